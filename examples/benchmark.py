@@ -0,0 +1,245 @@
+"""
+Throughput benchmarks of the solver, swept over the problems in
+pyfish.problems, the scheme options, resolutions, dimensions and thread counts.
+
+Each case sets up its problem as euler.py does, takes a few warm-up steps, and
+then times a number of Runge-Kutta steps, reporting
+
+    zone_updates_per_sec   interior zones advanced by a full step, per second
+    seconds_per_stage      wall time of a single Runge-Kutta stage
+    peak_memory_mb         high water mark of the resident memory
+
+Every case runs in a fresh interpreter, so that its peak memory is its own, and
+so that a case which fails or crashes is recorded without ending the sweep. The
+results are written as JSON, and may be compared against a baseline, a results
+file written earlier. Cases slower than the baseline by more than the
+tolerance, or whose peak memory grew by more than the memory tolerance, are
+flagged as regressions (the exit status is then 1). Cases missing from the
+baseline are listed as new. For example
+
+    python benchmark.py --dimensions 1,2 --resolutions 64,128 --output new.json
+    python benchmark.py --baseline old.json --tolerance 0.1 --output new.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import itertools
+import subprocess
+import numpy as np
+
+CASE_KEYS = ['problem', 'solver_type', 'reconstruction', 'riemann_solver',
+             'resolution', 'dimension', 'num_threads']
+
+
+def build_cases(problems, solver_types, reconstructions, riemann_solvers,
+                resolutions, dimensions, threads):
+    """
+    Returns the list of cases, dictionaries keyed by CASE_KEYS, in the outer
+    product of the options.
+    """
+    return [dict(zip(CASE_KEYS, values)) for values in itertools.product(
+            problems, solver_types, reconstructions, riemann_solvers,
+            resolutions, dimensions, threads)]
+
+
+def case_key(case):
+    return tuple(case[k] for k in CASE_KEYS)
+
+
+def peak_memory_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / float(1<<20 if sys.platform == 'darwin' else 1<<10)
+
+
+def run_case(case, steps=5, warmup=1, rk=3, CFL=0.3):
+    """
+    Runs a single case in this process, and returns its result: the case,
+    together with the measured rates.
+    """
+    import pyfish
+    from euler import MaraEvolutionOperator
+
+    resolution = [case['resolution']] * case['dimension']
+    problem = getattr(pyfish.problems, case['problem'])(resolution=resolution)
+    scheme = pyfish.FishSolver()
+    scheme.solver_type = case['solver_type']
+    scheme.reconstruction = case['reconstruction']
+    scheme.riemann_solver = case['riemann_solver']
+    scheme.num_threads = case['num_threads']
+
+    mara = MaraEvolutionOperator(problem, scheme)
+    mara.initial_model(problem.pinit, problem.ginit)
+    mara.boundary = problem.build_boundary(mara)
+
+    stages = [0]
+    dUdt = mara.dUdt
+    def counted(*args, **kwargs):
+        stages[0] += 1
+        return dUdt(*args, **kwargs)
+    mara.dUdt = counted
+
+    wall = 0.0
+    for n in range(warmup + steps):
+        if n == warmup:
+            stages[0] = 0
+        dt = CFL * mara.min_grid_spacing() / mara.max_wavespeed()
+        start = time.time()
+        mara.advance(dt, rk=rk)
+        if n >= warmup:
+            wall += time.time() - start
+
+    zones = np.prod(resolution)
+    result = dict(case)
+    result.update(status='ok',
+                  steps=steps,
+                  stages=stages[0],
+                  seconds=wall,
+                  seconds_per_step=wall / steps,
+                  seconds_per_stage=wall / max(stages[0], 1),
+                  zone_updates_per_sec=zones * steps / wall,
+                  peak_memory_mb=peak_memory_mb())
+    return result
+
+
+def run_isolated(case, steps=5, warmup=1, rk=3):
+    """
+    Runs a case in a new interpreter, returning its result, or the case with
+    status 'error' and the end of its error output if it failed.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    args = [sys.executable, os.path.join(here, 'benchmark.py'),
+            '--case', json.dumps(case), '--steps', str(steps),
+            '--warmup', str(warmup), '--rk', str(rk)]
+    proc = subprocess.Popen(args, cwd=here, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode == 0:
+        return json.loads(out.strip().splitlines()[-1])
+    result = dict(case)
+    result.update(status='error',
+                  error=(err.strip().splitlines() or ['exit status %d' %
+                                                      proc.returncode])[-1])
+    return result
+
+
+def compare(results, baseline, tolerance=0.1, memory_tolerance=None):
+    """
+    Compares each result with the baseline result of the same case. Returns a
+    list of (result, baseline result, ratio, memory_ratio, regressed) tuples,
+    one for every result. ratio is the new throughput over the baseline's, and
+    memory_ratio the new peak memory over the baseline's. regressed is True when
+    the ratio is below 1 - tolerance, or the memory ratio above 1 +
+    memory_tolerance (which defaults to tolerance). A case which ran in the
+    baseline and now fails has the ratio 0. A case with no successful baseline
+    run has None for the baseline result and both ratios, and is not counted as
+    a regression.
+    """
+    if memory_tolerance is None:
+        memory_tolerance = tolerance
+    old = dict((case_key(r), r) for r in baseline if r['status'] == 'ok')
+    rows = [ ]
+    for r in results:
+        b = old.get(case_key(r))
+        if b is None:
+            rows.append((r, None, None, None, False))
+            continue
+        if r['status'] != 'ok':
+            ratio, memory_ratio = 0.0, None
+        else:
+            ratio = r['zone_updates_per_sec'] / b['zone_updates_per_sec']
+            memory_ratio = r['peak_memory_mb'] / b['peak_memory_mb']
+        regressed = ratio < 1.0 - tolerance or (
+            memory_ratio is not None and memory_ratio > 1.0 + memory_tolerance)
+        rows.append((r, b, ratio, memory_ratio, regressed))
+    return rows
+
+
+def describe(case):
+    return "%-28s %-8s %-5s %-5s %5d^%d x%d" % tuple(case[k] for k in CASE_KEYS)
+
+
+def print_result(result):
+    if result['status'] == 'ok':
+        print "%s %10.1f kz/s %10.3f ms/stage %8.1f MB" % (
+            describe(result), result['zone_updates_per_sec'] * 1e-3,
+            result['seconds_per_stage'] * 1e3, result['peak_memory_mb'])
+    else:
+        print "%s   failed: %s" % (describe(result), result['error'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sweeps solver throughput over problems and schemes.")
+    strings = lambda s: s.split(',')
+    integers = lambda s: [int(x) for x in s.split(',')]
+    parser.add_argument('--problems', type=strings,
+                        default=['PeriodicDensityWave', 'BrioWuShocktube'])
+    parser.add_argument('--solver-types', type=strings,
+                        default=['godunov', 'spectral'])
+    parser.add_argument('--reconstructions', type=strings,
+                        default=['plm', 'weno5'])
+    parser.add_argument('--riemann-solvers', type=strings, default=['hllc'])
+    parser.add_argument('--resolutions', type=integers, default=[64, 128])
+    parser.add_argument('--dimensions', type=integers, default=[1, 2])
+    parser.add_argument('--threads', type=integers, default=[1])
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--rk', default=3,
+                        type=lambda s: int(s) if s.isdigit() else s)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--memory-tolerance', type=float, default=None)
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.case is not None:
+        result = run_case(json.loads(opts.case), opts.steps, opts.warmup,
+                          opts.rk)
+        print json.dumps(result)
+        return 0
+
+    cases = build_cases(opts.problems, opts.solver_types, opts.reconstructions,
+                        opts.riemann_solvers, opts.resolutions, opts.dimensions,
+                        opts.threads)
+    results = [ ]
+    for case in cases:
+        results.append(run_isolated(case, opts.steps, opts.warmup, opts.rk))
+        print_result(results[-1])
+
+    report = {'host': socket.gethostname(),
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'steps': opts.steps,
+              'rk': opts.rk,
+              'results': results}
+    with open(opts.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    regressions = 0
+    if opts.baseline is not None:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)['results']
+        print
+        print "compared with %s (tolerance %d%%):" % (opts.baseline,
+                                                      opts.tolerance * 100)
+        for r, b, ratio, memory_ratio, regressed in compare(
+                results, baseline, opts.tolerance, opts.memory_tolerance):
+            if b is None:
+                print "%s      new" % describe(r)
+                continue
+            memory = ("%6.2fx mem" % memory_ratio if memory_ratio is not None
+                      else "    -- mem")
+            print "%s %8.2fx %s %s" % (describe(r), ratio, memory,
+                                       'REGRESSION' if regressed else '')
+            regressions += regressed
+        print "%d regression(s)" % regressions
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,6 @@ import os
 import time
 import pstats
 import cProfile
-import cPickle
 import numpy as np
 import pyfluids
 import pyfish
@@ -20,7 +19,13 @@ class MaraEvolutionOperator(object):
         self.scheme = scheme
         self.driving = getattr(problem, 'driving', None)
         self.poisson_solver = getattr(problem, 'poisson_solver', None)
+        self.density_floor = 1e-6
         self.pressure_floor = 1e-6
+        self.zones_floored = 0
+        self.integrators = { }
+        self.checkpoint_writer = None
+        self.wavespeeds = np.zeros(3) # largest along each axis, last step
+        self.step_wavespeed = None
 
         if len(self.shape) == 1:
             Nx, Ny, Nz = self.fluid.shape + (1, 1)
@@ -58,35 +63,93 @@ class MaraEvolutionOperator(object):
             print "creating data directory", dir
         except OSError: # Directory exists
             pass
-        chkpt = { "prim": self.fluid.primitive, "status": status.__dict__ }
-        chkpt.update(extras)
-        chkpt_name = "%s/chkpt.%04d.pk" % (dir, status.chkpt_number)
-        chkpt_file = open(chkpt_name, 'w')
+        fields = { "prim": self.fluid.primitive }
+        if self.fluid.descriptor.ngravity:
+            fields["grav"] = self.fluid.gravity
+        attrs = { "status": status.__dict__ }
+        attrs.update(extras)
+        chkpt_name = "%s/chkpt.%04d.fish" % (dir, status.chkpt_number)
         print "Writing checkpoint", chkpt_name
-        cPickle.dump(chkpt, chkpt_file)
+        if self.checkpoint_writer is not None:
+            # the fields are fresh arrays, so the writer may keep them
+            self.checkpoint_writer.write(chkpt_name, fields, attrs, owned=True)
+        else:
+            pyfish.checkpoint.write_checkpoint(chkpt_name, fields, attrs)
+        return chkpt_name
 
-    def measure(self):
+    def read_checkpoint(self, chkpt_name, status=None):
+        """
+        Restores the fluid from a checkpoint written by write_checkpoint, and
+        the attributes of status if it is given. Returns the checkpoint, whose
+        attrs hold any extras it was written with.
+        """
+        chkpt = pyfish.checkpoint.read_checkpoint(chkpt_name)
+        P = chkpt["prim"]
+        if P.shape != self.shape + (self.fluid.descriptor.nprimitive,):
+            raise ValueError("checkpoint %s has shape %s, expected %s" % (
+                    chkpt_name, P.shape[:-1], self.shape))
+        self.fluid.primitive = np.array(P)
+        if "grav" in chkpt and self.fluid.descriptor.ngravity:
+            self.fluid.gravity = np.array(chkpt["grav"])
+        if status is not None:
+            status.__dict__.update(chkpt.attrs["status"])
+        return chkpt
+
+    def measure(self, chunk=1<<16):
+        """
+        Computes the diagnostics in a single pass over slabs of the grid along
+        its first axis of about chunk zones. All reductions of a slab are made
+        while its primitive and conserved arrays are held, so that no full-size
+        temporaries are created.
+        """
+        nzone = self.fluid.size
+        nslab = max(1, chunk * self.shape[0] // nzone)
+        kinetic = 0.0
+        density_max = -np.inf
+        density_min = np.inf
+        P_sum = np.zeros(5)
+        U_sum = np.zeros(5)
+        for i0 in range(0, self.shape[0], nslab):
+            S = self.fluid[i0:i0 + nslab]
+            P = S.primitive
+            U = S.conserved()
+            P = P.reshape(-1, P.shape[-1])
+            U = U.reshape(-1, U.shape[-1])
+            rho = P[:,0]
+            v = P[:,2:5]
+            kinetic += np.dot(rho, np.einsum('ij,ij->i', v, v))
+            density_max = max(density_max, rho.max())
+            density_min = min(density_min, rho.min())
+            P_sum += P[:,:5].sum(axis=0)
+            U_sum += U[:,:5].sum(axis=0)
         meas = { }
-        P = self.fluid.primitive
-        U = self.fluid.conserved()
-        rho = P[...,0]
-        vx = P[...,2]
-        vy = P[...,3]
-        vz = P[...,4]
-        meas["kinetic"] = (rho * (vx*vx + vy*vy + vz*vz)).mean()
-        meas["density_max"] = rho.max()
-        meas["density_min"] = rho.min()
-        meas["conserved_avg"] = [U[...,i].mean() for i in range(5)]
-        meas["primitive_avg"] = [P[...,i].mean() for i in range(5)]
+        meas["kinetic"] = kinetic / nzone
+        meas["density_max"] = density_max
+        meas["density_min"] = density_min
+        meas["conserved_avg"] = list(U_sum / nzone)
+        meas["primitive_avg"] = list(P_sum / nzone)
         return meas
 
+    def max_wavespeed(self):
+        """
+        Largest wave speed met by the flux sweeps over the stages of the last
+        step, or found from the eigenvalues of the fluid before the first one.
+        """
+        if self.step_wavespeed is None:
+            return abs(self.fluid.eigenvalues()).max()
+        return self.step_wavespeed
+
     def min_grid_spacing(self):
         return min([self.dx, self.dy, self.dz][:len(self.shape)])
 
     def number_guard_zones(self):
         return 3
 
-    def coordinate_grid(self):
+    def coordinate_axes(self):
+        """
+        Returns the zone center coordinates along the x, y and z axes, the
+        coordinate grid being their outer product.
+        """
         ng = self.number_guard_zones()
         Nx, Ny, Nz = self.Nx, self.Ny, self.Nz
         dx, dy, dz = self.dx, self.dy, self.dz
@@ -98,22 +161,62 @@ class MaraEvolutionOperator(object):
         if self.Nx > 1: x1 += ng * dx
         if self.Ny > 1: y1 += ng * dy
         if self.Nz > 1: z1 += ng * dz
-        return np.mgrid[x0+dx/2 : x1+dx/2 : dx,
-                        y0+dy/2 : y1+dy/2 : dy,
-                        z0+dz/2 : z1+dz/2 : dz]
+        # same values as the axes of np.mgrid[x0+dx/2 : x1+dx/2 : dx, ...]
+        axis = lambda a, b, d: np.arange(int(np.ceil((b - a) / d))) * d + a
+        return (axis(x0+dx/2, x1+dx/2, dx),
+                axis(y0+dy/2, y1+dy/2, dy),
+                axis(z0+dz/2, z1+dz/2, dz))
 
-    def initial_model(self, pinit, ginit=None):
+    @property
+    def geometry(self):
+        """
+        The pyfish.geometry.Geometry of the grid, guard zones included. It is
+        built on first use and kept until the grid changes, along with the
+        quantities derived from it.
+        """
+        key = (self.shape, tuple(self.X0), tuple(self.X1),
+               self.dx, self.dy, self.dz)
+        if getattr(self, '_geometry_key', None) != key:
+            self._geometry = pyfish.geometry.Geometry(*self.coordinate_axes())
+            self._geometry_key = key
+        return self._geometry
+
+    def coordinate_grid(self):
+        """
+        Returns a new dense coordinate grid. Prefer the axes, sparse views and
+        derived quantities of self.geometry, which are not rebuilt each time.
+        """
+        return self.geometry.grid()
+
+    def initial_model(self, pinit, ginit=None, chunk=1<<18):
+        """
+        Fills the primitive and gravitational fields from the initial
+        conditions pinit(x, y, z) and ginit(x, y, z), or from their array-valued
+        companions (see pyfish.problems.array_initializer) when those exist. The
+        grid is filled in slabs along the first axis of about chunk zones, so
+        that coordinates are only ever held for a single slab.
+        """
         npr = self.fluid.descriptor.nprimitive
         ngr = self.fluid.descriptor.ngravity
         if ginit is None: ginit = lambda x,y,z: np.zeros(ngr)
         shape = self.shape
-        X, Y, Z = self.coordinate_grid()
-        P = np.ndarray(
-            shape=shape + (npr,), buffer=np.array(
-                [pinit(x, y, z) for x, y, z in zip(X.flat, Y.flat, Z.flat)]))
-        G = np.ndarray(
-            shape=shape + (ngr,), buffer=np.array(
-                [ginit(x, y, z) for x, y, z in zip(X.flat, Y.flat, Z.flat)]))
+        x, y, z = self.geometry.axes
+        P = np.empty(shape + (npr,))
+        G = np.empty(shape + (ngr,))
+        fields = [(P, npr, pinit), (G, ngr, ginit)][:2 if ngr else 1]
+        nslab = max(1, chunk // (y.size * z.size))
+
+        for i0 in range(0, x.size, nslab):
+            i1 = min(i0 + nslab, x.size)
+            X, Y, Z = np.meshgrid(x[i0:i1], y, z, indexing='ij')
+            for F, nq, f in fields:
+                fa = pyfish.problems.array_initializer(f)
+                if fa is not None:
+                    Fs = fa(X, Y, Z)
+                else:
+                    Fs = np.array([f(xi, yi, zi) for xi, yi, zi in
+                                   zip(X.flat, Y.flat, Z.flat)])
+                F[i0:i1] = np.reshape(Fs, (i1 - i0,) + shape[1:] + (nq,))
         self.fluid.primitive = P
         self.fluid.gravity = G
 
@@ -125,32 +228,23 @@ class MaraEvolutionOperator(object):
         self.boundary.set_boundary(self.fluid.primitive, ng, field='prim')
 
     def advance(self, dt, rk=3):
+        """
+        rk is one of 1, 2, 3, 4 or the low-storage schemes 'ls3' and 'ls4', see
+        pyfish.integrators. Stages are done in place on the conserved array.
+        """
         start = time.clock()
-        U0 = self.fluid.conserved()
-        # RungeKuttaSingleStep
-        if rk == 1:
-            U1 = U0 + dt * self.dUdt(U0)
-        # RungeKuttaRk2Tvd
-        if rk == 2:
-            U1 =      U0 +      dt*self.dUdt(U0)
-            U1 = 0.5*(U0 + U1 + dt*self.dUdt(U1))
-        # RungeKuttaShuOsherRk3
-        if rk == 3:
-            U1 =      U0 +                  dt * self.dUdt(U0)
-            U1 = 3./4*U0 + 1./4*U1 + 1./4 * dt * self.dUdt(U1)
-            U1 = 1./3*U0 + 2./3*U1 + 2./3 * dt * self.dUdt(U1)
-        # RungeKuttaClassicRk4
-        if rk == 4:
-            L1 = self.dUdt(U0)
-            L2 = self.dUdt(U0 + (0.5*dt) * L1)
-            L3 = self.dUdt(U0 + (0.5*dt) * L2)
-            L4 = self.dUdt(U0 + (1.0*dt) * L3)
-            U1 = U0 + dt * (L1 + 2.0*L2 + 2.0*L3 + L4) / 6.0
+        if rk not in self.integrators:
+            self.integrators[rk] = pyfish.integrators.build_integrator(rk)
+        U1 = self.fluid.conserved()
+        self.wavespeeds[...] = 0.0
+        self.integrators[rk].advance(U1, dt, self.dUdt)
+        self.step_wavespeed = self.wavespeeds.max()
 
         try:
             ng = self.number_guard_zones()
-            S = self.driving.source_terms(self.fluid.primitive[ng:-ng,ng:-ng])
-            U1[ng:-ng,ng:-ng] += S * dt
+            interior = (slice(ng, -ng),) * len(self.shape)
+            S = self.driving.source_terms(self.fluid.primitive[interior])
+            U1[interior] += S * dt
             self.driving.advance(dt)
         except AttributeError:
             # no driving module
@@ -158,36 +252,33 @@ class MaraEvolutionOperator(object):
 
         ng = self.number_guard_zones()
         self.boundary.set_boundary(U1, ng)
-        self.fluid.from_conserved(U1)
+        self.from_conserved(U1)
         return time.clock() - start
 
-    def dUdt(self, U):
+    def from_conserved(self, U):
+        """
+        Recovers the primitive variables from U in a single native pass, raising
+        zones below the density or pressure floor to it (and rewriting them in
+        U) rather than stopping the run.
+        """
+        self.scheme.density_floor = self.density_floor
+        self.scheme.pressure_floor = self.pressure_floor
+        self.zones_floored += self.scheme.from_conserved(self.fluid, U)
+
+    def dUdt(self, U, out=None):
         ng = self.number_guard_zones()
         dx = [self.dx, self.dy, self.dz]
         self.boundary.set_boundary(U, ng)
-        self.fluid.from_conserved(U)
-
-        if (U[...,0] < 0.0).any():
-            raise RuntimeError("negative density (conserved)")
-        if (U[...,1] < 0.0).any():
-            raise RuntimeError("negative energy")
-        self.fluid.from_conserved(U)
-        P = self.fluid.primitive
-        if (P[...,0] < 0.0).any():
-            raise RuntimeError("negative density (primitive)")
-        if (P[...,1] < 0.0).any():
-            #print P[P[...,1] < 0, 1]
-            #P[P[...,1] < 0, 1] = 0.0#-1*P[P[...,1] < 0, 1]
-            #print "set pressure floor on some zones"
-            raise RuntimeError("negative pressure")
+        self.from_conserved(U)
 
         self.update_gravity()
-        L = self.scheme.time_derivative(self.fluid, dx)
+        a = np.zeros(3)
+        L = self.scheme.time_derivative(self.fluid, dx, ng=ng, out=out,
+                                        wavespeeds=a)
+        np.maximum(self.wavespeeds, a, out=self.wavespeeds)
         if self.fluid.descriptor.fluid in ['gravp', 'gravs']:
-            S = self.fluid.source_terms()
-            return L + S
-        else:
-            return L
+            L += self.fluid.source_terms()
+        return L
 
 
     def update_gravity(self):
@@ -195,7 +286,8 @@ class MaraEvolutionOperator(object):
         Notes:
         ------
 
-        (1) Only works in 1d for now.
+        (1) The solution is written directly into the interior of the gravity
+        array, whose guard zones are then filled, in 1d, 2d or 3d.
 
         (2) To see the bug introduced by not accounting for the background
         density, do
@@ -205,15 +297,16 @@ class MaraEvolutionOperator(object):
         """
         if self.poisson_solver is None:
             return
-        if len(self.shape) > 1:
-            raise NotImplementedError
         try:
             ng = self.number_guard_zones()
-            G, rhobar = self.poisson_solver.solve(self.fields['rho'][ng:-ng],
-                                                  retrhobar=True)
+            interior = (slice(ng, -ng),) * len(self.shape)
+            G = self.fluid.gravity
+            rhobar = self.poisson_solver.solve(self.fields['rho'][interior],
+                                               retrhobar=True,
+                                               out=G[interior])[1]
             self.fluid.descriptor.rhobar = rhobar
-            self.fluid.gravity[ng:-ng] = G
-            self.boundary.set_boundary(self.fluid.gravity, ng, field='grav')
+            self.boundary.set_boundary(G, ng, field='grav')
+            self.fluid.gravity = G
 
         except AttributeError: # no poisson_solver
             pass
@@ -232,6 +325,155 @@ class MaraEvolutionOperator(object):
         plt.show()
 
 
+class DecomposedEvolution(object):
+    """
+    Advances the fluid of mara with its domain split along x into nblocks
+    slabs, each owned by a worker process (see pyfish.decomposition). The
+    conserved variables of each slab, with its guard zones, live in shared
+    memory. Each Runge-Kutta stage fills the guard zones of a slab from the
+    edges of its neighbors, or from mara.boundary on the faces of the domain,
+    and then calls FishSolver.time_derivative on the slab alone.
+
+    A static gravitational field is scattered into shared slabs along with
+    the conserved variables, guard zones included, so that each worker sees
+    the field which the whole fluid holds. The fluid of mara is only brought up
+    to date by gather. Self-gravity and driving act on the whole domain and are
+    not supported.
+    """
+    def __init__(self, mara, nblocks):
+        if mara.poisson_solver is not None or mara.driving is not None:
+            raise ValueError("self-gravity and driving need the whole domain")
+        ng = mara.number_guard_zones()
+        nq = mara.fluid.descriptor.nprimitive
+        ngr = mara.fluid.descriptor.ngravity
+        self.mara = mara
+        self.ng = ng
+        self.faces = mara.boundary.faces(len(mara.shape))
+        self.decomposition = pyfish.decomposition.SlabDecomposition(
+            mara.shape, ng, nblocks)
+        self.blocks = [pyfish.decomposition.shared_array(s + (nq,))
+                       for s in self.decomposition.block_shapes]
+        U = mara.fluid.conserved()
+        mara.boundary.set_boundary(U, ng)
+        self.decomposition.scatter(U, self.blocks)
+        self.gravity = None
+        if ngr:
+            self.gravity = [pyfish.decomposition.shared_array(s + (ngr,))
+                            for s in self.decomposition.block_shapes]
+            self.decomposition.scatter(mara.fluid.gravity, self.gravity)
+        self._fluid = None # the slab of the worker, made in the worker
+        self._max_wavespeed = None
+        self.barrier = pyfish.decomposition.Barrier(nblocks)
+        self.workers = pyfish.decomposition.BlockWorkers(nblocks, self._handle,
+                                                         self.barrier)
+
+    def close(self):
+        self.workers.close()
+
+    def advance(self, dt, rk=3):
+        start = time.time()
+        results = self.workers.run('advance', dt, rk)
+        self.mara.zones_floored += sum(r[0] for r in results)
+        self._max_wavespeed = max(r[1] for r in results)
+        return time.time() - start
+
+    def max_wavespeed(self):
+        """
+        Largest wave speed over all slabs, met by the flux sweeps of the last
+        step when there was one.
+        """
+        if self._max_wavespeed is None:
+            self._max_wavespeed = max(self.workers.run('wavespeed'))
+        return self._max_wavespeed
+
+    def gather(self):
+        """
+        Copies the slabs back into the fluid of mara, and fills its guard
+        zones.
+        """
+        U = np.empty(self.mara.shape + (self.mara.fluid.descriptor.nprimitive,))
+        self.decomposition.gather(self.blocks, U)
+        self.mara.boundary.set_boundary(U, self.ng)
+        zones_floored = self.mara.zones_floored
+        self.mara.from_conserved(U)
+        self.mara.zones_floored = zones_floored
+
+    # -------------------------------------------------------------------------
+    # The methods below run in the worker processes
+    # -------------------------------------------------------------------------
+    def _handle(self, b, command, *args):
+        if self._fluid is None:
+            self._fluid = pyfluids.FluidStateVector(
+                self.decomposition.block_shapes[b], self.mara.fluid.descriptor)
+            if self.gravity is not None:
+                self._fluid.gravity = self.gravity[b]
+            self._integrators = { }
+            self._zones_floored = 0
+        return getattr(self, '_' + command)(b, *args)
+
+    def _advance(self, b, dt, rk):
+        if rk not in self._integrators:
+            self._integrators[rk] = pyfish.integrators.build_integrator(rk)
+        self._zones_floored = 0
+        self._wavespeeds = np.zeros(3)
+        self._integrators[rk].advance(self.blocks[b], dt,
+                                      lambda U, out=None: self._dUdt(b, U, out))
+        self._synchronize(b)
+        return self._zones_floored, self._wavespeeds.max()
+
+    def _synchronize(self, b):
+        """
+        Fills the guard zones of block b once every worker has finished its
+        last update, and recovers the primitive variables. The second wait
+        keeps the neighbors from updating the edges before they have been
+        copied. Guard zones between two blocks are not counted towards the zones
+        floored, as they are counted by the block owning them.
+        """
+        mara = self.mara
+        ng = self.ng
+        U = self.blocks[b]
+        self.barrier.wait()
+        faces = list(self.faces)
+        inflow = [mara.boundary.inflow.get(('cons', n))
+                  for n in range(len(faces))]
+        lower, upper = self.decomposition.neighbors(
+            b, periodic=faces[0] == 'periodic')
+        if lower is not None:
+            B = self.blocks[lower]
+            faces[0], inflow[0] = 'inflow', B[B.shape[0] - 2*ng:B.shape[0] - ng]
+        if upper is not None:
+            faces[1], inflow[1] = 'inflow', self.blocks[upper][ng:2*ng]
+        pyfish.fish.fill_guards(U, ng, faces, inflow)
+        self.barrier.wait()
+        n = U.shape[0]
+        i0 = ng if b > 0 else 0
+        i1 = n - ng if b < self.decomposition.nblocks - 1 else n
+        mara.scheme.density_floor = mara.density_floor
+        mara.scheme.pressure_floor = mara.pressure_floor
+        self._zones_floored += mara.scheme.from_conserved(self._fluid[i0:i1],
+                                                          U[i0:i1])
+        for j0, j1 in [(0, i0), (i1, n)]:
+            if j1 > j0:
+                mara.scheme.from_conserved(self._fluid[j0:j1], U[j0:j1])
+
+    def _dUdt(self, b, U, out=None):
+        mara = self.mara
+        dx = [mara.dx, mara.dy, mara.dz]
+        self._synchronize(b)
+        a = np.zeros(3)
+        L = mara.scheme.time_derivative(self._fluid, dx, ng=self.ng, out=out,
+                                        wavespeeds=a)
+        np.maximum(self._wavespeeds, a, out=self._wavespeeds)
+        if self._fluid.descriptor.fluid in ['gravp', 'gravs']:
+            L += self._fluid.source_terms()
+        return L
+
+    def _wavespeed(self, b):
+        ng = self.ng
+        self._synchronize(b)
+        return abs(self._fluid[ng:-ng].eigenvalues()).max()
+
+
 class SimulationStatus:
     pass
 
@@ -243,6 +485,7 @@ def main():
     #problem = pyfish.problems.OneDimensionalPolytrope(selfgrav=True, **problem_cfg)
     problem = pyfish.problems.PeriodicDensityWave(**problem_cfg)
     #problem = pyfish.problems.DrivenTurbulence2d(tfinal=0.01)
+    #problem = pyfish.problems.DrivenTurbulence3d(tfinal=0.01)
 
     # Status setup
     status = SimulationStatus()
@@ -253,7 +496,10 @@ def main():
     status.chkpt_number = 0
     status.chkpt_last = 0.0
     status.chkpt_interval = 1.0
-    measlog = { }
+    data_dir = "data/test"
+    measure_cadence = pyfish.diagnostics.Cadence(steps=1, interval=None)
+    restart = None # name of a checkpoint file to restart from
+    num_blocks = 1 # > 1 splits the domain among that many worker processes
 
     # Plotting options
     plot_fields = problem.plot_fields
@@ -270,9 +516,27 @@ def main():
     scheme.smoothness_indicator = ["jiangshu96", "borges08", "shenzha10"][2]
 
     mara = MaraEvolutionOperator(problem, scheme)
-    mara.initial_model(problem.pinit, problem.ginit)
+    mara.checkpoint_writer = pyfish.checkpoint.CheckpointWriter(codec='zlib')
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    if restart is None:
+        mara.initial_model(problem.pinit, problem.ginit)
+        measlog = pyfish.diagnostics.DiagnosticsLog(
+            "%s/diagnostics.log" % data_dir, mode='w')
+    else:
+        chkpt = mara.read_checkpoint(restart, status)
+        pointer = chkpt.attrs["diagnostics"]
+        measlog = pyfish.diagnostics.DiagnosticsLog(pointer["filename"])
+        measlog.truncate(pointer)
     mara.boundary = problem.build_boundary(mara)
 
+    if num_blocks > 1:
+        evolution = DecomposedEvolution(mara, num_blocks)
+        synchronize = evolution.gather
+    else:
+        evolution = mara
+        synchronize = lambda: None
+
     if plot_interactive:
         import matplotlib.pyplot as plt
         plt.ion()
@@ -283,14 +547,15 @@ def main():
 
     while status.time_current < problem.tfinal:
         if plot_interactive:
+            synchronize()
             for f in plot_fields:
                 lines[f].set_ydata(mara.fields[f])
             plt.draw()
 
-        ml = abs(mara.fluid.eigenvalues()).max()
+        ml = evolution.max_wavespeed()
         dt = status.CFL * mara.min_grid_spacing() / ml
         try:
-            wall_step = 1e-10 +  mara.advance(dt, rk=3)
+            wall_step = 1e-10 +  evolution.advance(dt, rk=3)
         except RuntimeError as e:
             print e
             break
@@ -305,14 +570,23 @@ def main():
             (wall_step / (mara.fluid.size*5)) * 1e6)
 
         if status.time_current - status.chkpt_last > status.chkpt_interval:
-            mara.write_checkpoint(status, dir="data/test", update_status=True,
-                                  measlog=measlog)
-
-        measlog[status.iteration] = mara.measure()
-        measlog[status.iteration]["time"] = status.time_current
-        measlog[status.iteration]["message"] = status.message
+            synchronize()
+            mara.write_checkpoint(status, dir=data_dir, update_status=True,
+                                  diagnostics=measlog.pointer())
+
+        if measure_cadence.due(status.iteration, status.time_current):
+            synchronize()
+            meas = mara.measure()
+            meas["message"] = status.message
+            meas["zones_floored"] = mara.zones_floored
+            measlog.append(status.iteration, status.time_current, meas)
         print status.message
 
+    synchronize()
+    if evolution is not mara:
+        evolution.close()
+    measlog.close()
+    mara.checkpoint_writer.close()
     mara.set_boundary()
     if plot_final:
         plot(mara, plot_fields, show=True, label='end')
@@ -321,7 +595,7 @@ def main():
 def plot1d(mara, fields, show=True, **kwargs):
     import matplotlib.pyplot as plt
     lines = { }
-    x, y, z = mara.coordinate_grid()
+    x, y, z = mara.geometry.axes
     try:
         axes = plot1d.axes
     except:
@@ -329,7 +603,7 @@ def plot1d(mara, fields, show=True, **kwargs):
         axes = plot1d.axes
 
     for ax, f in zip(axes, fields):
-        lines[f], = ax.plot(x.flat, mara.fields[f], '-o', mfc='none', label=(
+        lines[f], = ax.plot(x, mara.fields[f], '-o', mfc='none', label=(
                 f + ' ' + kwargs.get('label', '')))
     if show:
         for ax in axes:
@@ -347,7 +621,6 @@ def plot1d(mara, fields, show=True, **kwargs):
 def plot2d(mara, fields, show=True, **kwargs):
     import matplotlib.pyplot as plt
     lines = { }
-    x, y, z = mara.coordinate_grid()
     ng = mara.number_guard_zones()
     try:
         axes = plot2d.axes
@@ -368,7 +641,6 @@ def plot2d(mara, fields, show=True, **kwargs):
 def plot3d(mara, fields, show=True, **kwargs):
     import matplotlib.pyplot as plt
     lines = { }
-    x, y, z = mara.coordinate_grid()
     ng = mara.number_guard_zones()
     try:
         axes = plot2d.axes
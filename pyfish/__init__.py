@@ -5,3 +5,8 @@ import pyfish.gravity
 import pyfish.boundary
 import pyfish.problems
 import pyfish.driving
+import pyfish.integrators
+import pyfish.checkpoint
+import pyfish.diagnostics
+import pyfish.decomposition
+import pyfish.geometry
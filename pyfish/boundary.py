@@ -1,82 +1,59 @@
-
 import numpy as np
+from pyfish.fish import fill_guards
 
 
 class BoundaryConditions(object):
-    def set_boundary(self, X, ng, field='cons'):
-        getattr(self, "set_boundary%dd" % (len(X.shape) - 1))(X, ng, field)
-
-    def set_boundary1d(self, *args, **kwargs):
-        raise NotImplementedError
+    """
+    Fills the ng guard zones of the arrays given to set_boundary in a single
+    native pass (see pyfish.fish.fill_guards), writing only the guard layers.
+    Each face has its own condition, 'periodic', 'outflow' or 'inflow', given
+    for each axis either as a single condition for both faces or as a (lower,
+    upper) pair. Axes which are not given use the class default, e.g.
+
+        BoundaryConditions(x='periodic', y=('outflow', 'outflow'))
+
+    Periodic faces must come in pairs. The values held on inflow faces are kept
+    in self.inflow, under the key (field, face) where face is 2*axis for the
+    lower and 2*axis + 1 for the upper face of an axis.
+    """
+    default = 'outflow'
+
+    def __init__(self, x=None, y=None, z=None):
+        self.axes = [x, y, z]
+        self.inflow = { }
+
+    def faces(self, ndim):
+        faces = [ ]
+        for c in self.axes[:ndim]:
+            c = self.default if c is None else c
+            faces += [c, c] if isinstance(c, str) else list(c)
+        return faces
 
-    def set_boundary2d(self, *args, **kwargs):
-        raise NotImplementedError
-
-    def set_boundary3d(self, *args, **kwargs):
-        raise NotImplementedError
+    def set_boundary(self, X, ng, field='cons'):
+        faces = self.faces(len(X.shape) - 1)
+        inflow = [self.inflow.get((field, n)) for n in range(len(faces))]
+        fill_guards(X, ng, faces, inflow)
 
 
 class Outflow(BoundaryConditions):
-    def __init__(self):
-        pass
-
-    def set_boundary1d(self, X, ng, field):
-        X[:+ng] = X[+(ng+0)]
-        X[-ng:] = X[-(ng+1)]
-
-    def set_boundary2d(self, X, ng, field):
-        X[:,:+ng] = X[:,+(ng+0)][:,np.newaxis,:]
-        X[:,-ng:] = X[:,-(ng+1)][:,np.newaxis,:]
-        X[:+ng,:] = X[+(ng+0),:][np.newaxis,:,:]
-        X[-ng:,:] = X[-(ng+1),:][np.newaxis,:,:]
-
-    def set_boundary3d(self, X, ng, field):
-        X[:,:,:+ng] = X[:,:,+(ng+0)][:,:,np.newaxis,:]
-        X[:,:,-ng:] = X[:,:,-(ng+1)][:,:,np.newaxis,:]
-        X[:,:+ng,:] = X[:,+(ng+0),:][:,np.newaxis,:,:]
-        X[:,-ng:,:] = X[:,-(ng+1),:][:,np.newaxis,:,:]
-        X[:+ng,:,:] = X[+(ng+0),:,:][np.newaxis,:,:,:]
-        X[-ng:,:,:] = X[-(ng+1),:,:][np.newaxis,:,:,:]
+    default = 'outflow'
 
 
 class Periodic(BoundaryConditions):
-    def __init__(self):
-        pass
-
-    def set_boundary1d(self, X, ng, field):
-        X[:+ng] = X[-2*ng:-ng]
-        X[-ng:] = X[+ng:+2*ng]
+    default = 'periodic'
 
-    def set_boundary2d(self, X, ng, field):
-        X[:+ng,:] = X[-2*ng:-ng,:]
-        X[-ng:,:] = X[+ng:+2*ng,:]
-        X[:,:+ng] = X[:,-2*ng:-ng]
-        X[:,-ng:] = X[:,+ng:+2*ng]
 
-    def set_boundary3d(self, X, ng, field):
-        X[:+ng,:,:] = X[-2*ng:-ng,:,:]
-        X[-ng:,:,:] = X[+ng:+2*ng,:,:]
-        X[:,:+ng,:] = X[:,-2*ng:-ng,:]
-        X[:,-ng:,:] = X[:,+ng:+2*ng,:]
-        X[:,:,:+ng] = X[:,:,-2*ng:-ng]
-        X[:,:,-ng:] = X[:,:,+ng:+2*ng]
-
-
-"""
 class Inflow(BoundaryConditions):
-    def __init__(self, SL, SR):
-        self.UL = np.array([S.conserved() for S in SL])
-        self.UR = np.array([S.conserved() for S in SR])
-        self.GL = np.array([S.gravity.copy() for S in SL])
-        self.GR = np.array([S.gravity.copy() for S in SR])
-
-    def set_boundary1d(self, mara):
-        ng = mara.number_guard_zones()
-        U = mara.fluid.conserved()
-        G = mara.fluid.gravity
-        U[:+ng] = self.UL
-        U[-ng:] = self.UR
-        G[:+ng] = self.GL
-        G[-ng:] = self.GR
-        mara.fluid.from_conserved(U)
-"""
+    """
+    Holds the guard zones on both faces of the x axis at the values of the
+    fluid states SL and SR, e.g. mara.fluid[:ng] and mara.fluid[-ng:], when the
+    boundary is built. The primitive, conserved and gravitational fields are
+    each held. Other axes take the conditions given for them, outflow by
+    default.
+    """
+    def __init__(self, SL, SR, y=None, z=None):
+        super(Inflow, self).__init__(x='inflow', y=y, z=z)
+        for n, S in enumerate([SL, SR]):
+            self.inflow['prim', n] = np.array(S.primitive)
+            self.inflow['cons', n] = np.array(S.conserved())
+            self.inflow['grav', n] = np.array(S.gravity)
@@ -0,0 +1,282 @@
+"""
+Chunked checkpoint files which can be memory mapped.
+
+Layout of a checkpoint file:
+
+    [0:8]    magic string 'FISHCHK1'
+    [8:16]   offset of the header (little-endian uint64)
+    [16:24]  length of the header
+    ...      field data, each field written as a sequence of chunks, which are
+             slabs along its first axis, each of them encoded with the field's
+             codec: raw fields start on ALIGN byte boundaries
+    ...      header, a pickled dictionary:
+
+    {'version': 1,
+     'fields': {name: {'dtype': dtype string,
+                       'shape': shape tuple,
+                       'codec': 'raw', 'zlib' or 'bz2',
+                       'chunks': [(i0, i1, offset, nbytes), ...]}},
+     'attrs': {name: any picklable object}}
+
+The chunks of a raw field are contiguous, so that the whole field can be mapped
+as a single array. Chunks of compressed fields are compressed independently, so
+that a slab is read by decompressing only the chunks overlapping it. Only the
+header is read when a checkpoint is opened, fields and slabs of them are mapped
+or decompressed on demand.
+"""
+
+import os
+import copy
+import struct
+import cPickle
+import threading
+import Queue
+import zlib
+import bz2
+import multiprocessing.pool
+import numpy as np
+
+MAGIC = 'FISHCHK1'
+VERSION = 1
+ALIGN = 4096
+PREFIX = struct.Struct('<8sQQ')
+
+
+# Both compressors release the GIL, so chunks compress in parallel on threads
+_compress = {'zlib': lambda data, level: zlib.compress(data, level),
+             'bz2' : lambda data, level: bz2.compress(data, level)}
+_decompress = {'zlib': zlib.decompress,
+               'bz2' : bz2.decompress}
+_levels = {'zlib': 6, 'bz2': 9}
+
+
+def _aligned(n, align=ALIGN):
+    return (n + align - 1) // align * align
+
+
+def _slabs(A, nrow):
+    for i0 in range(0, A.shape[0], nrow):
+        i1 = min(i0 + nrow, A.shape[0])
+        yield i0, i1, np.ascontiguousarray(A[i0:i1])
+
+
+def write_checkpoint(filename, fields, attrs=None, chunk_bytes=1<<22,
+                     codec='raw', level=None, pool=None):
+    """
+    Writes the arrays in the dictionary fields, and the picklable objects in
+    attrs, to a new checkpoint file. Each field is written in slabs along its
+    first axis of about chunk_bytes, so no copy of a whole field is made. The
+    file is written under a temporary name and moved into place when complete.
+
+    codec is one of 'raw', 'zlib' or 'bz2'. Compressed chunks are produced on
+    the threads of pool (a multiprocessing.pool.ThreadPool) if one is given,
+    and written in order as they complete.
+    """
+    if codec != 'raw' and codec not in _compress:
+        raise ValueError("unknown codec %s" % codec)
+    if level is None:
+        level = _levels.get(codec)
+    header = {'version': VERSION, 'fields': { }, 'attrs': attrs or { }}
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, 0, 0))
+        for name, A in sorted(fields.items()):
+            A = np.asarray(A)
+            if A.ndim == 0:
+                A = A.reshape(1)
+            row = A[0:1].nbytes or 1
+            nrow = max(1, chunk_bytes // row)
+            chunks = [ ]
+            if codec == 'raw':
+                f.seek(_aligned(f.tell()))
+                for i0, i1, data in _slabs(A, nrow):
+                    chunks.append((i0, i1, f.tell(), data.nbytes))
+                    f.write(data.data)
+            else:
+                compress = _compress[codec]
+                encode = lambda s: (s[0], s[1], compress(s[2].data, level))
+                imap = pool.imap if pool is not None else map
+                for i0, i1, data in imap(encode, _slabs(A, nrow)):
+                    chunks.append((i0, i1, f.tell(), len(data)))
+                    f.write(data)
+            header['fields'][name] = {'dtype': A.dtype.str,
+                                      'shape': A.shape,
+                                      'codec': codec,
+                                      'chunks': chunks}
+        hoffset = f.tell()
+        hstring = cPickle.dumps(header, cPickle.HIGHEST_PROTOCOL)
+        f.write(hstring)
+        f.seek(0)
+        f.write(PREFIX.pack(MAGIC, hoffset, len(hstring)))
+    os.rename(tmpname, filename)
+
+
+class Checkpoint(object):
+    """
+    Read access to a checkpoint file. Only the header is read on construction:
+
+        chkpt = Checkpoint('chkpt.0001.fish')
+        chkpt.attrs['status']        # picklable objects saved with the fields
+        chkpt['prim']                # memory mapped field
+        chkpt.slab('prim', 10, 20)   # memory mapped slab prim[10:20]
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, hoffset, hlength = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                raise IOError("%s is not a fish checkpoint" % filename)
+            f.seek(hoffset)
+            header = cPickle.loads(f.read(hlength))
+        if header['version'] > VERSION:
+            raise IOError("%s has unsupported checkpoint version %d" % (
+                    filename, header['version']))
+        self.header = header
+        self.attrs = header['attrs']
+
+    @property
+    def fields(self):
+        return sorted(self.header['fields'].keys())
+
+    def __contains__(self, name):
+        return name in self.header['fields']
+
+    def __getitem__(self, name):
+        return self.field(name)
+
+    def field(self, name):
+        """
+        Returns the whole field, memory mapped read-only if it is raw.
+        """
+        entry = self.header['fields'][name]
+        return self.slab(name, 0, entry['shape'][0])
+
+    def slab(self, name, i0, i1):
+        """
+        Returns the slab field[i0:i1] of the field, memory mapped read-only if
+        the field is raw. Otherwise the chunks overlapping the slab are
+        decompressed into a new array.
+        """
+        entry = self.header['fields'][name]
+        shape = tuple(entry['shape'])
+        dtype = np.dtype(entry['dtype'])
+        codec = entry['codec']
+        if codec != 'raw' and codec not in _decompress:
+            raise IOError("unknown codec %s for field %s" % (codec, name))
+        i0, i1, _ = slice(i0, i1).indices(shape[0])
+        i1 = max(i0, i1)
+        if i1 == i0 or 0 in shape:
+            return np.empty((i1 - i0,) + shape[1:], dtype=dtype)
+        if codec != 'raw':
+            return self._decompressed_slab(entry, i0, i1)
+        offset = entry['chunks'][0][2] + i0 * dtype.itemsize * int(
+            np.prod(shape[1:]))
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset,
+                         shape=(i1 - i0,) + shape[1:])
+
+    def _decompressed_slab(self, entry, i0, i1):
+        shape = tuple(entry['shape'])
+        dtype = np.dtype(entry['dtype'])
+        decompress = _decompress[entry['codec']]
+        S = np.empty((i1 - i0,) + shape[1:], dtype=dtype)
+        with open(self.filename, 'rb') as f:
+            for c0, c1, offset, nbytes in entry['chunks']:
+                if c1 <= i0 or c0 >= i1:
+                    continue
+                f.seek(offset)
+                C = np.frombuffer(decompress(f.read(nbytes)), dtype=dtype)
+                C = C.reshape((c1 - c0,) + shape[1:])
+                j0, j1 = max(c0, i0), min(c1, i1)
+                S[j0 - i0:j1 - i0] = C[j0 - c0:j1 - c0]
+        return S
+
+
+def read_checkpoint(filename):
+    return Checkpoint(filename)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread, so that the caller only waits
+    for a snapshot of the fields to be taken:
+
+        writer = CheckpointWriter(codec='zlib', num_threads=4)
+        writer.write('chkpt.0001.fish', fields, attrs)   # returns once copied
+        ...
+        writer.close()                                    # waits for the rest
+
+    Each field is copied once when it is submitted and attrs are deep copied,
+    so the caller may go on modifying them. Fields which the caller has just
+    made for the checkpoint may instead be handed over with owned=True, and are
+    then queued as they are; the caller must not modify them afterwards. The
+    chunks of a checkpoint are compressed in parallel on a pool of num_threads
+    threads. At most max_pending snapshots wait behind the one being written;
+    write blocks until there is room, which bounds the memory held by the
+    writer to max_pending + 1 snapshots. An exception raised while writing is
+    re-raised by the next call to write, flush or close.
+    """
+    def __init__(self, codec='zlib', level=None, num_threads=4, max_pending=1,
+                 chunk_bytes=1<<22):
+        if codec != 'raw' and codec not in _compress:
+            raise ValueError("unknown codec %s" % codec)
+        self.codec = codec
+        self.level = level
+        self.chunk_bytes = chunk_bytes
+        self._pool = multiprocessing.pool.ThreadPool(num_threads)
+        self._queue = Queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, filename, fields, attrs=None, owned=False):
+        self._raise_error()
+        if self._thread is None:
+            raise ValueError("write to a closed CheckpointWriter")
+        snapshot = dict((name, np.asarray(A) if owned else np.array(A))
+                        for name, A in fields.items())
+        self._queue.put((filename, snapshot, copy.deepcopy(attrs)))
+
+    def flush(self):
+        """
+        Waits until every submitted checkpoint has been written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.join()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._pool.close()
+            self._pool.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                filename, fields, attrs = item
+                write_checkpoint(filename, fields, attrs,
+                                 chunk_bytes=self.chunk_bytes,
+                                 codec=self.codec, level=self.level,
+                                 pool=self._pool)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
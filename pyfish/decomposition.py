@@ -0,0 +1,173 @@
+"""
+Domain decomposition across local worker processes sharing memory.
+
+The grid is split along its first axis into slabs, each owned by a worker
+process. The data of each slab lives in a shared array, allocated before the
+workers are forked, so that every worker sees the slabs of its neighbors and
+copies their edges into its own guard zones directly, without any pickling.
+Python 2 has no multiprocessing.shared_memory, so shared arrays are
+sharedctypes.RawArray buffers viewed through numpy. The workers step in
+lockstep through a Barrier, and only small command and result tuples travel
+through the pipes connecting them to the parent process.
+"""
+
+import ctypes
+import traceback
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy as np
+
+
+def shared_array(shape):
+    """
+    Returns a zeroed double array of the given shape, whose memory is shared
+    with the processes forked after it was allocated.
+    """
+    raw = multiprocessing.sharedctypes.RawArray(ctypes.c_double,
+                                                int(np.prod(shape)))
+    return np.frombuffer(raw, dtype=np.double).reshape(shape)
+
+
+class Barrier(object):
+    """
+    Reusable barrier for a fixed number of processes (Python 2 has no
+    multiprocessing.Barrier). A process which fails should call abort, so that
+    the others raise RuntimeError from wait rather than waiting forever.
+    """
+    def __init__(self, parties):
+        self.parties = parties
+        self._cond = multiprocessing.Condition()
+        self._count = multiprocessing.RawValue('i', 0)
+        self._generation = multiprocessing.RawValue('i', 0)
+        self._broken = multiprocessing.RawValue('i', 0)
+
+    def wait(self):
+        with self._cond:
+            if self._broken.value:
+                raise RuntimeError("barrier was aborted")
+            generation = self._generation.value
+            self._count.value += 1
+            if self._count.value == self.parties:
+                self._count.value = 0
+                self._generation.value += 1
+                self._cond.notify_all()
+                return
+            while (generation == self._generation.value and
+                   not self._broken.value):
+                self._cond.wait()
+            if generation == self._generation.value:
+                raise RuntimeError("barrier was aborted")
+
+    def abort(self):
+        with self._cond:
+            self._broken.value = 1
+            self._cond.notify_all()
+
+
+class SlabDecomposition(object):
+    """
+    Splits the interior of the first axis of a grid of the given shape, which
+    includes ng guard zones on either side of each axis, into nblocks slabs of
+    nearly equal size. Block b owns the zones bounds[b][0] <= i < bounds[b][1]
+    of the global grid, and holds them together with ng guard zones on either
+    side, in an array of shape block_shapes[b] + (Q,).
+    """
+    def __init__(self, shape, ng, nblocks):
+        n = shape[0] - 2 * ng
+        if nblocks < 1 or n // nblocks < max(ng, 1):
+            raise ValueError("cannot split %d zones into %d blocks of at least "
+                             "%d zones" % (n, nblocks, max(ng, 1)))
+        self.shape = tuple(shape)
+        self.ng = ng
+        self.nblocks = nblocks
+        self.bounds = [(ng + b * n // nblocks, ng + (b + 1) * n // nblocks)
+                       for b in range(nblocks)]
+        self.block_shapes = [(i1 - i0 + 2 * ng,) + self.shape[1:]
+                             for i0, i1 in self.bounds]
+
+    def neighbors(self, b, periodic=False):
+        """
+        Returns the blocks on the lower and upper sides of block b along the
+        first axis, or None on the sides at the edge of a non-periodic grid.
+        """
+        lower = b - 1 if b > 0 else (self.nblocks - 1 if periodic else None)
+        upper = b + 1 if b < self.nblocks - 1 else (0 if periodic else None)
+        return lower, upper
+
+    def scatter(self, U, blocks):
+        """
+        Copies the global array U, guard zones included, into the blocks.
+        """
+        ng = self.ng
+        for (i0, i1), B in zip(self.bounds, blocks):
+            B[...] = U[i0 - ng:i1 + ng]
+
+    def gather(self, blocks, U):
+        """
+        Copies the interior zones of the blocks into the global array U.
+        """
+        ng = self.ng
+        for (i0, i1), B in zip(self.bounds, blocks):
+            U[i0:i1] = B[ng:B.shape[0] - ng]
+
+
+class BlockWorkers(object):
+    """
+    Runs one process for each of nblocks blocks. run(command, *args) calls
+    handler(b, command, *args) in every worker b, and returns the list of
+    their results, which must be picklable. The handler may synchronize the
+    workers through barrier, which is made if not given. An exception raised
+    in any worker aborts the barrier and is raised by run as a RuntimeError.
+
+    The workers are forked on construction, so the barrier and the shared
+    arrays they need must be made before, and other state they need is
+    inherited as it was then.
+    """
+    def __init__(self, nblocks, handler, barrier=None):
+        self.nblocks = nblocks
+        self.barrier = barrier or Barrier(nblocks)
+        self._handler = handler
+        self._pipes = [ ]
+        self._procs = [ ]
+        for b in range(nblocks):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=self._serve, args=(b, child))
+            proc.daemon = True
+            proc.start()
+            self._pipes.append(parent)
+            self._procs.append(proc)
+
+    def _serve(self, b, pipe):
+        while True:
+            message = pipe.recv()
+            if message is None:
+                return
+            try:
+                pipe.send((True, self._handler(b, *message)))
+            except Exception:
+                self.barrier.abort()
+                pipe.send((False, traceback.format_exc()))
+
+    def run(self, command, *args):
+        for pipe in self._pipes:
+            pipe.send((command,) + args)
+        replies = [pipe.recv() for pipe in self._pipes]
+        for ok, result in replies:
+            if not ok:
+                self.close()
+                raise RuntimeError("worker failed:\n%s" % result)
+        return [result for ok, result in replies]
+
+    def close(self):
+        for pipe, proc in zip(self._pipes, self._procs):
+            if proc.is_alive():
+                pipe.send(None)
+            proc.join()
+        self._pipes = [ ]
+        self._procs = [ ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,241 @@
+"""
+Append-only diagnostics log, streamed to disk in batches.
+
+A log is a pair of files:
+
+    filename         records, each pickled independently, back to back
+    filename.idx     index of the records, an array of INDEX_DTYPE holding the
+                     iteration, the time, and the byte range of each record
+
+Records are held in memory only until batch_size of them are pending, then
+written with a single write to each file, the data before the index. The index
+is small and ordered by iteration, so queries by iteration or time range read it
+with a binary search and unpickle only the records they return. A checkpoint
+refers to the log through pointer(), and a restart truncates the log back to
+that pointer, discarding the records written after the checkpoint.
+"""
+
+import os
+import cPickle
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('iteration', '<i8'),
+                        ('time', '<f8'),
+                        ('offset', '<u8'),
+                        ('nbytes', '<u8')])
+
+
+class DiagnosticsLog(object):
+    """
+    An indexed log of diagnostic records:
+
+        log = DiagnosticsLog('diagnostics.log', mode='w')
+        log.append(iteration, time, {'kinetic': ...})
+        log.records(100, 200)     # [(iteration, time, record), ...] for
+                                  # 100 <= iteration < 200
+        log.between(0.5, 1.0)     # records with 0.5 <= time < 1.0
+        log.close()
+
+    mode is 'r' to read an existing log, 'a' to append to an existing log (it
+    is created if missing) and 'w' to start a new one.
+    """
+    def __init__(self, filename, mode='a', batch_size=64):
+        if mode not in ['r', 'a', 'w']:
+            raise ValueError("mode must be 'r', 'a' or 'w'")
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.mode = mode
+        self.batch_size = batch_size
+        self._pending = [ ]
+        if mode == 'w':
+            for fname in [self.filename, self.index_filename]:
+                open(fname, 'wb').close()
+        elif mode == 'a' and not os.path.exists(self.index_filename):
+            for fname in [self.filename, self.index_filename]:
+                open(fname, 'ab').close()
+        self._nrecords, self._nbytes = self._recover()
+
+    def _recover(self):
+        """
+        Returns the number of complete records on disk, and the length of the
+        data they occupy. Entries of an index which was only partly written,
+        or which refer past the end of the data, are not counted.
+        """
+        size = os.path.getsize(self.index_filename)
+        nrecords = size // INDEX_DTYPE.itemsize
+        datasize = os.path.getsize(self.filename)
+        index = self._read_index(nrecords)
+        while nrecords and (index[nrecords - 1]['offset'] +
+                            index[nrecords - 1]['nbytes'] > datasize):
+            nrecords -= 1
+        if nrecords:
+            last = index[nrecords - 1]
+            return nrecords, int(last['offset'] + last['nbytes'])
+        return 0, 0
+
+    def _read_index(self, nrecords):
+        if nrecords == 0:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.index_filename, dtype=INDEX_DTYPE, mode='r',
+                         shape=(nrecords,))
+
+    def __len__(self):
+        return self._nrecords + len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, iteration, time, record):
+        """
+        Appends a record, which may be any picklable object. The record is
+        pickled immediately, so the caller may go on modifying it.
+        """
+        if self.mode == 'r':
+            raise IOError("log %s is open read-only" % self.filename)
+        self._pending.append((iteration, time,
+                              cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL)))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending records and their index entries to disk.
+        """
+        if not self._pending:
+            return
+        index = np.empty(len(self._pending), dtype=INDEX_DTYPE)
+        offset = self._nbytes
+        for n, (iteration, time, data) in enumerate(self._pending):
+            index[n] = (iteration, time, offset, len(data))
+            offset += len(data)
+        with open(self.filename, 'r+b') as f:
+            f.seek(self._nbytes)
+            f.write(''.join(data for _, _, data in self._pending))
+        with open(self.index_filename, 'r+b') as f:
+            f.seek(self._nrecords * INDEX_DTYPE.itemsize)
+            f.write(index.tostring())
+        self._nrecords += len(self._pending)
+        self._nbytes = offset
+        self._pending = [ ]
+
+    def close(self):
+        if self.mode != 'r':
+            self.flush()
+
+    def pointer(self):
+        """
+        Returns a small dictionary locating the end of the log, to be saved in
+        a checkpoint and later passed to truncate. Pending records are flushed
+        first.
+        """
+        self.flush()
+        return {'filename': self.filename,
+                'records': self._nrecords,
+                'nbytes': self._nbytes}
+
+    def truncate(self, records):
+        """
+        Discards all but the first records entries of the log. records may
+        also be a pointer returned by pointer().
+        """
+        if isinstance(records, dict):
+            records = records['records']
+        if self.mode == 'r':
+            raise IOError("log %s is open read-only" % self.filename)
+        self.flush()
+        if records >= self._nrecords:
+            return
+        nbytes = int(self._read_index(self._nrecords)[records]['offset'])
+        with open(self.index_filename, 'r+b') as f:
+            f.truncate(records * INDEX_DTYPE.itemsize)
+        with open(self.filename, 'r+b') as f:
+            f.truncate(nbytes)
+        self._nrecords, self._nbytes = records, nbytes
+
+    def index(self):
+        """
+        Returns the index of all records, an array of INDEX_DTYPE.
+        """
+        self.flush()
+        return np.array(self._read_index(self._nrecords))
+
+    def records(self, start=None, stop=None):
+        """
+        Returns the records with start <= iteration < stop, as a list of
+        (iteration, time, record) tuples.
+        """
+        return self._select('iteration', start, stop)
+
+    def between(self, t0=None, t1=None):
+        """
+        Returns the records with t0 <= time < t1, as a list of (iteration,
+        time, record) tuples.
+        """
+        return self._select('time', t0, t1)
+
+    def __getitem__(self, iteration):
+        found = self.records(iteration, iteration + 1)
+        if not found:
+            raise KeyError(iteration)
+        return found[-1][2]
+
+    def _select(self, key, lower, upper):
+        if self.mode != 'r':
+            self.flush()
+        index = self._read_index(self._nrecords)
+        column = index[key]
+        n0 = 0 if lower is None else np.searchsorted(column, lower, 'left')
+        n1 = len(index) if upper is None else np.searchsorted(column, upper,
+                                                              'left')
+        if n1 <= n0:
+            return [ ]
+        found = [ ]
+        with open(self.filename, 'rb') as f:
+            f.seek(int(index[n0]['offset']))
+            data = f.read(int(index[n1 - 1]['offset'] + index[n1 - 1]['nbytes']
+                              - index[n0]['offset']))
+        base = int(index[n0]['offset'])
+        for entry in index[n0:n1]:
+            i = int(entry['offset']) - base
+            found.append((int(entry['iteration']), float(entry['time']),
+                          cPickle.loads(data[i:i + int(entry['nbytes'])])))
+        return found
+
+
+class Cadence(object):
+    """
+    Decides when a measurement is due: every steps iterations, every interval
+    of simulation time, or whichever comes first when both are given. Either
+    may be None. The first call to due is always True.
+    """
+    def __init__(self, steps=1, interval=None):
+        if steps is None and interval is None:
+            raise ValueError("one of steps or interval must be given")
+        self.steps = steps
+        self.interval = interval
+        self.last_iteration = None
+        self.last_time = None
+
+    def due(self, iteration, time):
+        """
+        Returns True if a measurement is due at the given iteration and time,
+        in which case it is recorded as the last one made.
+        """
+        if self.last_iteration is None:
+            due = True
+        else:
+            due = ((self.steps is not None and
+                    iteration - self.last_iteration >= self.steps) or
+                   (self.interval is not None and
+                    time - self.last_time >= self.interval))
+        if due:
+            self.last_iteration = iteration
+            self.last_time = time
+        return due
+
+
+def open_log(filename, mode='r', **kwargs):
+    return DiagnosticsLog(filename, mode=mode, **kwargs)
@@ -3,10 +3,28 @@ import numpy as np
 from numpy.fft import *
 
 
+def spectral_profile(k, k0=0.1):
+    """
+    The shape exp(-(k/k0)^2) (k/k0)^8 of the driving power spectrum, which
+    peaks at k = 2 k0. Wavenumbers are in cycles per zone.
+    """
+    return np.exp(-(k/k0)**2) * (k/k0)**8
+
+
 class DrivingModule2d(object):
     """
     The power spectrum in this module refers to the 2d profile dP/dk^2, not the 1d
     power spectrum dP/dk.
+
+    The Ornstein-Uhlenbeck state is held in the Hermitian-reduced layout of a
+    real-to-complex transform, of shape (Nx, Ny/2 + 1), and the random numbers
+    of each step are drawn for that layout only. Their variance is that of the
+    Hermitian part of the full complex state, which is all that ever reached
+    the forcing field, so the statistics of the forcing are as they were when
+    the full state was held. A given seed gives a different realization,
+    however, and Nyquist modes carry no derivative (see spectral_weights). The
+    spectral weights of the two force components are computed once, and the
+    real-space field is computed at most once per call to advance.
     """
     theta = 1.0 # restoring parameter
     sigma = 1.0 # step size multiplier
@@ -15,16 +33,43 @@ class DrivingModule2d(object):
     def __init__(self, shape, rms=1.0, seed=12345):
         self._shape = tuple(shape)
         self._rng = np.random.RandomState(seed)
-        self._sol = np.zeros(self._shape, dtype=np.complex)
+        Nx, Ny = self._shape
+        self._sol = np.zeros((Nx, Ny//2 + 1), dtype=np.complex)
         self._rms = rms
+        self._field = None
         Kx, Ky, K = self.wave_number()
         self._totpower = self.power_spectrum(K, normalized=False).mean()
+        self._weights = self.spectral_weights()
+        # the transform takes the Hermitian part of the columns ky = 0 and
+        # Nyquist, which halves the variance of their random numbers
+        self._noise_scale = np.ones(Ny//2 + 1)
+        self._noise_scale[0] = 2**0.5
+        if Ny % 2 == 0: self._noise_scale[-1] = 2**0.5
 
     def advance(self, dt):
-        dx = self._rng.normal(0.0, (2*dt)**0.5, size=self._shape)
-        dy = self._rng.normal(0.0, (2*dt)**0.5, size=self._shape) * 1.j
+        dx = self._rng.normal(0.0, dt**0.5, size=self._sol.shape)
+        dy = self._rng.normal(0.0, dt**0.5, size=self._sol.shape) * 1.j
         t, s = self.theta, self.sigma
-        self._sol += -t * self._sol * dt + (s*dx + s*dy)
+        self._sol += -t * self._sol * dt + s * self._noise_scale * (dx + dy)
+        self._field = None
+
+    def spectral_weights(self):
+        """
+        Returns the weights which take the Hermitian-reduced state to the
+        transforms of the x and y force components, an array of shape (2, Nx,
+        Ny/2 + 1). The force is the curl of the state, so it has no divergence.
+        Nyquist modes carry no derivative and are given no weight.
+        """
+        Nx, Ny = self._shape
+        Kx = fftfreq(Nx)[:,np.newaxis]
+        Ky = rfftfreq(Ny)[np.newaxis,:]
+        K = (Kx**2 + Ky**2)**0.5
+        P = self.power_spectrum(K)
+        fk = (P / K**2 * (Nx * Ny))**0.5
+        fk[0,0] = 0.0
+        if Nx % 2 == 0: Kx[Nx//2,0] = 0.0
+        if Ny % 2 == 0: Ky[0,Ny//2] = 0.0
+        return np.array([-1.j * Ky * fk, +1.j * Kx * fk])
 
     def wave_number(self):
         L = self.L
@@ -45,8 +90,7 @@ class DrivingModule2d(object):
     def power_spectrum(self, k=None, normalized=True, bins=None):
         if bins is None:
             k[abs(k) < 1e-12] = 1e-12
-            k0 = 0.1
-            Pk = np.exp(-(k/k0)**2) * (k/k0)**8
+            Pk = spectral_profile(k)
             if normalized:
                 return Pk / self._totpower * self._rms**2
             else:
@@ -76,14 +120,124 @@ class DrivingModule2d(object):
 
     @property
     def field(self):
-        Nx, Ny = self._shape
-        Kx, Ky, K = self.wave_number()
-        P = self.power_spectrum(K)
-        fk = (P / K**2 * K.size)**0.5
-        fk[0,0] = 0.0
-        Fx = ifftn(-1.j * Ky * self._sol * fk).real
-        Fy = ifftn(+1.j * Kx * self._sol * fk).real
-        return Fx, Fy
+        if self._field is None:
+            H = self._weights * self._sol
+            Fx, Fy = irfftn(H, self._shape, axes=(1, 2))
+            self._field = (Fx, Fy)
+        return self._field
+
+
+class SparseDrivingModule(object):
+    """
+    Driving in two or three dimensions which evolves only the modes carrying
+    power above threshold times the peak of the spectrum, a band around k =
+    2 k0, held as a compact list of modes in the layout of a real-to-complex
+    transform. Each mode has an Ornstein-Uhlenbeck vector state. The force is
+    the projection of the state onto its solenoidal and compressive parts,
+    weighted by solenoidal and 1 - solenoidal, normalized so that the power
+    spectrum and rms are those of DrivingModule2d, with the same profile and
+    time correlation. The force is synthesized with one inverse transform of
+    the otherwise empty spectrum, once per call to advance.
+
+    Only as many random numbers as the band has mode components are drawn on
+    each step, so realizations differ from those of DrivingModule2d for the
+    same seed, while their statistics do not.
+    """
+    theta = 1.0 # restoring parameter
+    sigma = 1.0 # step size multiplier
+    k0 = 0.1 # the spectrum peaks at 2 k0, in cycles per zone
+
+    def __init__(self, shape, rms=1.0, seed=12345, threshold=1e-6,
+                 solenoidal=1.0):
+        self._shape = tuple(shape)
+        ndim = len(self._shape)
+        if ndim not in [2, 3]:
+            raise ValueError("driving needs a 2d or 3d shape")
+        self._rng = np.random.RandomState(seed)
+        self._rms = rms
+        self._solenoidal = solenoidal
+        self._field = None
+
+        rshape = self._shape[:-1] + (self._shape[-1]//2 + 1,)
+        N = np.prod(self._shape)
+        K = [fftfreq(n) for n in self._shape[:-1]] + [rfftfreq(self._shape[-1])]
+        mult = np.where((K[-1] == 0.0) | (abs(K[-1]) == 0.5), 1.0, 2.0)
+        Kt = np.meshgrid(*K[1:], indexing='ij', sparse=True)
+        peak = spectral_profile(2 * self.k0, self.k0)
+
+        # modes are selected one slab of the first axis at a time, counting
+        # the profile over the full grid for the normalization
+        total = 0.0
+        index = [ ]
+        for i, kx in enumerate(K[0]):
+            k2 = kx**2 + sum(k**2 for k in Kt)
+            Pk = spectral_profile(k2**0.5, self.k0)
+            total += (Pk * mult).sum()
+            keep = Pk > threshold * peak
+            for k in [kx] + Kt:
+                keep &= abs(k) != 0.5 # Nyquist modes are not represented
+            index.append(i * keep.size + np.flatnonzero(keep))
+        self._index = np.concatenate(index)
+
+        kvec = np.array([K[d][j] for d, j in
+                         enumerate(np.unravel_index(self._index, rshape))])
+        kmag = (kvec**2).sum(axis=0)**0.5
+        P = spectral_profile(kmag, self.k0) / (total / N) * rms**2
+        last = np.unravel_index(self._index, rshape)[-1]
+        norm = solenoidal**2 * (ndim - 1) + (1 - solenoidal)**2
+
+        self._khat = kvec / kmag
+        self._amplitude = (N * P / norm)**0.5
+        self._noise_scale = mult[last]**-0.5 * 2**0.5
+        self._power = (mult[last] * P).sum() / N
+        self._sol = np.zeros((ndim, self._index.size), dtype=np.complex)
+        self._spectrum = np.zeros((ndim,) + rshape, dtype=np.complex)
+
+    @property
+    def number_of_modes(self):
+        return self._index.size
+
+    def advance(self, dt):
+        W = self._rng.normal(0.0, dt**0.5, size=(2,) + self._sol.shape)
+        W *= self._noise_scale
+        t, s = self.theta, self.sigma
+        self._sol += -t * self._sol * dt + s * (W[0] + 1.j * W[1])
+        self._field = None
+
+    def total_power(self, actual=False):
+        """
+        Returns the mean of |F|^2 over the grid, as realized if actual is True,
+        and otherwise its expectation in the statistically steady state.
+        """
+        if actual:
+            return sum(F**2 for F in self.field).mean()
+        else:
+            return self._power
+
+    def source_terms(self, P):
+        F = self.field
+        S = np.zeros_like(P)
+        for d, Fd in enumerate(F):
+            np.multiply(P[...,0], Fd, out=S[...,2+d])
+            S[...,1] += S[...,2+d] * P[...,2+d]
+        return S
+
+    @property
+    def field(self):
+        """
+        The force components, a tuple of arrays of the grid's shape.
+        """
+        if self._field is None:
+            z = self._solenoidal
+            s = self._sol
+            khat = self._khat
+            F = z * s + (1 - 2*z) * khat * (khat * s).sum(axis=0)
+            F *= self._amplitude
+            H = self._spectrum.reshape(len(self._shape), -1)
+            H[:,self._index] = F
+            axes = range(1, len(self._shape) + 1)
+            self._field = tuple(irfftn(self._spectrum, self._shape, axes=axes))
+        return self._field
 
 
 def test_power_spectrum(driving):
@@ -20,6 +20,19 @@ cdef extern from "fish.h":
         FISH_ISK_BORGES08, # improved by Borges (2008) NOTE: might be 4th order
         FISH_ISK_SHENZHA10, # improved by Shen & Zha (2010)
 
+        # ---------------------------------------------------------------------------
+        # time integration schemes and boundary conditions for fish_evolve
+        # ---------------------------------------------------------------------------
+        FISH_RK1, # single step (forward Euler)
+        FISH_RK2_TVD, # second order total variation diminishing
+        FISH_RK3_SHUOSHER, # third order method of Shu & Osher (1988)
+        FISH_RK4, # classic fourth order
+        FISH_PERIODIC, # guard zones copied from the opposite side of the domain
+        FISH_OUTFLOW, # guard zones copied from the nearest interior zone
+        FISH_INFLOW, # guard zones held at given values, see fish_fillguards
+        FISH_USER_BOUNDARY, # guard zones filled by the callback given to
+                            # fish_setboundary
+
         # ---------------------------------------------------------------------------
         # names of parameters for solver description
         # ---------------------------------------------------------------------------
@@ -32,28 +45,73 @@ cdef extern from "fish.h":
         FISH_RECONSTRUCTION,
         FISH_GRAVRECNSTRUCT,
         FISH_SMOOTHNESS_INDICATOR,
+        FISH_NUM_THREADS, # [1 -> FISH_MAX_THREADS]
+        FISH_SWEEP_TILE, # [1 (pencil at a time) -> ~16], pencils gathered together
+        FISH_TIME_INTEGRATOR, # FISH_RK1 ... FISH_RK4
+        FISH_BOUNDARY_CONDITION, # FISH_PERIODIC, FISH_OUTFLOW, FISH_USER_BOUNDARY
+        FISH_MEASURE_WAVESPEEDS, # [0/1] fish_timederivative records wave speeds
 
         # -----------------
         # double parameters
         # -----------------
         FISH_PLM_THETA, # [1 -> 2 (most aggressive)]
         FISH_SHENZHA10_PARAM, # [0 -> ~100 (most aggressive)]
+        FISH_DENSITY_FLOOR, # smallest density left by fish_fromconserved
+        FISH_PRESSURE_FLOOR, # smallest pressure left by fish_fromconserved
+
+        # ---------------------------------------------------------------------
+        # double parameters (read-only, from the last fish_timederivative with
+        # FISH_MEASURE_WAVESPEEDS set)
+        # ---------------------------------------------------------------------
+        FISH_MAX_WAVESPEED, # largest wave speed seen in any direction
+        FISH_MAX_WAVESPEED0, # ... along axis 0
+        FISH_MAX_WAVESPEED1, # ... along axis 1
+        FISH_MAX_WAVESPEED2, # ... along axis 2
+
+        # ---------------------------------------------------
+        # long parameters (read-only, solver usage statistics)
+        # ---------------------------------------------------
+        FISH_ALLOCS_AVOIDED, # allocations saved by reusing the solver workspace
+        FISH_ZONES_FLOORED, # zones raised to the density or pressure floor
 
         FISH_ERROR_BADARG,
+        FISH_ERROR_BOUNDARY, # the boundary condition callback returned non-zero
+        FISH_ERROR_FROMCONS, # conserved to primitive conversion failed
+        FISH_MAX_THREADS,
 
     struct fish_state
 
+    ctypedef int (*fish_boundary_callback)(double *U, int ndim, int *shape,
+                                           int Q, int ng, void *data)
+
     fish_state *fish_new()
     int fish_del(fish_state *S)
-    int fish_evolve(fish_state *S, double dt)
+    int fish_evolve(fish_state *S, fluids_state **fluid,
+                    int ndim, int *shape, double *dx, double dt, int ng)
+    int fish_setboundary(fish_state *S, fish_boundary_callback boundary,
+                         void *data)
+    int fish_fromconserved(fish_state *S, fluids_state **fluid, double *U,
+                           long N)
+    int fish_fillguards(double *U, int ndim, int *shape, int Q, int ng,
+                        int *faces, double **inflow)
     int fish_intercellflux(fish_state *S, fluids_state **fluid, double *F, int N,
                            int dim)
     int fish_timederivative(fish_state *S, fluids_state **fluid,
-                            int ndim, int *shape, double *dx, double *L)
+                            int ndim, int *shape, double *dx, double *L,
+                            int ng)
+    int fish_intercellflux_array(fish_state *S, fluids_descr *D, double *P,
+                                 double *G, int sP, int sG, double *F, int N,
+                                 int dim)
+    int fish_timederivative_array(fish_state *S, fluids_descr *D, double *P,
+                                  double *G, int ndim, int *shape, double *dx,
+                                  double *L, int ng)
     int fish_getparami(fish_state *S, int *param, long flag)
     int fish_setparami(fish_state *S, int param, long flag)
+    int fish_getparaml(fish_state *S, long *param, long flag)
     int fish_getparamd(fish_state *S, double *param, long flag)
     int fish_setparamd(fish_state *S, double param, long flag)
 
 cdef class FishSolver(object):
     cdef fish_state *_c
+    cdef object _boundary
+    cdef object _boundary_error
@@ -19,15 +19,111 @@ _riemannsolvers  = {"hll"        : FLUIDS_RIEMANN_HLL,
 _smoothness      = {"jiangshu96" : FISH_ISK_JIANGSHU96,
                     "borges08"   : FISH_ISK_BORGES08,
                     "shenzha10"  : FISH_ISK_SHENZHA10}
+_integrators     = {1            : FISH_RK1,
+                    2            : FISH_RK2_TVD,
+                    3            : FISH_RK3_SHUOSHER,
+                    4            : FISH_RK4}
+_boundaries      = {"periodic"   : FISH_PERIODIC,
+                    "outflow"    : FISH_OUTFLOW}
+_faces           = {"periodic"   : FISH_PERIODIC,
+                    "outflow"    : FISH_OUTFLOW,
+                    "inflow"     : FISH_INFLOW}
 
 _solvertypes_i = inverse_dict(_solvertypes)
 _reconstructions_i = inverse_dict(_reconstructions)
 _riemannsolvers_i = inverse_dict(_riemannsolvers)
 _smoothness_i = inverse_dict(_smoothness)
+_boundaries_i = inverse_dict(_boundaries)
+
+def _output_array(shape, out):
+    """
+    Returns a zeroed, flat double array of the given shape, which is a view of
+    out when that is given.
+    """
+    if out is None:
+        return np.zeros(np.prod(shape))
+    if (out.shape != tuple(shape) or out.dtype != np.double or
+        not out.flags.c_contiguous):
+        raise ValueError("out must be a C-contiguous double array of shape %s"
+                         % (tuple(shape),))
+    out[...] = 0.0
+    return out.reshape(-1)
+
+cdef int _boundary_callback(double *U, int ndim, int *shape, int Q, int ng,
+                            void *data) noexcept:
+    cdef FishSolver solver = <FishSolver>data
+    cdef int i, size = Q
+    for i in range(ndim):
+        size *= shape[i]
+    try:
+        X = np.asarray(<double[:size]>U).reshape(
+            tuple([shape[i] for i in range(ndim)]) + (Q,))
+        solver._boundary(X, ng)
+    except Exception as e:
+        solver._boundary_error = e
+        return 1
+    return 0
+
+def fill_guards(X, int ng, faces, inflow=None):
+    """
+    Fills the ng guard zones of X, an array of shape (N0, ..., Nd, Q), in a
+    single native pass. faces holds a condition for each face, in the order
+    [x0, x1, y0, y1, z0, z1], among 'periodic', 'outflow' and 'inflow'. The
+    guard zones of an inflow face are copied from the corresponding entry of
+    inflow, a list in the same order whose entries are arrays shaped like the
+    guard slab (e.g. X[:ng] for the x0 face), or None for other faces.
+    """
+    cdef int ndim = X.ndim - 1
+    if ndim < 1 or ndim > 3 or len(faces) != 2 * ndim:
+        raise ValueError("faces must hold two conditions for each of the %d "
+                         "axes of X" % ndim)
+    if ng < 0:
+        raise ValueError("ng must be non-negative")
+    if inflow is None:
+        inflow = [None] * len(faces)
+    if len(inflow) != len(faces):
+        raise ValueError("inflow must hold an entry for each face")
+    for d in range(ndim):
+        if (faces[2*d] == "periodic") != (faces[2*d+1] == "periodic"):
+            raise ValueError("periodic faces must come in pairs, which they do "
+                             "not on axis %d" % d)
+    cdef np.ndarray U = np.ascontiguousarray(X, dtype=np.double)
+    cdef int shape[3]
+    cdef int cfaces[6]
+    cdef double *cinflow[6]
+    cdef np.ndarray A
+    arrays = [ ]
+    for d in range(ndim):
+        shape[d] = X.shape[d]
+    for n in range(len(faces)):
+        try:
+            cfaces[n] = _faces[faces[n]]
+        except KeyError:
+            raise ValueError("unknown boundary condition: %s" % faces[n])
+        cinflow[n] = NULL
+        if inflow[n] is not None:
+            a = np.ascontiguousarray(inflow[n], dtype=np.double)
+            guard_shape = X.shape[:n//2] + (ng,) + X.shape[n//2+1:]
+            if a.shape != guard_shape:
+                raise ValueError("inflow values for face %d must have shape %s"
+                                 % (n, guard_shape))
+            arrays.append(a)
+            A = a
+            cinflow[n] = <double*>A.data
+        elif faces[n] == "inflow":
+            raise ValueError("no inflow values given for face %d" % n)
+    err = fish_fillguards(<double*>U.data, ndim, shape, X.shape[-1], ng,
+                          cfaces, cinflow)
+    if err != 0:
+        raise ValueError("bad arguments to fish_fillguards")
+    if U is not X:
+        X[...] = U
 
 cdef class FishSolver(object):
     def __cinit__(self):
         self._c = fish_new()
+        self._boundary = None
+        self._boundary_error = None
 
     def __dealloc__(self):
         fish_del(self._c)
@@ -50,11 +146,23 @@ cdef class FishSolver(object):
         free(fluid)
         return Fiph
 
-    def time_derivative(self, fluidstatevec, spacing):
+    def time_derivative(self, fluidstatevec, spacing, int ng=0, out=None,
+                        wavespeeds=None):
+        """
+        Returns the time derivative of the conserved variables on each zone of
+        the FluidStateVector. If ng is given, only the pencils which feed zones
+        at least ng away from the boundary of each axis are computed, and the
+        others are left zero. If out is given, the result is written into it
+        and it is returned. If wavespeeds is given, an array with an entry for
+        each axis, the largest wave speed met by the sweep along each axis is
+        written into it.
+        """
+        if ng < 0:
+            raise ValueError("ng must be non-negative")
         states = fluidstatevec.states
         cdef fluids_state **fluid = <fluids_state**>malloc(
             states.size * sizeof(fluids_state*))
-        cdef int i, N
+        cdef int i, N, err
         cdef FluidState si
         cdef int Q = fluidstatevec.descriptor.nprimitive
         cdef int shape[3]
@@ -65,11 +173,177 @@ cdef class FishSolver(object):
         for i in range(states.size):
             si = states.flat[i]
             fluid[i] = si._c
-        cdef np.ndarray[np.double_t] L = np.zeros(states.size*Q)
-        fish_timederivative(self._c, fluid, len(states.shape), shape, dx,
-                            <double*>L.data)
+        cdef np.ndarray[np.double_t] L = _output_array(states.shape + (Q,),
+                                                       out)
+        fish_setparami(self._c, wavespeeds is not None, FISH_MEASURE_WAVESPEEDS)
+        err = fish_timederivative(self._c, fluid, len(states.shape), shape, dx,
+                                  <double*>L.data, ng)
         free(fluid)
-        return L.reshape(states.shape + (Q,))
+        if err != 0:
+            raise ValueError("bad arguments to fish_timederivative")
+        self._read_wavespeeds(wavespeeds, len(states.shape))
+        return L.reshape(states.shape + (Q,)) if out is None else out
+
+    def evolve(self, fluidstatevec, double dt, spacing, int rk=3, int ng=0):
+        """
+        Advances the FluidStateVector in place through a single Runge-Kutta
+        step of size dt, of order rk (1 through 4), with guard zones of width ng
+        filled according to the boundary property before each stage. Only the
+        flux divergence is integrated, source terms must be added separately.
+        """
+        if rk not in _integrators:
+            raise ValueError("rk must be one of %s" % _integrators.keys())
+        if ng < 0:
+            raise ValueError("ng must be non-negative")
+        states = fluidstatevec.states
+        cdef fluids_state **fluid = <fluids_state**>malloc(
+            states.size * sizeof(fluids_state*))
+        cdef int i, N, err
+        cdef FluidState si
+        cdef int shape[3]
+        cdef double dx[3]
+        for i, N in enumerate(states.shape):
+            shape[i] = N
+            dx[i] = spacing[i]
+        for i in range(states.size):
+            si = states.flat[i]
+            fluid[i] = si._c
+        fish_setparami(self._c, _integrators[rk], FISH_TIME_INTEGRATOR)
+        self._boundary_error = None
+        err = fish_evolve(self._c, fluid, len(states.shape), shape, dx, dt, ng)
+        free(fluid)
+        if err == FISH_ERROR_BOUNDARY:
+            e, self._boundary_error = self._boundary_error, None
+            raise e
+        elif err == FISH_ERROR_FROMCONS:
+            raise RuntimeError("conserved to primitive conversion failed")
+        elif err != 0:
+            raise ValueError("bad arguments to fish_evolve")
+
+    def from_conserved(self, fluidstatevec, conserved):
+        """
+        Recovers the primitive variables of each zone of the FluidStateVector
+        from the conserved array, in a single pass. Zones whose density or
+        pressure would fall below density_floor or pressure_floor are raised to
+        the floor, and their conserved variables are rewritten in place.
+        Returns the number of such zones.
+        """
+        states = fluidstatevec.states
+        cdef int Q = fluidstatevec.descriptor.nprimitive
+        if (conserved.shape != states.shape + (Q,) or
+            conserved.dtype != np.double or
+            not conserved.flags.c_contiguous):
+            raise ValueError("conserved must be a C-contiguous double array of "
+                             "shape %s" % (states.shape + (Q,),))
+        cdef np.ndarray U = conserved
+        cdef fluids_state **fluid = <fluids_state**>malloc(
+            states.size * sizeof(fluids_state*))
+        cdef int i, err
+        cdef long nfloor0, nfloor1
+        cdef FluidState si
+        for i in range(states.size):
+            si = states.flat[i]
+            fluid[i] = si._c
+        fish_getparaml(self._c, &nfloor0, FISH_ZONES_FLOORED)
+        err = fish_fromconserved(self._c, fluid, <double*>U.data, states.size)
+        fish_getparaml(self._c, &nfloor1, FISH_ZONES_FLOORED)
+        free(fluid)
+        if err == FISH_ERROR_FROMCONS:
+            raise RuntimeError("conserved to primitive conversion failed")
+        return nfloor1 - nfloor0
+
+    def intercell_flux_array(self, descriptor, primitive, gravity=None,
+                             int dim=0):
+        """
+        Same as intercell_flux, but operates directly on a pencil of primitive
+        variables with shape (N, nprimitive) and an optional gravitational
+        field with shape (N, ngravity) instead of an array of FluidState's.
+        """
+        cdef FluidDescriptor D = descriptor
+        cdef np.ndarray[np.double_t,ndim=2] P = np.ascontiguousarray(
+            primitive, dtype=np.double)
+        cdef np.ndarray[np.double_t,ndim=2] G
+        cdef double *Gdata = NULL
+        cdef int N = P.shape[0]
+        cdef int Q = P.shape[1]
+        cdef int QG = 0
+        if Q != descriptor.nprimitive:
+            raise ValueError("primitive array has wrong number of components")
+        if gravity is not None and descriptor.ngravity:
+            grav = np.ascontiguousarray(gravity, dtype=np.double)
+            if grav.shape != (N, descriptor.ngravity):
+                raise ValueError("gravity array must have shape %s" %
+                                 ((N, descriptor.ngravity),))
+            G = grav
+            Gdata = <double*>G.data
+            QG = descriptor.ngravity
+        cdef np.ndarray[np.double_t,ndim=2] Fiph = np.zeros([N, Q])
+        fish_intercellflux_array(self._c, D._c, <double*>P.data, Gdata, Q, QG,
+                                 <double*>Fiph.data, N, dim)
+        return Fiph
+
+    def time_derivative_array(self, descriptor, primitive, spacing,
+                              gravity=None, int ng=0, out=None,
+                              wavespeeds=None):
+        """
+        Same as time_derivative, but operates directly on the primitive array
+        with shape (Nx, [Ny, [Nz]], nprimitive) and an optional gravitational
+        field instead of a FluidStateVector.
+        """
+        cdef FluidDescriptor D = descriptor
+        prim = np.ascontiguousarray(primitive, dtype=np.double)
+        cdef np.ndarray P = prim
+        cdef np.ndarray G
+        cdef double *Gdata = NULL
+        cdef int i, N
+        cdef int Q = descriptor.nprimitive
+        cdef int shape[3]
+        cdef double dx[3]
+        cdef int ndim = len(prim.shape) - 1
+        if not 1 <= ndim <= 3 or prim.shape[ndim] != Q:
+            raise ValueError("primitive array has wrong shape")
+        if ng < 0:
+            raise ValueError("ng must be non-negative")
+        for i, N in enumerate(prim.shape[:ndim]):
+            shape[i] = N
+            dx[i] = spacing[i]
+        if gravity is not None and descriptor.ngravity:
+            grav = np.ascontiguousarray(gravity, dtype=np.double)
+            if grav.shape != prim.shape[:ndim] + (descriptor.ngravity,):
+                raise ValueError("gravity array must have shape %s" %
+                                 (prim.shape[:ndim] + (descriptor.ngravity,),))
+            G = grav
+            Gdata = <double*>G.data
+        cdef np.ndarray[np.double_t] L = _output_array(prim.shape, out)
+        cdef int err
+        fish_setparami(self._c, wavespeeds is not None, FISH_MEASURE_WAVESPEEDS)
+        err = fish_timederivative_array(self._c, D._c, <double*>P.data, Gdata,
+                                        ndim, shape, dx, <double*>L.data, ng)
+        if err != 0:
+            raise ValueError("bad arguments to fish_timederivative_array")
+        self._read_wavespeeds(wavespeeds, ndim)
+        return L.reshape(prim.shape) if out is None else out
+
+    def _read_wavespeeds(self, wavespeeds, int ndim):
+        cdef double a
+        cdef long flags[3]
+        flags[:] = [FISH_MAX_WAVESPEED0, FISH_MAX_WAVESPEED1,
+                    FISH_MAX_WAVESPEED2]
+        if wavespeeds is None:
+            return
+        for i in range(ndim):
+            fish_getparamd(self._c, &a, flags[i])
+            wavespeeds[i] = a
+
+    property max_wavespeed:
+        """
+        Largest wave speed met by the last time derivative computed with
+        wavespeeds given.
+        """
+        def __get__(self):
+            cdef double ret
+            fish_getparamd(self._c, &ret, FISH_MAX_WAVESPEED)
+            return ret
 
     property solver_type:
         def __get__(self):
@@ -104,6 +378,63 @@ cdef class FishSolver(object):
             fish_setparami(self._c, _smoothness[mode],
                            FISH_SMOOTHNESS_INDICATOR)
 
+    property num_threads:
+        def __get__(self):
+            cdef int ret
+            fish_getparami(self._c, &ret, FISH_NUM_THREADS)
+            return ret
+        def __set__(self, num_threads):
+            if not 1 <= num_threads <= FISH_MAX_THREADS:
+                raise ValueError("num_threads must be between 1 and %d" %
+                                 FISH_MAX_THREADS)
+            fish_setparami(self._c, num_threads, FISH_NUM_THREADS)
+
+    property sweep_tile:
+        def __get__(self):
+            cdef int ret
+            fish_getparami(self._c, &ret, FISH_SWEEP_TILE)
+            return ret
+        def __set__(self, sweep_tile):
+            if sweep_tile < 1:
+                raise ValueError("sweep_tile must be at least 1")
+            fish_setparami(self._c, sweep_tile, FISH_SWEEP_TILE)
+
+    property boundary:
+        """
+        Boundary condition used by evolve: either 'periodic', 'outflow', or a
+        callable f(U, ng) which fills the guard zones of the conserved array U
+        in place, e.g. the set_boundary method of a pyfish.boundary object.
+        """
+        def __get__(self):
+            cdef int ret
+            fish_getparami(self._c, &ret, FISH_BOUNDARY_CONDITION)
+            if ret == FISH_USER_BOUNDARY:
+                return self._boundary
+            return _boundaries_i[ret]
+        def __set__(self, boundary):
+            if callable(boundary):
+                self._boundary = boundary
+                fish_setboundary(self._c, _boundary_callback, <void*>self)
+                fish_setparami(self._c, FISH_USER_BOUNDARY,
+                               FISH_BOUNDARY_CONDITION)
+            else:
+                self._boundary = None
+                fish_setboundary(self._c, NULL, NULL)
+                fish_setparami(self._c, _boundaries[boundary],
+                               FISH_BOUNDARY_CONDITION)
+
+    property zones_floored:
+        def __get__(self):
+            cdef long ret
+            fish_getparaml(self._c, &ret, FISH_ZONES_FLOORED)
+            return ret
+
+    property allocations_avoided:
+        def __get__(self):
+            cdef long ret
+            fish_getparaml(self._c, &ret, FISH_ALLOCS_AVOIDED)
+            return ret
+
     property plm_theta:
         def __get__(self):
             cdef double ret
@@ -114,6 +445,22 @@ cdef class FishSolver(object):
                 raise ValueError("plm_theta must be between 1 and 2")
             fish_setparamd(self._c, plm_theta, FISH_PLM_THETA)
 
+    property density_floor:
+        def __get__(self):
+            cdef double ret
+            fish_getparamd(self._c, &ret, FISH_DENSITY_FLOOR)
+            return ret
+        def __set__(self, density_floor):
+            fish_setparamd(self._c, density_floor, FISH_DENSITY_FLOOR)
+
+    property pressure_floor:
+        def __get__(self):
+            cdef double ret
+            fish_getparamd(self._c, &ret, FISH_PRESSURE_FLOOR)
+            return ret
+        def __set__(self, pressure_floor):
+            fish_setparamd(self._c, pressure_floor, FISH_PRESSURE_FLOOR)
+
     property shenzha10_param:
         def __get__(self):
             cdef double ret
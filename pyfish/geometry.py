@@ -0,0 +1,85 @@
+"""
+Cached geometry of a Cartesian grid of zone centers.
+
+A Geometry is built from the coordinate axes of a grid, and derives from them,
+on first use, the quantities which source terms and diagnostics need in every
+stage: the radius of each zone, 1 / r^2, the radial unit vector, and the force
+field of a central point mass. Each quantity is computed once and kept for as
+long as the Geometry, which the evolution operator replaces only when its grid
+changes. The arrays returned are shared, and must not be modified.
+"""
+
+import numpy as np
+
+
+class Geometry(object):
+    """
+    Geometry of the grid whose zone centers are the outer product of the 1d
+    arrays x, y and z:
+
+        geom = Geometry(x, y, z)
+        geom.axes         # (x, y, z)
+        geom.sparse       # broadcastable views X, Y, Z of shape (Nx, 1, 1),
+                          # (1, Ny, 1) and (1, 1, Nz)
+        geom.radius       # r, of shape (Nx, Ny, Nz)
+        geom.rhat         # radial unit vector, of shape (3, Nx, Ny, Nz)
+        geom.central_force(G, M)
+
+    Other derived quantities may be kept with memoize.
+    """
+    def __init__(self, x, y, z):
+        self.axes = tuple(np.array(a, dtype=float) for a in [x, y, z])
+        self.shape = tuple(a.size for a in self.axes)
+        self.sparse = tuple(np.meshgrid(*self.axes, indexing='ij', sparse=True))
+        self._memo = { }
+
+    def memoize(self, key, compute):
+        """
+        Returns the value kept under key, calling compute() to make it the
+        first time.
+        """
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def grid(self):
+        """
+        Returns a new dense coordinate grid, of shape (3, Nx, Ny, Nz).
+        """
+        return np.array(np.meshgrid(*self.axes, indexing='ij'))
+
+    @property
+    def radius2(self):
+        X, Y, Z = self.sparse
+        return self.memoize('radius2', lambda: X**2 + Y**2 + Z**2)
+
+    @property
+    def radius(self):
+        return self.memoize('radius', lambda: self.radius2**0.5)
+
+    @property
+    def inverse_radius2(self):
+        return self.memoize('inverse_radius2', lambda: 1.0 / self.radius2)
+
+    @property
+    def rhat(self):
+        def compute():
+            rhat = np.empty((3,) + self.shape)
+            for d, X in enumerate(self.sparse):
+                np.divide(X, self.radius, out=rhat[d])
+            return rhat
+        return self.memoize('rhat', compute)
+
+    @property
+    def rhat_over_r2(self):
+        return self.memoize('rhat_over_r2',
+                            lambda: self.rhat * self.inverse_radius2)
+
+    def central_force(self, G=1.0, M=1.0):
+        """
+        Returns the acceleration -G M rhat / r^2 due to a point mass M at the
+        origin, of shape (3, Nx, Ny, Nz), and its potential -G M / r.
+        """
+        def compute():
+            return (-G * M) * self.rhat_over_r2, (-G * M) / self.radius
+        return self.memoize(('central_force', G, M), compute)
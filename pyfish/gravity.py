@@ -1,35 +1,94 @@
+import multiprocessing.pool
 import numpy as np
 from numpy.fft import *
 
-class PoissonSolver1d(object):
+class PoissonSolver(object):
+    """
+    Solves del^2 phi = four_pi_G (rho - <rho>) for periodic arrays rho of one,
+    two or three dimensions using real-to-complex FFT's. The solution is a
+    4-component array containing phi in soln[...,0] and its gradient in
+    soln[...,1:4], the components along axes beyond the dimension of rho being
+    zero. L is the length of the domain, either one for all axes or a sequence
+    with one for each.
+
+    Wavenumbers and the Green's function are computed once for each grid shape
+    and kept for later calls. phi and its spectral gradient are recovered with
+    a single batched inverse transform.
+    """
     L = 1.0
     four_pi_G = 1.0
     gradient_method = ['spectral', 'difference'][0]
 
     def __init__(self):
-        pass
-
-    def solve(self, rho, retrhobar=False):
-        Nx, = rho.shape
-        k = fftfreq(Nx) * 2*np.pi*Nx
-        k[0] = 1.0
-        rhohat = fft(rho)
-        rhobar = rhohat[0] / rho.size
-        phihat = self.four_pi_G * rhohat / -k**2
-        phihat[0] = 0.0
-        gphhat = 1.j * k * phihat
-        phi = ifft(phihat).real
+        self._kernels = { }
+
+    def lengths(self, ndim):
+        return list(self.L) if np.iterable(self.L) else [self.L] * ndim
+
+    def kernel(self, shape):
+        """
+        Returns the wavenumbers along each axis, shaped to broadcast against
+        the real-to-complex transform of an array of the given shape, and the
+        Green's function -four_pi_G / k^2, which is zero for k = 0. The
+        wavenumbers are meant for derivatives, so the Nyquist mode of each axis
+        is zeroed, as taking the real part of a complex transform would do.
+        """
+        shape = tuple(shape)
+        key = (shape, tuple(self.lengths(len(shape))), self.four_pi_G)
+        if key not in self._kernels:
+            ndim = len(shape)
+            K = [ ]
+            k2 = 0.0
+            for d, (N, L) in enumerate(zip(shape, self.lengths(ndim))):
+                f = rfftfreq(N) if d == ndim - 1 else fftfreq(N)
+                k = f * (2*np.pi*N/L)
+                k = k.reshape([-1 if e == d else 1 for e in range(ndim)])
+                k2 = k2 + k**2
+                if N % 2 == 0:
+                    k = k.copy()
+                    k.flat[N // 2] = 0.0
+                K.append(k)
+            k2.flat[0] = 1.0 # prevent division by 0
+            green = -self.four_pi_G / k2
+            green.flat[0] = 0.0
+            self._kernels[key] = (K, green)
+        return self._kernels[key]
+
+    def solve(self, rho, retrhobar=False, out=None):
+        """
+        Returns the solution for the density rho, written into out if that is
+        given, an array of shape rho.shape + (4,) which may be a view (e.g. the
+        interior of a gravity array). With retrhobar the mean density is also
+        returned.
+        """
+        shape = rho.shape
+        ndim = len(shape)
+        axes = range(1, ndim + 1)
+        K, green = self.kernel(shape)
+        rhohat = rfftn(rho)
+        rhobar = rhohat.flat[0].real / rho.size
+        phihat = rhohat * green
+        soln = np.zeros(shape + (4,)) if out is None else out
 
         if self.gradient_method == 'spectral':
-            gph = ifft(1.j * k * phihat).real
+            H = np.empty((ndim + 1,) + phihat.shape, dtype=phihat.dtype)
+            H[0] = phihat
+            for d in range(ndim):
+                np.multiply(phihat, 1.j * K[d], out=H[d+1])
+            F = irfftn(H, shape, axes=axes)
+            for c in range(ndim + 1):
+                soln[...,c] = F[c]
         elif self.gradient_method == 'difference':
-            gph = np.gradient(phi, self.L / Nx)
+            phi = irfftn(phihat, shape)
+            soln[...,0] = phi
+            dx = [L / N for L, N in zip(self.lengths(ndim), shape)]
+            gph = np.gradient(phi, *dx)
+            for d in range(ndim):
+                soln[...,1+d] = gph[d] if ndim > 1 else gph
+        soln[...,1+ndim:] = 0.0
 
-        soln = np.zeros(rho.shape + (4,))
-        soln[:,0] = phi
-        soln[:,1] = gph
         if retrhobar:
-            return soln, rhobar.real
+            return soln, rhobar
         else:
             return soln
 
@@ -37,120 +96,151 @@ class PoissonSolver1d(object):
         pass
 
 
+# The original one-dimensional solver, now a special case
+PoissonSolver1d = PoissonSolver
+
+
 class SelfGravitySourceTerms(object):
-    def __init__(self, G=1.0):
+    """
+    Source terms of the self-gravity of a three-dimensional periodic fluid,
+    with gravitational constant G. The kernels are those of a PoissonSolver,
+    cached for each grid shape. The force components, and phi when retphi is
+    given, are recovered with real-to-complex inverse transforms, which are
+    spread over a pool of num_threads threads when that is more than one
+    (numpy's transforms release the GIL).
+    """
+    def __init__(self, G=1.0, num_threads=1):
         self.G = G
-
-    def source_terms(self, mara, retphi=False):
-        from numpy.fft import fftfreq, fftn, ifftn
+        self.num_threads = num_threads
+        self._poisson = PoissonSolver()
+        self._pool = None
+
+    def _inverse(self, H, shape):
+        if self.num_threads > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.pool.ThreadPool(self.num_threads)
+            return self._pool.map(lambda h: irfftn(h, shape), H)
+        else:
+            return irfftn(H, shape, axes=range(1, len(shape) + 1))
+
+    def source_terms(self, mara, retphi=False, out=None):
+        """
+        Returns the source terms, an array of shape mara.fluid.shape + (5,)
+        which is zero in the guard zones. If out is given, the source terms are
+        written into its interior and its guard zones are left alone.
+        """
         ng = mara.number_guard_zones()
-        G = self.G
-        L = 1.0
-        Nx, Ny, Nz = mara.fluid.shape
-        Nx -= 2*ng
-        Ny -= 2*ng
-        Nz -= 2*ng
-        P = mara.fluid.primitive[ng:-ng,ng:-ng,ng:-ng]
+        interior = (slice(ng, -ng),) * 3
+        P = mara.fluid.primitive[interior]
         rho = P[...,0]
-        vx = P[...,2]
-        vy = P[...,3]
-        vz = P[...,4]
-
-        K = [fftfreq(Nx)[:,np.newaxis,np.newaxis] * (2*np.pi*Nx/L),
-             fftfreq(Ny)[np.newaxis,:,np.newaxis] * (2*np.pi*Ny/L),
-             fftfreq(Nz)[np.newaxis,np.newaxis,:] * (2*np.pi*Nz/L)]
-        delsq = -(K[0]**2 + K[1]**2 + K[2]**2)
-        delsq[0,0,0] = 1.0 # prevent division by 0
-
-        rhohat = fftn(rho)
-        phihat = (4*np.pi*G) * rhohat / delsq
-        fx = -ifftn(1.j * K[0] * phihat).real
-        fy = -ifftn(1.j * K[1] * phihat).real
-        fz = -ifftn(1.j * K[2] * phihat).real
-
-        S = np.zeros(mara.fluid.shape + (5,))
-        S[ng:-ng,ng:-ng,ng:-ng,0] = 0.0
-        S[ng:-ng,ng:-ng,ng:-ng,1] = rho * (fx*vx + fy*vy + fz*vz)
-        S[ng:-ng,ng:-ng,ng:-ng,2] = rho * fx
-        S[ng:-ng,ng:-ng,ng:-ng,3] = rho * fy
-        S[ng:-ng,ng:-ng,ng:-ng,4] = rho * fz
-        return (S, ifftn(phihat).real) if retphi else S
+        shape = rho.shape
+
+        self._poisson.four_pi_G = 4*np.pi*self.G
+        K, green = self._poisson.kernel(shape)
+        rhohat = rfftn(rho)
+        phihat = rhohat * green
+        H = np.empty((4 if retphi else 3,) + phihat.shape, dtype=phihat.dtype)
+        for d in range(3):
+            np.multiply(phihat, -1.j * K[d], out=H[d])
+        if retphi:
+            H[3] = phihat
+            H[3].flat[0] = rhohat.flat[0] * (4*np.pi*self.G) # mean of phi, as before
+        F = self._inverse(H, shape)
+
+        S = np.zeros(mara.fluid.shape + (5,)) if out is None else out
+        Si = S[interior]
+        Si[...,0] = 0.0
+        Si[...,1] = 0.0
+        for d in range(3):
+            np.multiply(rho, F[d], out=Si[...,2+d])
+            Si[...,1] += Si[...,2+d] * P[...,2+d]
+        return (S, F[3]) if retphi else S
 
 
 class EnclosedMassMonopoleGravity(object):
-    def __init__(self, G=1.0):
+    """
+    Source terms of the monopole part of the self-gravity of a fluid, the
+    force at radius r being -G M(r) / r^2 towards the origin. The mass M(r)
+    enclosed by r is found on nbins radial bins spanning 0 <= r < rmax, rmax
+    being by default the largest radius on the grid. Mass beyond rmax is not
+    counted. M(r) is interpolated linearly between the bin edges.
+
+    The bin index of each zone, its position within its bin, and the factor
+    rhat / r^2 are kept in mara.geometry, so that each call makes a single
+    histogram pass over the density, followed by a cumulative sum.
+    """
+    def __init__(self, G=1.0, nbins=10, rmax=None):
         self.G = G
-
-    def source_terms(self, mara, retphi=False):
-        from scipy.interpolate import interp1d
-
-        G = self.G
-        X, Y, Z = mara.coordinate_grid()
-        r2 = X**2 + Y**2 + Z**2
-        r = r2**0.5
-
+        self.nbins = nbins
+        self.rmax = rmax
+
+    def bins(self, mara):
+        """
+        Returns the bin index of each zone of mara's grid, flattened, and the
+        fractional position of each zone within its bin. Zones beyond rmax have
+        the bin index nbins. These are kept in mara.geometry.
+        """
+        geom = mara.geometry
+        def compute():
+            r = geom.radius
+            rmax = r.max() * (1 + 1e-12) if self.rmax is None else self.rmax
+            u = r * (self.nbins / rmax)
+            index = np.minimum(u.astype(int), self.nbins)
+            frac = np.where(index < self.nbins, u - index, 0.0)
+            return index.ravel(), frac
+        return geom.memoize(('monopole_bins', self.nbins, self.rmax), compute)
+
+    def source_terms(self, mara, retphi=False, out=None):
+        """
+        Returns the source terms, an array of shape mara.fluid.shape + (5,),
+        written into out if that is given.
+        """
+        index, frac = self.bins(mara)
+        rhat_r2 = mara.geometry.rhat_over_r2
         P = mara.fluid.primitive
         rho = P[...,0]
-        vx = P[...,2]
-        vy = P[...,3]
-        vz = P[...,4]
 
         dV = mara.dx * mara.dy * mara.dz
-        renc = np.linspace(0.0, 1.0, 10)
-        Menc = [ ]
-
-        for r0 in renc:
-            Menc.append(rho[r < r0].sum() * dV)
-
-        Menc_f = interp1d(renc, Menc, kind='cubic')
-        Menc_i = Menc_f(r)
-
-        rhatx, rhaty, rhatz = X/r, Y/r, Z/r
-        fx = -G * Menc_i * rhatx / r2
-        fy = -G * Menc_i * rhaty / r2
-        fz = -G * Menc_i * rhatz / r2
-
-        S = np.zeros(mara.fluid.shape + (5,))
+        shells = np.bincount(index, weights=rho.ravel(),
+                             minlength=self.nbins + 1) * dV
+        edges = np.zeros(self.nbins + 1)
+        np.cumsum(shells[:-1], out=edges[1:])
+        Menc = edges[index].reshape(rho.shape) + frac * shells[index].reshape(
+            rho.shape)
+
+        S = np.zeros(mara.fluid.shape + (5,)) if out is None else out
         S[...,0] = 0.0
-        S[...,1] = rho * (fx*vx + fy*vy + fz*vz)
-        S[...,2] = rho * fx
-        S[...,3] = rho * fy
-        S[...,4] = rho * fz
+        S[...,1] = 0.0
+        Menc *= -self.G
+        Menc *= rho
+        for d in range(3):
+            np.multiply(Menc, rhat_r2[d], out=S[...,2+d])
+            S[...,1] += S[...,2+d] * P[...,2+d]
         return S
 
 
 class StaticCentralGravity(object):
+    """
+    Source terms of a point mass M at the origin. The force field and its
+    potential are read from mara.geometry, where they are kept for as long as
+    the grid does not change.
+    """
     def __init__(self, G=1.0, M=1.0):
         self.G = G
         self.M = M
 
-    def source_terms(self, mara, retphi=False):
-        G = self.G
-        M = self.M
-
-        X, Y, Z = mara.coordinate_grid()
-        r2 = X**2 + Y**2 + Z**2
-        r = r2**0.5
-
-        rhatx, rhaty, rhatz = X/r, Y/r, Z/r
-        fx = -G * M * rhatx / r2
-        fy = -G * M * rhaty / r2
-        fz = -G * M * rhatz / r2
-
-        phi = -G * M / r
+    def source_terms(self, mara, retphi=False, out=None):
+        F, phi = mara.geometry.central_force(self.G, self.M)
 
         P = mara.fluid.primitive
         rho = P[...,0]
-        vx = P[...,2]
-        vy = P[...,3]
-        vz = P[...,4]
 
-        S = np.zeros(mara.fluid.shape + (5,))
+        S = np.zeros(mara.fluid.shape + (5,)) if out is None else out
         S[...,0] = 0.0
-        S[...,1] = rho * (fx*vx + fy*vy + fz*vz)
-        S[...,2] = rho * fx
-        S[...,3] = rho * fy
-        S[...,4] = rho * fz
+        S[...,1] = 0.0
+        for d in range(3):
+            np.multiply(rho, F[d], out=S[...,2+d])
+            S[...,1] += S[...,2+d] * P[...,2+d]
 
         return (S, phi) if retphi else S
 
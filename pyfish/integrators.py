@@ -0,0 +1,157 @@
+import numpy as np
+
+
+class RungeKuttaIntegrator(object):
+    """
+    Advances a conserved array U in place through a single time step,
+
+        integrator.advance(U, dt, dUdt)
+
+    where dUdt(U, out=L) writes the time derivative of U into the array L and
+    returns it. Stage registers are allocated on first use and kept for later
+    steps, so that no full-grid temporaries are created while stepping.
+    """
+    def __init__(self):
+        self._registers = { }
+
+    def register(self, name, U):
+        R = self._registers.get(name)
+        if R is None or R.shape != U.shape or R.dtype != U.dtype:
+            R = self._registers[name] = np.empty_like(U)
+        return R
+
+    def storage(self):
+        """
+        Number of full-grid arrays held by the integrator, in addition to U.
+        """
+        return len(self._registers)
+
+    def advance(self, U, dt, dUdt):
+        raise NotImplementedError
+
+
+class RungeKuttaSingleStep(RungeKuttaIntegrator):
+    def advance(self, U, dt, dUdt):
+        L = dUdt(U, out=self.register('L', U))
+        L *= dt
+        U += L
+
+
+class RungeKuttaRk2Tvd(RungeKuttaIntegrator):
+    def advance(self, U, dt, dUdt):
+        U0 = self.register('U0', U)
+        U0[...] = U
+        for a in [0.0, 1./2]:
+            L = dUdt(U, out=self.register('L', U))
+            L *= dt
+            U += L
+            if a != 0.0:
+                # U = a U0 + (1 - a) (U + dt L)
+                U *= 1.0 - a
+                np.multiply(U0, a, out=L)
+                U += L
+
+
+class RungeKuttaShuOsherRk3(RungeKuttaIntegrator):
+    def advance(self, U, dt, dUdt):
+        U0 = self.register('U0', U)
+        U0[...] = U
+        for a in [0.0, 3./4, 1./3]:
+            L = dUdt(U, out=self.register('L', U))
+            L *= dt
+            U += L
+            if a != 0.0:
+                U *= 1.0 - a
+                np.multiply(U0, a, out=L)
+                U += L
+
+
+class RungeKuttaClassicRk4(RungeKuttaIntegrator):
+    def advance(self, U, dt, dUdt):
+        U0 = self.register('U0', U)
+        U1 = self.register('U1', U)
+        U0[...] = U
+        U1[...] = U
+        for c, w in [(1./2, 1./6), (1./2, 2./6), (1.0, 2./6), (None, 1./6)]:
+            L = dUdt(U, out=self.register('L', U))
+            L *= dt
+            if c is not None:
+                # U = U0 + c dt L, the sum of the w dt L is kept in U1
+                np.multiply(L, c, out=U)
+                U += U0
+                L *= w
+                U1 += L
+            else:
+                L *= w
+                np.add(U1, L, out=U)
+
+
+class LowStorageRungeKutta(RungeKuttaIntegrator):
+    """
+    2N-storage scheme of Williamson (1980), only a single register dU is kept
+    between the stages:
+
+        dU = A[s] dU + dt L(U)
+        U  = U + B[s] dU
+
+    Together with the time derivative written by dUdt the scheme holds two
+    full-grid arrays in addition to U, whatever the number of stages.
+    """
+    A = [ ]
+    B = [ ]
+
+    def advance(self, U, dt, dUdt):
+        dU = self.register('dU', U)
+        for A, B in zip(self.A, self.B):
+            L = dUdt(U, out=self.register('L', U))
+            if A == 0.0:
+                np.multiply(L, dt, out=dU)
+            else:
+                dU *= A
+                L *= dt
+                dU += L
+            np.multiply(dU, B, out=L)
+            U += L
+
+
+class LowStorageRk3(LowStorageRungeKutta):
+    """
+    Third order, three stages, Williamson (1980).
+    """
+    A = [0.0, -5./9, -153./128]
+    B = [1./3, 15./16, 8./15]
+
+
+class LowStorageRk4(LowStorageRungeKutta):
+    """
+    Fourth order, five stages, Carpenter & Kennedy (1994).
+    """
+    A = [0.0,
+         -567301805773.0 / 1357537059087.0,
+         -2404267990393.0 / 2016746695238.0,
+         -3550918686646.0 / 2091501179385.0,
+         -1275806237668.0 / 842570457699.0]
+    B = [1432997174477.0 / 9575080441755.0,
+         5161836677717.0 / 13612068292357.0,
+         1720146321549.0 / 2090206949498.0,
+         3134564353537.0 / 4481467310338.0,
+         2277821191437.0 / 14882151754819.0]
+
+
+_integrators = {1     : RungeKuttaSingleStep,
+                2     : RungeKuttaRk2Tvd,
+                3     : RungeKuttaShuOsherRk3,
+                4     : RungeKuttaClassicRk4,
+                'ls3' : LowStorageRk3,
+                'ls4' : LowStorageRk4}
+
+
+def build_integrator(rk):
+    """
+    Returns a new integrator for the given scheme: 1, 2, 3 and 4 are the
+    classic schemes, 'ls3' and 'ls4' are the 2N-storage ones.
+    """
+    try:
+        return _integrators[rk]()
+    except KeyError:
+        raise ValueError("unknown Runge-Kutta scheme: %s" % rk)
@@ -1,8 +1,48 @@
+"""
+Initial conditions are given per point, as pinit(x, y, z) and ginit(x, y, z)
+returning the list of primitive (gravitational) variables at that point. Any of
+them may also come with an array-valued companion, named like it with the
+suffix _array, e.g. pinit_array(X, Y, Z) or polytrope3d_array(X, Y, Z), which
+takes coordinate arrays of any shape and returns the variables with shape
+X.shape + (nprimitive,). The companion is used in place of the per-point
+function whenever it exists, see array_initializer.
+"""
+
+import sys
 import numpy as np
 import pyfluids
 from pyfish import boundary, driving, gravity
 
 
+def array_initializer(f):
+    """
+    Returns the array-valued companion f_array of the per-point initial
+    condition f, which is either a method of a problem or a module level
+    function. Returns None when there is none.
+    """
+    name = f.__name__ + '_array'
+    owner = getattr(f, '__self__', None)
+    if owner is None:
+        return getattr(sys.modules.get(f.__module__), name, None)
+    for cls in type(owner).__mro__:
+        # the companion has to be defined alongside f, so that a subclass
+        # overriding only f does not pick up an inherited f_array
+        if f.__name__ in vars(cls):
+            return getattr(owner, name) if name in vars(cls) else None
+    return None
+
+
+def _stack(X, *fields):
+    """
+    Returns the fields, each an array broadcastable to X.shape or a scalar,
+    stacked along a new last axis.
+    """
+    P = np.empty(X.shape + (len(fields),))
+    for i, f in enumerate(fields):
+        P[...,i] = f
+    return P
+
+
 class TestProblem(object):
     tfinal = 1.0
     lower_bounds = [-0.5, -0.5, -0.5]
@@ -26,6 +66,9 @@ class TestProblem(object):
     def ginit(self, x, y, z):
         return 0.0
 
+    def ginit_array(self, X, Y, Z):
+        return np.zeros(X.shape + (self.fluid_descriptor.ngravity,))
+
 
 class OneDimensionalUpsidedownGaussian(TestProblem):
     '''
@@ -48,11 +91,24 @@ class OneDimensionalUpsidedownGaussian(TestProblem):
         pre = rho * e0 * (self.gamma - 1.0)
         return [rho, pre, 0.0, 0.0, 0.0]
 
+    def pinit_array(self, X, Y, Z):
+        phi = self.ginit_array(X, Y, Z)[...,0]
+        e0 = self.sie
+        D0 = 1.0
+        rho = D0 * np.exp(-phi / (e0 * (self.gamma - 1.0)))
+        pre = rho * e0 * (self.gamma - 1.0)
+        return _stack(X, rho, pre, 0.0, 0.0, 0.0)
+
     def ginit(self, x, y, z):
         phi = -self.ph0 * np.exp(-0.5 * x**2 / self.sig**2)
         gph = -x/self.sig**2 * phi
         return [phi, gph, 0.0, 0.0]
 
+    def ginit_array(self, X, Y, Z):
+        phi = -self.ph0 * np.exp(-0.5 * X**2 / self.sig**2)
+        gph = -X/self.sig**2 * phi
+        return _stack(X, phi, gph, 0.0, 0.0)
+
     def build_boundary(self, mara):
         ng = mara.number_guard_zones()
         return boundary.Inflow(mara.fluid[0:ng], mara.fluid[-ng:])
@@ -76,7 +132,7 @@ class OneDimensionalPolytrope(TestProblem):
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
         if self.selfgrav:
-            self.poisson_solver = gravity.PoissonSolver1d()
+            self.poisson_solver = gravity.PoissonSolver()
 
     def pinit(self, x, y, z):
         R = self.R
@@ -96,9 +152,24 @@ class OneDimensionalPolytrope(TestProblem):
             if pre < self.Pa: pre = self.Pa
         return [rho, pre, 0.0, 0.0, 0.0]
 
+    def pinit_array(self, X, Y, Z):
+        R = self.R
+        K = 0.5 * R**2 / np.pi**2
+        inside = abs(X) < R/2
+        rho = np.where(inside, self.Dc * np.cos(np.pi * X / R),
+                       0.0 if self.floor_fix else self.Da)
+        pre = K * rho**2.0
+        if self.floor_fix:
+            rho = np.maximum(rho, self.Da)
+            pre = np.maximum(pre, self.Pa)
+        return _stack(X, rho, pre, 0.0, 0.0, 0.0)
+
     def ginit(self, x, y, z):
         return [0.0, 0.0, 0.0, 0.0]
 
+    def ginit_array(self, X, Y, Z):
+        return np.zeros(X.shape + (4,))
+
     def build_boundary(self, mara):
         return boundary.Periodic()
 
@@ -120,7 +191,7 @@ class PeriodicDensityWave(TestProblem):
         super(self.__class__, self).__init__(*args, **kwargs)
         if self.fluid in ['gravs', 'gravp', 'grave']:
             self.plot_fields.append('phi')
-            self.poisson_solver = gravity.PoissonSolver1d()
+            self.poisson_solver = gravity.PoissonSolver()
             self.fluid_descriptor.rhobar = self.D0
 
     def pinit(self, x, y, z):
@@ -128,9 +199,17 @@ class PeriodicDensityWave(TestProblem):
         rho = self.D0 + self.D1 * np.cos(2 * self.n0 * np.pi * x / L)
         return [rho, self.p0, self.v0, 0.0, 0.0]
 
+    def pinit_array(self, X, Y, Z):
+        L = self.upper_bounds[0] - self.lower_bounds[0]
+        rho = self.D0 + self.D1 * np.cos(2 * self.n0 * np.pi * X / L)
+        return _stack(X, rho, self.p0, self.v0, 0.0, 0.0)
+
     def ginit(self, x, y, z):
         return [0.0, 0.0, 0.0, 0.0]
 
+    def ginit_array(self, X, Y, Z):
+        return np.zeros(X.shape + (4,))
+
     def build_boundary(self, mara):
         return boundary.Periodic()
 
@@ -165,6 +244,24 @@ class BrioWuShocktube(TestProblem):
         else:
             return [1.000, 1.000, 0.0, 0.0, 0.0]
 
+    def pinit_array(self, X, Y, Z):
+        if self.geometry == 'planar':
+            r = {'x': X, 'y': Y, 'z': Z}[self.direction]
+            R = 0.0
+        elif self.geometry == 'cylindrical':
+            r = (X**2 + Y**2)**0.5
+            R = 0.125
+        elif self.geometry == 'spherical':
+            r = (X**2 + Y**2 + Z**2)**0.5
+            R = 0.125
+        else:
+            raise ValueError("invalid problem geometry: %s" % self.geometry)
+
+        outside = r > R
+        rho = np.where(outside, 0.125, 1.000)
+        pre = np.where(outside, 0.100, 1.000)
+        return _stack(X, rho, pre, 0.0, 0.0, 0.0)
+
 
 class DrivenTurbulence2d(TestProblem):
     fluid = 'nrhyd'
@@ -178,6 +275,30 @@ class DrivenTurbulence2d(TestProblem):
     def pinit(self, x, y, z):
         return [1.0, 1.0, 0.0, 0.0, 0.0]
 
+    def pinit_array(self, X, Y, Z):
+        return _stack(X, 1.0, 1.0, 0.0, 0.0, 0.0)
+
+    def build_boundary(self, mara):
+        return boundary.Periodic()
+
+
+class DrivenTurbulence3d(TestProblem):
+    fluid = 'nrhyd'
+    gamma = 1.4
+    tfinal = 1.0
+    resolution = [64, 64, 64]
+    solenoidal = 1.0 # weight of the solenoidal part of the driving
+    def __init__(self, *args, **kwargs):
+        super(self.__class__, self).__init__(*args, **kwargs)
+        self.driving = driving.SparseDrivingModule(self.resolution,
+                                                   solenoidal=self.solenoidal)
+
+    def pinit(self, x, y, z):
+        return [1.0, 1.0, 0.0, 0.0, 0.0]
+
+    def pinit_array(self, X, Y, Z):
+        return _stack(X, 1.0, 1.0, 0.0, 0.0, 0.0)
+
     def build_boundary(self, mara):
         return boundary.Periodic()
 
@@ -201,6 +322,22 @@ def polytrope3d(x, y, z):
     return [rho, pre, 0.0, 0.0, 0.0]
 
 
+def polytrope3d_array(X, Y, Z):
+    rho_c = 1.0    # central density
+    rho_f = 1.0e-3 # floor (atmospheric) density
+    G = 1.0        # gravitational constant
+    b = 0.3        # beta, stellar radius
+    a = b / np.pi  # alpha
+    n = 1.0        # polytropic index
+    K = 4*np.pi*G * a**2 / ((n + 1) * rho_c**(1.0/n - 1.0))
+    r = (X**2 + Y**2 + Z**2)**0.5 / a
+    rs = np.where(r < 1e-6, 1.0, r) # keeps sin(r)/r finite where it's unused
+    rho = np.where(r < 1e-6, rho_c,
+                   np.where(r >= np.pi, rho_f, rho_c * np.sin(rs) / rs))
+    pre = K * rho**2
+    return _stack(X, rho, pre, 0.0, 0.0, 0.0)
+
+
 def central_mass3d(x, y, z):
     rho_c = 1.0    # central density
     rho_f = 1.0e-2 # floor (atmospheric) density
@@ -214,6 +351,16 @@ def central_mass3d(x, y, z):
     return [rho, pre, 0.0, 0.0, 0.0]
 
 
+def central_mass3d_array(X, Y, Z):
+    rho_c = 1.0    # central density
+    rho_f = 1.0e-2 # floor (atmospheric) density
+    a = 0.3        # alpha, stellar radius
+    r = (X**2 + Y**2 + Z**2)**0.5 / a
+    rho = np.where(r < 0.5, rho_c, rho_f)
+    pre = 1.0
+    return _stack(X, rho, pre, 0.0, 0.0, 0.0)
+
+
 def ginit(self, x, y, z):
     """
     An attempt at a static gravity solution to the 1d polytrop. In practive we
@@ -0,0 +1,90 @@
+#define _POSIX_C_SOURCE 199309L // for clock_gettime
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include <math.h>
+#include "fish.h"
+
+// Times fish_timederivative_array on an N^3 grid, once with the pencils of each
+// sweep gathered one at a time, and once with FISH_SWEEP_TILE pencils at a
+// time. Usage: benchfish [tile] [N ...], defaults to tile 8 and N = 64 128 256.
+// -----------------------------------------------------------------------------
+
+static double seconds()
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9 * t.tv_nsec;
+}
+
+static double bench(fluids_descr *D, int N, int tile, int nrep)
+{
+  int shape[3] = {N, N, N};
+  double dx[3] = {1.0 / N, 1.0 / N, 1.0 / N};
+  long ncell = (long) N * N * N;
+  double *P = (double*) malloc(ncell * 5 * sizeof(double));
+  double *L = (double*) malloc(ncell * 5 * sizeof(double));
+  double best = 0.0;
+
+  for (long n=0; n<ncell; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.1 * sin(0.3 * n);
+    P[5*n + 3] = 0.1 * cos(0.5 * n);
+    P[5*n + 4] = 0.1 * cos(0.9 * n);
+  }
+
+  fish_state *S = fish_new();
+  fish_setparami(S, FISH_GODUNOV, FISH_SOLVER_TYPE);
+  fish_setparami(S, FISH_PLM, FISH_RECONSTRUCTION);
+  fish_setparami(S, FLUIDS_RIEMANN_HLLC, FISH_RIEMANN_SOLVER);
+  fish_setparami(S, tile, FISH_SWEEP_TILE);
+
+  for (int r=0; r<nrep; ++r) {
+    for (long m=0; m<ncell*5; ++m) {
+      L[m] = 0.0;
+    }
+    double t0 = seconds();
+    fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L, 0);
+    double t1 = seconds();
+    if (r == 0 || t1 - t0 < best) {
+      best = t1 - t0;
+    }
+  }
+
+  fish_del(S);
+  free(P);
+  free(L);
+  return best;
+}
+
+int main(int argc, char **argv)
+{
+  int tile = argc > 1 ? atoi(argv[1]) : 8;
+  int sizes[3] = {64, 128, 256};
+  int nsize = 3;
+
+  if (argc > 2) {
+    nsize = argc - 2 < 3 ? argc - 2 : 3;
+    for (int i=0; i<nsize; ++i) {
+      sizes[i] = atoi(argv[i + 2]);
+    }
+  }
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  printf("%8s %12s %12s %8s\n", "N", "tile=1 [s]", "tiled [s]", "speedup");
+  for (int i=0; i<nsize; ++i) {
+    int N = sizes[i];
+    int nrep = N <= 64 ? 5 : (N <= 128 ? 3 : 1);
+    double t1 = bench(D, N, 1, nrep);
+    double tn = bench(D, N, tile, nrep);
+    printf("%8d %12.4f %12.4f %8.2f\n", N, t1, tn, t1 / tn);
+  }
+
+  fluids_descr_del(D);
+  return 0;
+}
@@ -0,0 +1,105 @@
+#include <string.h>
+#define FISH_PRIVATE_DEFS
+#include "fish.h"
+
+int _boundary(fish_state *S, double *U, int ndim, int *shape, int Q, int ng)
+/* -----------------------------------------------------------------------------
+ * Fills the ng guard zones on either side of each axis of U, according to the
+ * boundary condition S->boundary_condition, which applies to every face.
+ * -----------------------------------------------------------------------------
+ */
+{
+  int faces[6];
+
+  switch (S->boundary_condition) {
+  case FISH_PERIODIC: break;
+  case FISH_OUTFLOW: break;
+  case FISH_USER_BOUNDARY:
+    if (S->boundary == NULL) {
+      return FISH_ERROR_BADARG;
+    }
+    if (S->boundary(U, ndim, shape, Q, ng, S->boundary_data)) {
+      return FISH_ERROR_BOUNDARY;
+    }
+    return 0;
+  default: return FISH_ERROR_BADARG;
+  }
+  for (int n=0; n<6; ++n) {
+    faces[n] = S->boundary_condition;
+  }
+  return fish_fillguards(U, ndim, shape, Q, ng, faces, NULL);
+}
+
+
+int fish_fillguards(double *U, int ndim, int *shape, int Q, int ng,
+		    int *faces, double **inflow)
+/* -----------------------------------------------------------------------------
+ * Fills the ng guard zones on either side of each axis of U, a C-ordered array
+ * of shape (shape[0], ..., shape[ndim-1], Q). faces[2*d] and faces[2*d+1] are
+ * the conditions on the lower and upper faces of axis d: FISH_PERIODIC (both
+ * faces of the axis must then be periodic), FISH_OUTFLOW or FISH_INFLOW. The
+ * guard zones of an inflow face are copied from inflow[2*d] or inflow[2*d+1],
+ * a C-ordered array shaped like the guard slab, that is like U with shape[d]
+ * replaced by ng. inflow may be NULL if no face is an inflow face.
+ *
+ * Only the guard layers are written. Axes with no more than 2 ng zones have no
+ * guard zones and are left alone. The axes are done one after another, so that
+ * the corners are filled consistently.
+ * -----------------------------------------------------------------------------
+ */
+{
+  if (ndim < 1 || ndim > 3 || ng < 0) {
+    return FISH_ERROR_BADARG;
+  }
+  for (int d=0; d<ndim; ++d) {
+    int L = faces[2*d+0], R = faces[2*d+1];
+    if ((L == FISH_PERIODIC) != (R == FISH_PERIODIC)) {
+      return FISH_ERROR_BADARG;
+    }
+    for (int s=0; s<2; ++s) {
+      int f = faces[2*d+s];
+      if (f != FISH_PERIODIC && f != FISH_OUTFLOW && f != FISH_INFLOW) {
+	return FISH_ERROR_BADARG;
+      }
+      if (f == FISH_INFLOW && (inflow == NULL || inflow[2*d+s] == NULL)) {
+	return FISH_ERROR_BADARG;
+      }
+    }
+  }
+
+  for (int d=0; d<ndim; ++d) {
+    int N = shape[d];
+    long nouter = 1; // number of slabs stacked before axis d ...
+    long ninner = Q; // ... and the size of a single layer of those slabs
+    for (int e=0; e<d; ++e) nouter *= shape[e];
+    for (int e=d+1; e<ndim; ++e) ninner *= shape[e];
+
+    if (N <= 2 * ng) {
+      continue;
+    }
+    for (long o=0; o<nouter; ++o) {
+      double *u = &U[o * N * ninner];
+      for (int s=0; s<2; ++s) {
+	double *guard = s == 0 ? u : &u[(N - ng) * ninner];
+
+	switch (faces[2*d+s]) {
+	case FISH_INFLOW:
+	  memcpy(guard, &inflow[2*d+s][o * ng * ninner],
+		 ng * ninner * sizeof(double));
+	  break;
+	case FISH_PERIODIC:
+	  memcpy(guard, s == 0 ? &u[(N - 2 * ng) * ninner] : &u[ng * ninner],
+		 ng * ninner * sizeof(double));
+	  break;
+	case FISH_OUTFLOW:
+	  for (int i=0; i<ng; ++i) {
+	    int j = s == 0 ? ng : N - ng - 1; // nearest interior layer
+	    memcpy(&guard[i * ninner], &u[j * ninner], ninner * sizeof(double));
+	  }
+	  break;
+	}
+      }
+    }
+  }
+  return 0;
+}
@@ -2,26 +2,71 @@
 #include <stdio.h>
 #include <string.h>
 #include <math.h>
+#include <pthread.h>
 
 #define FISH_PRIVATE_DEFS
 #include "fish.h"
 
 #define MAXQ 8 // for small statically-declared arrays
 
-static void _pcm(fish_state *S, fluids_state **src, fluids_state *L,
-		 fluids_state *R, long flag);
-static void _plm(fish_state *S, fluids_state **src, fluids_state *L,
-		 fluids_state *R, long flag);
-static void _avg(fish_state *S, fluids_state **src, fluids_state *L,
-		 fluids_state *R, long flag);
-static void _weno5(fish_state *S, fluids_state **src, fluids_state *L,
-		   fluids_state *R, long flag);
-static int _matrix_product(double *A, double *B, double *C,
-			   int ni, int nj, int nk);
-static int _intercell_godunov(fish_state *S, fluids_state **fluid, double *Fiph,
-			      int N, int dim);
-static int _intercell_spectral(fish_state *S, fluids_state **fluid,
+static void _stencil_product(double *A, double *B, double *C, int Q, int ldc);
+static int _intercellflux(fish_state *S, struct fish_workspace *W,
+			  fluids_descr *D, double *P, double *G,
+			  double *F, int N, int dim);
+static int _intercell_godunov(fish_state *S, struct fish_workspace *W,
+			      fluids_descr *D, double *P, double *G,
+			      double *Fiph, int N, int dim);
+static int _intercell_spectral(fish_state *S, struct fish_workspace *W,
+			       fluids_descr *D, double *P,
 			       double *Fiph, int N, int dim);
+static struct fish_workspace *_workspace(fish_state *S, int t,
+					 fluids_descr *D, int N, int tile);
+static void _workspace_del(struct fish_workspace *W);
+static int _timederivative(fish_state *S, fluids_descr *D,
+			   fluids_state **fluid, double *P, double *G,
+			   int ndim, int *shape, double *dx, double *L, int ng);
+static int _setconserved(fish_state *S, fluids_state **fluid, double *U,
+			 int ndim, int *shape, int Q, int ng);
+static void *_sweep(void *arg);
+static int _pencil_origin(int ndim, int *lo, int *len, int *stride, int dim,
+			  int p);
+
+struct fish_workspace {
+  fluids_descr *descr; // descriptor the fluid states below were created with
+  int size; // number of zones the buffers can hold
+  int tile; // number of pencils the P, G and Fiph buffers can hold
+  int ncomp; // number of components per zone the buffers can hold
+  double *P, *G, *Fiph; // contiguous pencils and intercell flux buffers
+  double *A, *F, *U, *lam; // per-zone buffers for the spectral solver
+  double *T; // component-major (transposed) copy of the pencil
+  double *Fl, *Fr; // component-major values reconstructed on either face side
+  double *fp, *fm; // characteristic fluxes on the 6-zone stencil of each face
+  double *Liph, *Riph; // left and right eigenvectors on each face
+  double *st; // split fluxes F+ and F- on the stencil of a single face
+  fluids_state *S_, *SL, *SR, *face, *zone;
+  fluids_riemn *R;
+  double amax; // largest wave speed seen since the start of the sweep
+  long nallocs; // number of allocations actually made ...
+  long nuses; // ... and the number that would be needed without the workspace
+} ;
+
+struct fish_sweep {
+  fish_state *S;
+  struct fish_workspace *W;
+  fluids_descr *D;
+  fluids_state **fluid; // either the fluid states are given, or ...
+  double *P; // ... the primitive and (optionally) gravity arrays
+  double *G;
+  double *L;
+  int ndim;
+  int dim;
+  int *shape;
+  int *stride;
+  int *lo, *len; // range of transverse indices whose pencils are computed
+  double dx;
+  int p0, p1; // range of pencils handled by this sweep
+  int tile; // largest number of neighboring pencils gathered together
+} ;
 static const long FLUIDS_FLUX[3] = {FLUIDS_FLUX0, FLUIDS_FLUX1, FLUIDS_FLUX2};
 static const long FLUIDS_EVAL[3] = {FLUIDS_EVAL0, FLUIDS_EVAL1, FLUIDS_EVAL2};
 static const long FLUIDS_LEVECS[3] = {FLUIDS_LEVECS0,
@@ -42,12 +87,29 @@ fish_state *fish_new(void)
     .smoothness_indicator = FISH_ISK_JIANGSHU96,
     .plm_theta = 2.0,
     .shenzha10_param = 0.0,
+    .density_floor = 0.0,
+    .pressure_floor = 0.0,
+    .zones_floored = 0,
+    .num_threads = 1,
+    .sweep_tile = 1,
+    .time_integrator = FISH_RK3_SHUOSHER,
+    .boundary_condition = FISH_OUTFLOW,
+    .measure_wavespeeds = 0,
+    .max_wavespeed = {0.0, 0.0, 0.0},
+    .boundary = NULL,
+    .boundary_data = NULL,
+    .registers = NULL,
+    .nregisters = 0,
   } ;
   *S = state;
   return S;
 }
 int fish_del(fish_state *S)
 {
+  for (int t=0; t<FISH_MAX_THREADS; ++t) {
+    _workspace_del(S->workspace[t]);
+  }
+  free(S->registers);
   free(S);
   return 0;
 }
@@ -60,6 +122,11 @@ int fish_getparami(fish_state *S, int *param, long flag)
   case FISH_RECONSTRUCTION: *param = S->reconstruction; return 0;
   case FISH_GRAVRECNSTRUCT: *param = S->gravrecnstruct; return 0;
   case FISH_SMOOTHNESS_INDICATOR: *param = S->smoothness_indicator; return 0;
+  case FISH_NUM_THREADS: *param = S->num_threads; return 0;
+  case FISH_SWEEP_TILE: *param = S->sweep_tile; return 0;
+  case FISH_TIME_INTEGRATOR: *param = S->time_integrator; return 0;
+  case FISH_BOUNDARY_CONDITION: *param = S->boundary_condition; return 0;
+  case FISH_MEASURE_WAVESPEEDS: *param = S->measure_wavespeeds; return 0;
   }
   return FISH_ERROR_BADARG;
 }
@@ -71,6 +138,30 @@ int fish_setparami(fish_state *S, int param, long flag)
   case FISH_RECONSTRUCTION: S->reconstruction = param; return 0;
   case FISH_GRAVRECNSTRUCT: S->gravrecnstruct = param; return 0;
   case FISH_SMOOTHNESS_INDICATOR: S->smoothness_indicator = param; return 0;
+  case FISH_NUM_THREADS:
+    if (param < 1 || param > FISH_MAX_THREADS) return FISH_ERROR_BADARG;
+    S->num_threads = param; return 0;
+  case FISH_SWEEP_TILE:
+    if (param < 1) return FISH_ERROR_BADARG;
+    S->sweep_tile = param; return 0;
+  case FISH_TIME_INTEGRATOR: S->time_integrator = param; return 0;
+  case FISH_BOUNDARY_CONDITION: S->boundary_condition = param; return 0;
+  case FISH_MEASURE_WAVESPEEDS: S->measure_wavespeeds = param; return 0;
+  }
+  return FISH_ERROR_BADARG;
+}
+int fish_getparaml(fish_state *S, long *param, long flag)
+{
+  switch (flag) {
+  case FISH_ALLOCS_AVOIDED:
+    *param = 0;
+    for (int t=0; t<FISH_MAX_THREADS; ++t) {
+      if (S->workspace[t]) {
+	*param += S->workspace[t]->nuses - S->workspace[t]->nallocs;
+      }
+    }
+    return 0;
+  case FISH_ZONES_FLOORED: *param = S->zones_floored; return 0;
   }
   return FISH_ERROR_BADARG;
 }
@@ -79,6 +170,17 @@ int fish_getparamd(fish_state *S, double *param, long flag)
   switch (flag) {
   case FISH_PLM_THETA: *param = S->plm_theta; return 0;
   case FISH_SHENZHA10_PARAM: *param = S->shenzha10_param; return 0;
+  case FISH_DENSITY_FLOOR: *param = S->density_floor; return 0;
+  case FISH_PRESSURE_FLOOR: *param = S->pressure_floor; return 0;
+  case FISH_MAX_WAVESPEED:
+    *param = 0.0;
+    for (int d=0; d<3; ++d) {
+      if (S->max_wavespeed[d] > *param) *param = S->max_wavespeed[d];
+    }
+    return 0;
+  case FISH_MAX_WAVESPEED0: *param = S->max_wavespeed[0]; return 0;
+  case FISH_MAX_WAVESPEED1: *param = S->max_wavespeed[1]; return 0;
+  case FISH_MAX_WAVESPEED2: *param = S->max_wavespeed[2]; return 0;
   }
   return FISH_ERROR_BADARG;
 }
@@ -87,22 +189,81 @@ int fish_setparamd(fish_state *S, double param, long flag)
   switch (flag) {
   case FISH_PLM_THETA: S->plm_theta = param; return 0;
   case FISH_SHENZHA10_PARAM: S->shenzha10_param = param; return 0;
+  case FISH_DENSITY_FLOOR: S->density_floor = param; return 0;
+  case FISH_PRESSURE_FLOOR: S->pressure_floor = param; return 0;
   }
   return FISH_ERROR_BADARG;
 }
+int fish_setboundary(fish_state *S, fish_boundary_callback boundary,
+		     void *data)
+{
+  S->boundary = boundary;
+  S->boundary_data = data;
+  return 0;
+}
 
 int fish_intercellflux(fish_state *S, fluids_state **fluid, double *F, int N,
                        int dim)
+/* -----------------------------------------------------------------------------
+ * Gathers the primitive and gravitational fields out of the fluid states into
+ * contiguous buffers and hands them to the array-based flux solver. Each state
+ * is read exactly once.
+ * -----------------------------------------------------------------------------
+ */
+{
+  fluids_descr *D;
+  fluids_state_getdescr(fluid[0], &D);
+  struct fish_workspace *W = _workspace(S, 0, D, N, 1);
+  int Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
+  int QG = fluids_descr_getncomp(D, FLUIDS_GRAVITY);
+
+  for (int n=0; n<N; ++n) {
+    fluids_state_getattr(fluid[n], &W->P[n*Q], FLUIDS_PRIMITIVE);
+    if (QG) {
+      fluids_state_getattr(fluid[n], &W->G[n*QG], FLUIDS_GRAVITY);
+    }
+  }
+  W->nuses += QG ? 2 : 1;
+  return _intercellflux(S, W, D, W->P, QG ? W->G : NULL, F, N, dim);
+}
+
+int fish_intercellflux_array(fish_state *S, fluids_descr *D, double *P,
+			     double *G, int sP, int sG, double *F, int N,
+			     int dim)
+/* -----------------------------------------------------------------------------
+ * Array-native version of fish_intercellflux. Cell n of the pencil has its
+ * primitive variables at P[n*sP + q] and its gravitational field at
+ * G[n*sG + q], i.e. the components of a cell must be contiguous but the cells
+ * may be strided. G may be NULL when the fluid has no gravitational field.
+ * -----------------------------------------------------------------------------
+ */
+{
+  struct fish_workspace *W = _workspace(S, 0, D, N, 1);
+  int Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
+  int QG = G ? fluids_descr_getncomp(D, FLUIDS_GRAVITY) : 0;
+
+  for (int n=0; n<N; ++n) {
+    memcpy(&W->P[n*Q], &P[n*sP], Q * sizeof(double));
+    if (QG) {
+      memcpy(&W->G[n*QG], &G[n*sG], QG * sizeof(double));
+    }
+  }
+  W->nuses += QG ? 2 : 1;
+  return _intercellflux(S, W, D, W->P, QG ? W->G : NULL, F, N, dim);
+}
+
+int _intercellflux(fish_state *S, struct fish_workspace *W, fluids_descr *D,
+		   double *P, double *G, double *F, int N, int dim)
 {
   switch (S->solver_type) {
-  case FISH_GODUNOV: return _intercell_godunov(S, fluid, F, N, dim);
-  case FISH_SPECTRAL: return _intercell_spectral(S, fluid, F, N, dim);
+  case FISH_GODUNOV: return _intercell_godunov(S, W, D, P, G, F, N, dim);
+  case FISH_SPECTRAL: return _intercell_spectral(S, W, D, P, F, N, dim);
   default: return FISH_ERROR_BADARG;
   }
 }
 
 int fish_timederivative(fish_state *S, fluids_state **fluid,
-			int ndim, int *shape, double *dx, double *L)
+			int ndim, int *shape, double *dx, double *L, int ng)
 /* -----------------------------------------------------------------------------
  * NOTES:
  *
@@ -110,229 +271,509 @@ int fish_timederivative(fish_state *S, fluids_state **fluid,
  *     up-to-date.
  *
  * (2) L is assumed to already be initialized to zero's.
+ *
+ * (3) When FISH_NUM_THREADS is larger than 1, the pencils of each directional
+ *     sweep are divided between that many threads. Pencils of a given sweep
+ *     write to disjoint parts of L, and the sweeps are still done one direction
+ *     at a time, so the result is bitwise identical to the serial one.
+ *
+ * (4) When FISH_SWEEP_TILE is larger than 1, the sweeps along strided axes
+ *     gather up to that many pencils which are neighbors along the last
+ *     (contiguous) axis into a tile, so that each cell read from, and each
+ *     update written to L touches a contiguous run of memory rather than one
+ *     value per pencil at a large stride. The fluxes of each pencil are
+ *     computed exactly as before, so the result does not depend on the tile.
+ *
+ * (5) ng is the number of guard zones on either side of each axis. Only the
+ *     pencils whose transverse indices are all in the range [ng, N - ng) are
+ *     computed, since the others only feed guard zones. Entries of L on the
+ *     skipped pencils are left untouched. Axes with no more than 2 ng zones
+ *     (e.g. a trivial axis of a lower dimensional problem) are not trimmed.
+ *
+ * (6) When FISH_MEASURE_WAVESPEEDS is set, the largest wave speed met by each
+ *     directional sweep is recorded, and may be read back through the
+ *     FISH_MAX_WAVESPEED parameters. They come at little cost from the flux
+ *     computation: the spectral solver already finds the eigenvalues of each
+ *     zone, and the Godunov solver takes those of the reconstructed states on
+ *     either side of each face, from which the Riemann problem is solved.
  * -----------------------------------------------------------------------------
 */
 {
-  int si, sj, sk, Q;
-  double *Fiph;
-  fluids_state **slice;
   fluids_descr *D;
   fluids_state_getdescr(fluid[0], &D);
-  Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
-
-  switch (ndim) {
-    /* ---------------------------------- (1d) -------------------------------*/
-  case 1:
-    si = 1;
-
-    // ----------------------------
-    // sweeps along the x-direction
-    // ----------------------------
-    Fiph = (double*) malloc(shape[0] * Q * sizeof(double));
-    fish_intercellflux(S, fluid, Fiph, shape[0], 0);
-    for (int i=0; i<shape[0]; ++i) {
-      for (int q=0; q<Q; ++q) {
-	L[(i*si)*Q + q] -= (Fiph[i*Q+q] - Fiph[(i-1)*Q+q]) / dx[0];
+  return _timederivative(S, D, fluid, NULL, NULL, ndim, shape, dx, L, ng);
+}
+
+
+int fish_timederivative_array(fish_state *S, fluids_descr *D, double *P,
+			      double *G, int ndim, int *shape, double *dx,
+			      double *L, int ng)
+/* -----------------------------------------------------------------------------
+ * Array-native version of fish_timederivative. P, G and L are C-ordered arrays
+ * of shape (shape[0], ..., shape[ndim-1], ncomp). G may be NULL when the fluid
+ * has no gravitational field. The same notes as for fish_timederivative apply.
+ * -----------------------------------------------------------------------------
+ */
+{
+  return _timederivative(S, D, NULL, P, G, ndim, shape, dx, L, ng);
+}
+
+
+int fish_evolve(fish_state *S, fluids_state **fluid,
+		int ndim, int *shape, double *dx, double dt, int ng)
+/* -----------------------------------------------------------------------------
+ * Advances the fluid states through a single Runge-Kutta step of size dt, using
+ * the scheme given by FISH_TIME_INTEGRATOR. The ng guard zones on either side
+ * of each axis are filled according to FISH_BOUNDARY_CONDITION, on the
+ * conserved variables, before every stage and at the end of the step.
+ *
+ * NOTES:
+ *
+ * (1) The fluid states are assumed to be up-to-date on entry. On exit their
+ *     primitive variables have been recovered from the new conserved ones.
+ *
+ * (2) Only the flux divergence is integrated, there are no source terms
+ *     (e.g. gravitational or driving) in this function.
+ *
+ * (3) The primitive variables are recovered by fish_fromconserved, so that the
+ *     density and pressure floors are applied after every stage.
+ *
+ * (4) If the boundary condition or a conserved to primitive conversion fails,
+ *     the step is abandoned with the fluid states left at the failed stage.
+ * -----------------------------------------------------------------------------
+ */
+{
+  /* coefficients a and b of the stages U1 = a U0 + b (U1 + dt L(U1)) for the
+     schemes up to third order */
+  static const double RK[3][3][2] = {{{0.0, 1.0}},
+				     {{0.0, 1.0}, {1./2, 1./2}},
+				     {{0.0, 1.0}, {3./4, 1./4}, {1./3, 2./3}}};
+  /* sub-step sizes and weights of the classic fourth order scheme */
+  static const double RK4c[4] = {1./2, 1./2, 1.0, 0.0};
+  static const double RK4w[4] = {1./6, 2./6, 2./6, 1./6};
+
+  fluids_descr *D;
+  int Q, nstage, err;
+  long ncell = 1, size;
+  double *U0, *U1, *L, *Uacc;
+
+  if (ndim < 1 || ndim > 3 || ng < 0) {
+    return FISH_ERROR_BADARG;
+  }
+  switch (S->time_integrator) {
+  case FISH_RK1: nstage = 1; break;
+  case FISH_RK2_TVD: nstage = 2; break;
+  case FISH_RK3_SHUOSHER: nstage = 3; break;
+  case FISH_RK4: nstage = 4; break;
+  default: return FISH_ERROR_BADARG;
+  }
+
+  fluids_state_getdescr(fluid[0], &D);
+  Q = fluids_descr_getncomp(D, FLUIDS_CONSERVED);
+  for (int d=0; d<ndim; ++d) {
+    ncell *= shape[d];
+  }
+  size = ncell * Q;
+
+  if (S->nregisters < 4 * size) {
+    free(S->registers);
+    S->registers = (double*) malloc(4 * size * sizeof(double));
+    S->nregisters = 4 * size;
+  }
+  U0 = &S->registers[0 * size];
+  U1 = &S->registers[1 * size];
+  L = &S->registers[2 * size];
+  Uacc = &S->registers[3 * size];
+
+  for (long n=0; n<ncell; ++n) {
+    fluids_state_derive(fluid[n], &U0[n*Q], FLUIDS_CONSERVED);
+  }
+  if ((err = _setconserved(S, fluid, U0, ndim, shape, Q, ng))) {
+    return err;
+  }
+
+  if (S->time_integrator != FISH_RK4) {
+    for (int s=0; s<nstage; ++s) {
+      double a = RK[nstage-1][s][0];
+      double b = RK[nstage-1][s][1];
+      double *U = s == 0 ? U0 : U1;
+      memset(L, 0, size * sizeof(double));
+      if ((err = _timederivative(S, D, fluid, NULL, NULL, ndim, shape, dx, L,
+				 ng))) {
+	return err;
+      }
+      for (long m=0; m<size; ++m) {
+	U1[m] = a * U0[m] + b * (U[m] + dt * L[m]);
+      }
+      if ((err = _setconserved(S, fluid, U1, ndim, shape, Q, ng))) {
+	return err;
       }
     }
-    free(Fiph);
-    break;
-    /* ---------------------------------- (2d) -------------------------------*/
-  case 2:
-    si = shape[1];
-    sj = 1;
-
-    // ----------------------------
-    // sweeps along the x-direction
-    // ----------------------------
-    slice = (fluids_state **) malloc(shape[0] * sizeof(fluids_state*));
-    Fiph = (double*) malloc(shape[0] * Q *sizeof(double));
-    for (int j=0; j<shape[1]; ++j) {
-      for (int i=0; i<shape[0]; ++i) {
-	slice[i] = fluid[i*si + j*sj];
+  }
+  else {
+    memcpy(Uacc, U0, size * sizeof(double));
+    for (int s=0; s<nstage; ++s) {
+      memset(L, 0, size * sizeof(double));
+      if ((err = _timederivative(S, D, fluid, NULL, NULL, ndim, shape, dx, L,
+				 ng))) {
+	return err;
       }
-      fish_intercellflux(S, slice, Fiph, shape[0], 0);
-      for (int i=0; i<shape[0]; ++i) {
-	for (int q=0; q<Q; ++q) {
-	  int m = (i*si + j*sj)*Q + q;
-	  L[m] -= (Fiph[i*Q+q] - Fiph[(i-1)*Q+q]) / dx[0];
-	}
+      for (long m=0; m<size; ++m) {
+	Uacc[m] += RK4w[s] * dt * L[m];
+	U1[m] = U0[m] + RK4c[s] * dt * L[m];
+      }
+      if ((err = _setconserved(S, fluid, s < nstage - 1 ? U1 : Uacc,
+			       ndim, shape, Q, ng))) {
+	return err;
       }
     }
-    free(Fiph);
-    free(slice);
-
-    // ----------------------------
-    // sweeps along the y-direction
-    // ----------------------------
-    slice = (fluids_state **) malloc(shape[1] * sizeof(fluids_state*));
-    Fiph = (double*) malloc(shape[1] * Q *sizeof(double));
-    for (int i=0; i<shape[0]; ++i) {
-      for (int j=0; j<shape[1]; ++j) {
-	slice[j] = fluid[i*si + j*sj];
+  }
+  return 0;
+}
+
+
+int _setconserved(fish_state *S, fluids_state **fluid, double *U,
+		  int ndim, int *shape, int Q, int ng)
+/* -----------------------------------------------------------------------------
+ * Fills the guard zones of the conserved variables U, and then recovers the
+ * primitive variables of each fluid state from them.
+ * -----------------------------------------------------------------------------
+ */
+{
+  long ncell = 1;
+  int err = _boundary(S, U, ndim, shape, Q, ng);
+  if (err) {
+    return err;
+  }
+  for (int d=0; d<ndim; ++d) {
+    ncell *= shape[d];
+  }
+  return fish_fromconserved(S, fluid, U, ncell);
+}
+
+
+int fish_fromconserved(fish_state *S, fluids_state **fluid, double *U, long N)
+/* -----------------------------------------------------------------------------
+ * Recovers the primitive variables of the N fluid states from the contiguous
+ * array U of their conserved variables, in a single pass. Zones whose density
+ * or pressure (taken to be the first two primitive variables, as for all the
+ * fluid systems) comes out below FISH_DENSITY_FLOOR or FISH_PRESSURE_FLOOR are
+ * raised to the floor, and their entries of U are rewritten to match. Each of
+ * those zones adds one to FISH_ZONES_FLOORED. Returns FISH_ERROR_FROMCONS if
+ * the conversion failed on any zone, which is then left as it was.
+ * -----------------------------------------------------------------------------
+ */
+{
+  fluids_descr *D;
+  double P[MAXQ];
+  int err = 0;
+
+  if (N < 1) {
+    return 0;
+  }
+  fluids_state_getdescr(fluid[0], &D);
+  int Q = fluids_descr_getncomp(D, FLUIDS_CONSERVED);
+  if (fluids_descr_getncomp(D, FLUIDS_PRIMITIVE) > MAXQ) {
+    return FISH_ERROR_BADARG;
+  }
+
+  for (long n=0; n<N; ++n) {
+    if (fluids_state_fromcons(fluid[n], &U[n*Q], FLUIDS_CACHE_DEFAULT)) {
+      err = FISH_ERROR_FROMCONS;
+      continue;
+    }
+    fluids_state_getattr(fluid[n], P, FLUIDS_PRIMITIVE);
+    if (P[0] < S->density_floor || P[1] < S->pressure_floor) {
+      if (P[0] < S->density_floor) P[0] = S->density_floor;
+      if (P[1] < S->pressure_floor) P[1] = S->pressure_floor;
+      fluids_state_setattr(fluid[n], P, FLUIDS_PRIMITIVE);
+      fluids_state_derive(fluid[n], &U[n*Q], FLUIDS_CONSERVED);
+      S->zones_floored += 1;
+    }
+  }
+  return err;
+}
+
+
+int _timederivative(fish_state *S, fluids_descr *D, fluids_state **fluid,
+		    double *P, double *G, int ndim, int *shape, double *dx,
+		    double *L, int ng)
+/* -----------------------------------------------------------------------------
+ * Drives the directional sweeps for both fish_timederivative (fluid is given)
+ * and fish_timederivative_array (P and optionally G are given).
+ * -----------------------------------------------------------------------------
+ */
+{
+  int stride[3];
+  int lo[3], len[3];
+  int ncell = 1;
+  struct fish_sweep sweep[FISH_MAX_THREADS];
+  pthread_t threads[FISH_MAX_THREADS];
+
+  if (ndim < 1 || ndim > 3 || ng < 0) {
+    return FISH_ERROR_BADARG;
+  }
+  int nmax = 0;
+  for (int d=ndim-1; d>=0; --d) {
+    stride[d] = ncell;
+    ncell *= shape[d];
+    nmax = shape[d] > nmax ? shape[d] : nmax;
+    lo[d] = shape[d] > 2 * ng ? ng : 0;
+    len[d] = shape[d] - 2 * lo[d];
+  }
+  for (int d=0; d<3; ++d) {
+    S->max_wavespeed[d] = 0.0;
+  }
+
+  for (int dim=0; dim<ndim; ++dim) {
+    int npencil = 1;
+    for (int d=0; d<ndim; ++d) {
+      if (d != dim) npencil *= len[d];
+    }
+    int nthread = S->num_threads < npencil ? S->num_threads : npencil;
+    int tile = dim == ndim - 1 ? 1 : S->sweep_tile; // last axis is contiguous
+
+    for (int t=0; t<nthread; ++t) {
+      struct fish_sweep sw = {
+	.S = S,
+	.W = _workspace(S, t, D, nmax, tile),
+	.D = D,
+	.fluid = fluid,
+	.P = P,
+	.G = G,
+	.L = L,
+	.ndim = ndim,
+	.dim = dim,
+	.shape = shape,
+	.stride = stride,
+	.lo = lo,
+	.len = len,
+	.dx = dx[dim],
+	.p0 = (t + 0) * npencil / nthread,
+	.p1 = (t + 1) * npencil / nthread,
+	.tile = tile,
+      } ;
+      sweep[t] = sw;
+    }
+    if (nthread == 1) {
+      _sweep(&sweep[0]);
+    }
+    else {
+      for (int t=0; t<nthread; ++t) {
+	pthread_create(&threads[t], NULL, _sweep, &sweep[t]);
       }
-      fish_intercellflux(S, slice, Fiph, shape[1], 1);
-      for (int j=0; j<shape[1]; ++j) {
-	for (int q=0; q<Q; ++q) {
-	  int m = (i*si + j*sj)*Q + q;
-	  L[m] -= (Fiph[j*Q+q] - Fiph[(j-1)*Q+q]) / dx[1];
-	}
+      for (int t=0; t<nthread; ++t) {
+	pthread_join(threads[t], NULL);
       }
     }
-    free(Fiph);
-    free(slice);
-    break;
-  case 3:
-    /* ---------------------------------- (3d) -------------------------------*/
-    si = shape[2] * shape[1];
-    sj = shape[2];
-    sk = 1;
-
-    // ----------------------------
-    // sweeps along the x-direction
-    // ----------------------------
-    slice = (fluids_state **) malloc(shape[0] * sizeof(fluids_state*));
-    Fiph = (double*) malloc(shape[0] * Q *sizeof(double));
-    for (int k=0; k<shape[2]; ++k) {
-      for (int j=0; j<shape[1]; ++j) {
-	for (int i=0; i<shape[0]; ++i) {
-	  slice[i] = fluid[i*si + j*sj + k*sk];
+    if (S->measure_wavespeeds) {
+      for (int t=0; t<nthread; ++t) {
+	if (sweep[t].W->amax > S->max_wavespeed[dim]) {
+	  S->max_wavespeed[dim] = sweep[t].W->amax;
 	}
-	fish_intercellflux(S, slice, Fiph, shape[0], 0);
-	for (int i=0; i<shape[0]; ++i) {
-	  for (int q=0; q<Q; ++q) {
-	    int m = (i*si + j*sj + k*sk)*Q + q;
-	    L[m] -= (Fiph[i*Q+q] - Fiph[(i-1)*Q+q]) / dx[0];
+      }
+    }
+  }
+  return 0;
+}
+
+
+void *_sweep(void *arg)
+/* -----------------------------------------------------------------------------
+ * Computes the flux divergence along the pencils p0 <= p < p1 of a single
+ * directional sweep and subtracts it from L. All scratch memory, including the
+ * Riemann solver, comes from the workspace private to the calling thread.
+ * Pencils are taken a tile at a time: a tile holds up to sw->tile pencils which
+ * are neighbors along the last axis, stored one after another in W->P.
+ * -----------------------------------------------------------------------------
+ */
+{
+  struct fish_sweep *sw = (struct fish_sweep*) arg;
+  struct fish_workspace *W = sw->W;
+  fluids_descr *D = sw->D;
+  int N = sw->shape[sw->dim];
+  int s = sw->stride[sw->dim];
+  int nlast = sw->len[sw->ndim - 1];
+  int Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
+  int QG = (sw->fluid || sw->G) ? fluids_descr_getncomp(D, FLUIDS_GRAVITY) : 0;
+  double *P = W->P;
+  double *G = QG ? W->G : NULL;
+  double *Fiph = W->Fiph;
+  double *L = sw->L;
+
+  W->nuses += QG ? 3 : 2;
+  W->amax = 0.0;
+
+  for (int p=sw->p0, nb; p<sw->p1; p+=nb) {
+    int m0 = _pencil_origin(sw->ndim, sw->lo, sw->len, sw->stride, sw->dim, p);
+
+    /* the tile may not run past the end of this thread's pencils, or wrap
+       around the last axis */
+    nb = sw->tile;
+    if (nb > sw->p1 - p) {
+      nb = sw->p1 - p;
+    }
+    if (nb > nlast - p % nlast) {
+      nb = nlast - p % nlast;
+    }
+
+    if (sw->fluid) {
+      for (int i=0; i<N; ++i) {
+	for (int b=0; b<nb; ++b) {
+	  fluids_state *si = sw->fluid[m0 + i*s + b];
+	  fluids_state_getattr(si, &P[(b*N + i)*Q], FLUIDS_PRIMITIVE);
+	  if (QG) {
+	    fluids_state_getattr(si, &G[(b*N + i)*QG], FLUIDS_GRAVITY);
 	  }
 	}
       }
     }
-    free(Fiph);
-    free(slice);
-
-    // ----------------------------
-    // sweeps along the y-direction
-    // ----------------------------
-    slice = (fluids_state **) malloc(shape[1] * sizeof(fluids_state*));
-    Fiph = (double*) malloc(shape[1] * Q *sizeof(double));
-    for (int i=0; i<shape[0]; ++i) {
-      for (int k=0; k<shape[2]; ++k) {
-	for (int j=0; j<shape[1]; ++j) {
-	  slice[j] = fluid[i*si + j*sj + k*sk];
-	}
-	fish_intercellflux(S, slice, Fiph, shape[1], 1);
-	for (int j=0; j<shape[1]; ++j) {
-	  for (int q=0; q<Q; ++q) {
-	    int m = (i*si + j*sj + k*sk)*Q + q;
-	    L[m] -= (Fiph[j*Q+q] - Fiph[(j-1)*Q+q]) / dx[1];
+    else {
+      for (int i=0; i<N; ++i) {
+	for (int b=0; b<nb; ++b) {
+	  int m = m0 + i*s + b;
+	  memcpy(&P[(b*N + i)*Q], &sw->P[m*Q], Q * sizeof(double));
+	  if (QG) {
+	    memcpy(&G[(b*N + i)*QG], &sw->G[m*QG], QG * sizeof(double));
 	  }
 	}
       }
     }
-    free(Fiph);
-    free(slice);
-
-    // ----------------------------
-    // sweeps along the z-direction
-    // ----------------------------
-    slice = (fluids_state **) malloc(shape[2] * sizeof(fluids_state*));
-    Fiph = (double*) malloc(shape[2] * Q *sizeof(double));
-    for (int j=0; j<shape[1]; ++j) {
-      for (int i=0; i<shape[0]; ++i) {
-	for (int k=0; k<shape[2]; ++k) {
-	  slice[k] = fluid[i*si + j*sj + k*sk];
-	}
-	fish_intercellflux(S, slice, Fiph, shape[2], 2);
-	for (int k=0; k<shape[2]; ++k) {
-	  for (int q=0; q<Q; ++q) {
-	    int m = (i*si + j*sj + k*sk)*Q + q;
-	    L[m] -= (Fiph[k*Q+q] - Fiph[(k-1)*Q+q]) / dx[2];
-	  }
+    for (int b=0; b<nb; ++b) {
+      _intercellflux(sw->S, W, D, &P[b*N*Q], QG ? &G[b*N*QG] : NULL,
+		     &Fiph[b*N*Q], N, sw->dim);
+    }
+    for (int i=1; i<N; ++i) {
+      for (int b=0; b<nb; ++b) {
+	double *Fp = &Fiph[(b*N + i - 0)*Q];
+	double *Fm = &Fiph[(b*N + i - 1)*Q];
+	double *Lm = &L[(m0 + i*s + b)*Q];
+	for (int q=0; q<Q; ++q) {
+	  Lm[q] -= (Fp[q] - Fm[q]) / sw->dx;
 	}
       }
     }
-    free(Fiph);
-    free(slice);
-    break;
   }
-  return 0;
+  return NULL;
 }
 
 
-int _intercell_godunov(fish_state *S, fluids_state **fluid, double *F, int N,
-                       int dim)
+int _pencil_origin(int ndim, int *lo, int *len, int *stride, int dim, int p)
+/* -----------------------------------------------------------------------------
+ * Returns the index of the first cell of the p-th pencil along axis dim, where
+ * pencils are enumerated in C order over the remaining axes, each restricted to
+ * the len[d] indices starting at lo[d].
+ * -----------------------------------------------------------------------------
+ */
 {
-  fluids_descr *D;
-  fluids_state_getdescr(fluid[0], &D);
+  int m0 = 0;
+  for (int d=ndim-1; d>=0; --d) {
+    if (d == dim) continue;
+    m0 += (lo[d] + p % len[d]) * stride[d];
+    p /= len[d];
+  }
+  return m0;
+}
 
+int _intercell_godunov(fish_state *S, struct fish_workspace *W,
+		       fluids_descr *D, double *P, double *G,
+		       double *F, int N, int dim)
+/* -----------------------------------------------------------------------------
+ * P and G are contiguous pencils of primitive and gravitational fields, of size
+ * N*Q and N*QG respectively. G may be NULL. The fluid states and the Riemann
+ * solver are taken from the workspace W, which must have been prepared for the
+ * descriptor D.
+ * -----------------------------------------------------------------------------
+ */
+{
+  int n0, n1;
+  double Pl[MAXQ], Pr[MAXQ];
+  double Gl[MAXQ], Gr[MAXQ];
+  double lam[MAXQ];
   int Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
-  fluids_state *S_ = fluids_state_new();
-  fluids_state *SL = fluids_state_new();
-  fluids_state *SR = fluids_state_new();
+  int QG = G ? fluids_descr_getncomp(D, FLUIDS_GRAVITY) : 0;
+  double *T = W->T;
+  double *Fl = W->Fl;
+  double *Fr = W->Fr;
+  fluids_state *S_ = W->S_;
+  fluids_state *SL = W->SL;
+  fluids_state *SR = W->SR;
+  fluids_riemn *R = W->R;
+
+  W->nuses += 4;
+  fluids_riemn_setsolver(R, S->riemann_solver);
+  fluids_riemn_setdim(R, dim);
+
+  switch (S->reconstruction) {
+  case FISH_PCM: n0 = 0; n1 = N-1; break;
+  case FISH_PLM: n0 = 1; n1 = N-2; break;
+  case FISH_WENO5: n0 = 2; n1 = N-3; break;
+  default: n0 = 0; n1 = 0; break;
+  }
 
   /* prevent the use of uninitialized bytes */
-  for (int n=0; n<N*Q; ++n) {
+  for (int n=0; n<n0*Q && n<N*Q; ++n) {
+    F[n] = 0.0;
+  }
+  for (int n=(n1 > 0 ? n1 : 0)*Q; n<N*Q; ++n) {
     F[n] = 0.0;
   }
 
-  /* Assumes all states have the same descriptor, after all what sense does this
-     make otherwise? */
-  fluids_state_setdescr(S_, D);
-  fluids_state_setdescr(SL, D);
-  fluids_state_setdescr(SR, D);
-  fluids_state_cache(S_, FLUIDS_CACHE_CREATE);
-  fluids_state_cache(SL, FLUIDS_CACHE_CREATE);
-  fluids_state_cache(SR, FLUIDS_CACHE_CREATE);
+  /* transpose the pencil so that each component is contiguous, the rows of T
+     are the Q primitive components followed by the QG gravitational ones */
+  for (int n=0; n<N; ++n) {
+    for (int q=0; q<Q; ++q) {
+      T[q*N + n] = P[n*Q + q];
+    }
+    for (int q=0; q<QG; ++q) {
+      T[(Q+q)*N + n] = G[n*QG + q];
+    }
+  }
+  for (int q=0; q<Q+QG; ++q) {
+ // THERE SHOULD BE A SWITCH HERE SOMEHOW TO CHOOSE BETWEEN GRAVITY
+ // RECONSTRUCTION METHODS
+    int method = q < Q ? S->reconstruction : FISH_AVG;
+    _reconstruct_faces(S, &T[q*N], &T[q*N+1], &Fl[q*N], &Fr[q*N], n0, n1, 1,
+		       method);
+  }
 
-  fluids_riemn *R = fluids_riemn_new();
-  fluids_riemn_setsolver(R, S->riemann_solver);
-  fluids_riemn_setdim(R, dim);
-  fluids_riemn_setstateL(R, SL);
-  fluids_riemn_setstateR(R, SR);
+  for (int n=n0; n<n1; ++n) {
+    for (int q=0; q<Q; ++q) {
+      Pl[q] = Fl[q*N + n];
+      Pr[q] = Fr[q*N + n];
+    }
+    fluids_state_setattr(SL, Pl, FLUIDS_PRIMITIVE);
+    fluids_state_setattr(SR, Pr, FLUIDS_PRIMITIVE);
+    if (QG) {
+      for (int q=0; q<QG; ++q) {
+	Gl[q] = Fl[(Q+q)*N + n];
+	Gr[q] = Fr[(Q+q)*N + n];
+      }
+      fluids_state_setattr(SL, Gl, FLUIDS_GRAVITY);
+      fluids_state_setattr(SR, Gr, FLUIDS_GRAVITY);
+    }
+    fluids_riemn_execute(R);
+    fluids_riemn_sample(R, S_, 0.0);
+    fluids_state_derive(S_, &F[Q*n], FLUIDS_FLUX[dim]);
 
- // THERE SHOULD BE A SWITCH HERE SOMEHOW TO CHOOSE BETWEEN GRAVITY 
- // RECONSTRUCTION METHODS
-  switch (S->reconstruction) {
-  case FISH_PCM:
-    for (int n=0; n<N-1; ++n) {
-      _pcm(S, &fluid[n], SL, SR, FLUIDS_PRIMITIVE);
-      _avg(S, &fluid[n], SL, SR, FLUIDS_GRAVITY);
-      fluids_riemn_execute(R);
-      fluids_riemn_sample(R, S_, 0.0);
-      fluids_state_derive(S_, &F[Q*n], FLUIDS_FLUX[dim]);
-    }
-    break;
-  case FISH_PLM:
-    for (int n=1; n<N-2; ++n) {
-      _plm(S, &fluid[n], SL, SR, FLUIDS_PRIMITIVE);
-      _avg(S, &fluid[n], SL, SR, FLUIDS_GRAVITY);
-      fluids_riemn_execute(R);
-      fluids_riemn_sample(R, S_, 0.0);
-      fluids_state_derive(S_, &F[Q*n], FLUIDS_FLUX[dim]);
-    }
-    break;
-  case FISH_WENO5:
-    for (int n=2; n<N-3; ++n) {
-      _weno5(S, &fluid[n], SL, SR, FLUIDS_PRIMITIVE);
-      _avg(S, &fluid[n], SL, SR, FLUIDS_GRAVITY);
-      fluids_riemn_execute(R);
-      fluids_riemn_sample(R, S_, 0.0);
-      fluids_state_derive(S_, &F[Q*n], FLUIDS_FLUX[dim]);
-    }
-  default:
-    break;
-  }
-
-  fluids_state_del(SL);
-  fluids_state_del(SR);
-  fluids_state_del(S_);
-  fluids_riemn_del(R);
+    if (S->measure_wavespeeds) {
+      fluids_state *face[2] = {SL, SR};
+      for (int s=0; s<2; ++s) {
+	fluids_state_derive(face[s], lam, FLUIDS_EVAL[dim]);
+	for (int q=0; q<Q; ++q) {
+	  if (fabs(lam[q]) > W->amax) {
+	    W->amax = fabs(lam[q]);
+	  }
+	}
+      }
+    }
+  }
   return 0;
 }
 
 
-int _intercell_spectral(fish_state *S, fluids_state **fluid, double *Fiph,
-			int N, int dim)
+int _intercell_spectral(fish_state *S, struct fish_workspace *W,
+			fluids_descr *D, double *P, double *Fiph, int N, int dim)
 /* -----------------------------------------------------------------------------
  *
  * This function uses characteristic decomposition to find the intercell
@@ -340,86 +781,96 @@ int _intercell_spectral(fish_state *S, fluids_state **fluid, double *Fiph,
  * eigenvectors. PCM, PLM, and WENO5 reconstruction may be used. There's
  * presently no support for fluid systems woth gravity, although adding it here
  * is only a matter of choosing a reconstruction type for the gravitational
- * field. Right now the function hard-codes Q=5 primitive variables, but that
- * can easily be changed.
+ * field. The number of primitive variables Q is taken from the descriptor. P
+ * is a contiguous pencil of N*Q primitive variables. Scratch states and
+ * buffers are taken from the workspace W.
  *
  *
  * (1) Compute max eigenvalue A, flux F, and conserved U in each zone
  *
  * (2) Arithmetically average L/R primitive states to form L/R face-centered
- *     eigenvectors
+ *     eigenvectors, for all faces of the pencil at once
  *
  * (3) Get max wave-speed over local 6-zone stencil
  *
  * (4) Create F+ and F- fluxes over each of those 6 zones
  *
  * (5) Decompose F+ and F- into f+ and f-, characteristic right and left-going
- *     fluxes in each zone
+ *     fluxes in each zone, as a single (Q x Q) by (Q x 6) product per face
  *
  * (6) Use reconstruction on the stencil to get a left and right going
- *     characteristic f
+ *     characteristic f, one component at a time along the whole pencil
  *
  * (7) Rotate f into back into F
  *
  * -----------------------------------------------------------------------------
  */
 {
-  double Pl[5], Pr[5], Pface[5];
-  double Liph[5][5], Riph[5][5];
-  double fp[6][5];
-  double fm[6][5];
-  double fpT[5][6];
-  double fmT[5][6];
-  double Fp[5];
-  double Fm[5];
-  double f[5];
-
-  fluids_state *face = fluids_state_new();
-  fluids_descr *D;
-  fluids_state_getdescr(fluid[0], &D);
-  fluids_state_setdescr(face, D);
-  fluids_state_cache(face, FLUIDS_CACHE_CREATE);
+  fluids_state *face = W->face;
+  fluids_state *zone = W->zone;
 
   int Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
-  double *A = (double*) malloc(N*1*sizeof(double)); // array of max eigenvalues
-  double *F = (double*) malloc(N*Q*sizeof(double)); // array of fluxes
-  double *U = (double*) malloc(N*Q*sizeof(double)); // array of conserved
+  int QQ = Q*Q;
+  int n0 = 2, n1 = N-3; // range of faces with a complete 6-zone stencil
+  double *A = W->A; // array of max eigenvalues
+  double *F = W->F; // array of fluxes
+  double *U = W->U; // array of conserved
+  double *lam = W->lam; // array of eigenvalues
+  double *Pface = W->T; // face-averaged primitive variables
+  double *Liph = W->Liph; // face left eigenvectors, Q*Q per face
+  double *Riph = W->Riph; // face right eigenvectors, Q*Q per face
+  double *fpS = W->fp; // component-major stencils of f+, 6 per face
+  double *fmS = W->fm; // component-major stencils of f-, 6 per face
+  double *Fl = W->Fl;
+  double *Fr = W->Fr;
+  double *Fp = &W->st[0*Q]; // (Q x 6) stencils of F+ and F- for one face
+  double *Fm = &W->st[6*Q];
+
+  W->nuses += 5;
 
   /* prevent the use of uninitialized bytes */
-  for (int n=0; n<N*Q; ++n) {
-    F[n] = 0.0;
+  for (int n=0; n<n0*Q && n<N*Q; ++n) {
+    Fiph[n] = 0.0;
+  }
+  for (int n=(n1 > 0 ? n1 : 0)*Q; n<N*Q; ++n) {
+    Fiph[n] = 0.0;
   }
 
+  /*--------------------------------- (1) --------------------------------- */
   for (int n=0; n<N; ++n) {
-    /*--------------------------------- (1) --------------------------------- */
-    double lam[5];
     long flags = FLUIDS_EVAL[dim] | FLUIDS_FLUX[dim] | FLUIDS_CONSERVED;
 
-    fluids_state_derive(fluid[n], NULL, flags);
-    fluids_state_getcached(fluid[n], lam, FLUIDS_EVAL[dim]);
-    fluids_state_getcached(fluid[n], &F[Q*n], FLUIDS_FLUX[dim]);
-    fluids_state_getcached(fluid[n], &U[Q*n], FLUIDS_CONSERVED);
+    fluids_state_setattr(zone, &P[Q*n], FLUIDS_PRIMITIVE);
+    fluids_state_derive(zone, NULL, flags);
+    fluids_state_getcached(zone, &lam[Q*n], FLUIDS_EVAL[dim]);
+    fluids_state_getcached(zone, &F[Q*n], FLUIDS_FLUX[dim]);
+    fluids_state_getcached(zone, &U[Q*n], FLUIDS_CONSERVED);
 
     A[n] = 0.0;
     for (int q=0; q<Q; ++q) {
-      if (fabs(lam[q]) > A[n]) {
-       	A[n] = fabs(lam[q]);
+      if (fabs(lam[Q*n+q]) > A[n]) {
+       	A[n] = fabs(lam[Q*n+q]);
       }
     }
+    if (A[n] > W->amax) {
+      W->amax = A[n];
+    }
   }
 
-  for (int n=2; n<N-3; ++n) {
-
-    /*--------------------------------- (2) --------------------------------- */
-    fluids_state_getattr(fluid[n+0], Pl, FLUIDS_PRIMITIVE);
-    fluids_state_getattr(fluid[n+1], Pr, FLUIDS_PRIMITIVE);
+  /*--------------------------------- (2) --------------------------------- */
+  for (int n=n0; n<n1; ++n) {
     for (int q=0; q<Q; ++q) {
-      Pface[q] = 0.5*(Pl[q] + Pr[q]);
+      Pface[Q*n+q] = 0.5*(P[Q*(n+0)+q] + P[Q*(n+1)+q]);
     }
-    fluids_state_setattr(face, Pface, FLUIDS_PRIMITIVE);
+  }
+  for (int n=n0; n<n1; ++n) {
+    fluids_state_setattr(face, &Pface[Q*n], FLUIDS_PRIMITIVE);
     fluids_state_derive(face, NULL, FLUIDS_LEVECS[dim] | FLUIDS_REVECS[dim]);
-    fluids_state_getcached(face, Liph[0], FLUIDS_LEVECS[dim]);
-    fluids_state_getcached(face, Riph[0], FLUIDS_REVECS[dim]);
+    fluids_state_getcached(face, &Liph[QQ*n], FLUIDS_LEVECS[dim]);
+    fluids_state_getcached(face, &Riph[QQ*n], FLUIDS_REVECS[dim]);
+  }
+
+  for (int n=n0; n<n1; ++n) {
 
     /*--------------------------------- (3) --------------------------------- */
     double ml = 0.0;
@@ -429,164 +880,170 @@ int _intercell_spectral(fish_state *S, fluids_state **fluid, double *Fiph,
       }
     }
 
-    /*--------------------------------- (4,5) ------------------------------- */
-    for (int j=0; j<6; ++j) {
-      for (int q=0; q<Q; ++q) {
+    /*--------------------------------- (4) --------------------------------- */
+    for (int q=0; q<Q; ++q) {
+      for (int j=0; j<6; ++j) {
 	/*
 	 * local Lax-Friedrichs flux splitting
 	 */
 	int m = (n+j-2)*Q + q;
-	Fp[q] = 0.5*(F[m] + ml*U[m]);
-	Fm[q] = 0.5*(F[m] - ml*U[m]);
-      }
-      _matrix_product(Liph[0], Fp, fp[j], Q, 1, Q);
-      _matrix_product(Liph[0], Fm, fm[j], Q, 1, Q);
-    }
-    for (int q=0; q<Q; ++q) {
-      for (int j=0; j<6; ++j) {
-	fpT[q][j] = fp[j][q];
-	fmT[q][j] = fm[j][q];
+	Fp[q*6+j] = 0.5*(F[m] + ml*U[m]);
+	Fm[q*6+j] = 0.5*(F[m] - ml*U[m]);
       }
     }
 
-    /*--------------------------------- (6,7) ------------------------------- */
-    switch (S->reconstruction) {
-    case FISH_PCM:
-      for (int q=0; q<Q; ++q) {
-	f[q] = (_reconstruct(S, &fpT[q][2], PCM_C2R) +
-		_reconstruct(S, &fmT[q][3], PCM_C2L));
-      }
-      break;
-    case FISH_PLM:
-      for (int q=0; q<Q; ++q) {
-	f[q] = (_reconstruct(S, &fpT[q][2], PLM_C2R) +
-		_reconstruct(S, &fmT[q][3], PLM_C2L));
-      }
-      break;
-    case FISH_AVG:
-      for (int q=0; q<Q; ++q) {
-	f[q] = (_reconstruct(S, &fpT[q][2], AVG_C2R) +
-		_reconstruct(S, &fmT[q][3], AVG_C2L));
-      }
-      break;
-    case FISH_WENO5:
-      for (int q=0; q<Q; ++q) {
-	f[q] = (_reconstruct(S, &fpT[q][2], WENO5_FD_C2R) +
-		_reconstruct(S, &fmT[q][3], WENO5_FD_C2L));
+    /*--------------------------------- (5) --------------------------------- */
+    _stencil_product(&Liph[QQ*n], Fp, &fpS[n*6], Q, N*6);
+    _stencil_product(&Liph[QQ*n], Fm, &fmS[n*6], Q, N*6);
+  }
+
+  /*--------------------------------- (6) --------------------------------- */
+  for (int q=0; q<Q; ++q) {
+    _reconstruct_faces(S, &fpS[q*N*6 + 2], &fmS[q*N*6 + 3], &Fl[q*N], &Fr[q*N],
+		       n0, n1, 6, S->reconstruction);
+  }
+
+  /*--------------------------------- (7) --------------------------------- */
+  for (int n=n0; n<n1; ++n) {
+    double *R = &Riph[QQ*n];
+    for (int i=0; i<Q; ++i) {
+      double Fi = 0.0;
+      for (int k=0; k<Q; ++k) {
+	Fi += R[i*Q+k] * (Fl[k*N+n] + Fr[k*N+n]);
       }
-      break;
+      Fiph[n*Q+i] = Fi;
     }
-    _matrix_product(Riph[0], f, &Fiph[n*Q], Q, 1, Q);
-    double P_[5];
-    fluids_state_getattr(face, P_, FLUIDS_PRIMITIVE);
   }
-  fluids_state_del(face);
-  free(A);
-  free(F);
-  free(U);
   return 0;
 }
 
-void _pcm(fish_state *S, fluids_state **src, fluids_state *L,
-	  fluids_state *R, long flag)
-{
-  double Pl[MAXQ], Pr[MAXQ];
-  fluids_descr *D;
-  int fluid;
-  fluids_state_getdescr(src[0], &D);
-  fluids_descr_getfluid(D, &fluid);
-  fluids_state_getattr(src[0], Pl, flag);
-  fluids_state_getattr(src[1], Pr, flag);
-  fluids_state_setattr(L, Pl, flag);
-  fluids_state_setattr(R, Pr, flag);
-}
-
 
-void _avg(fish_state *S, fluids_state **src, fluids_state *L,
-	  fluids_state *R, long flag)
+struct fish_workspace *_workspace(fish_state *S, int t, fluids_descr *D, int N,
+			  int tile)
+/* -----------------------------------------------------------------------------
+ * Returns the workspace belonging to thread t, after making sure its fluid
+ * states were created for the descriptor D and its buffers hold at least N
+ * zones, or a tile of that many pencils for the P, G and Fiph buffers.
+ * Workspaces only ever grow, and are released by fish_del.
+ * -----------------------------------------------------------------------------
+ */
 {
-  double P[4][MAXQ];
-  double Pl[MAXQ], Pr[MAXQ];
-  fluids_descr *D;
-  int fluid;
-  fluids_state_getdescr(src[0], &D);
-  fluids_descr_getfluid(D, &fluid);
-  int Q = fluids_descr_getncomp(D, flag);
-  for (int j=-1; j<3; ++j) {
-    fluids_state_getattr(src[j], P[j+1], flag);
+  struct fish_workspace *W = S->workspace[t];
+  int Q = fluids_descr_getncomp(D, FLUIDS_PRIMITIVE);
+  int QG = fluids_descr_getncomp(D, FLUIDS_GRAVITY);
+  int ncomp = Q + QG;
+
+  if (W == NULL) {
+    W = (struct fish_workspace*) calloc(1, sizeof(struct fish_workspace));
+    S->workspace[t] = W;
   }
-  for (int q=0; q<Q; ++q) {
-    double v[4];
-    for (int j=0; j<4; ++j) {
-      v[j] = P[j][q];
+
+  if (W->descr != D) {
+    fluids_state **states[5] = { &W->S_, &W->SL, &W->SR, &W->face, &W->zone };
+    for (int i=0; i<5; ++i) {
+      if (*states[i]) {
+	fluids_state_del(*states[i]);
+      }
+      *states[i] = fluids_state_new();
+      fluids_state_setdescr(*states[i], D);
+      fluids_state_cache(*states[i], FLUIDS_CACHE_CREATE);
     }
-    Pl[q] = _reconstruct(S, &v[1], AVG_C2R);
-    Pr[q] = _reconstruct(S, &v[2], AVG_C2L);
+    if (W->R == NULL) {
+      W->R = fluids_riemn_new();
+    }
+    fluids_riemn_setstateL(W->R, W->SL);
+    fluids_riemn_setstateR(W->R, W->SR);
+    W->descr = D;
+    W->nallocs += 6;
   }
-  fluids_state_setattr(L, Pl, flag);
-  fluids_state_setattr(R, Pr, flag);
-}
 
-void _plm(fish_state *S, fluids_state **src, fluids_state *L,
-	  fluids_state *R, long flag)
-{
-  double P[4][MAXQ];
-  double Pl[MAXQ], Pr[MAXQ];
-  fluids_descr *D;
-  int fluid;
-  fluids_state_getdescr(src[0], &D);
-  fluids_descr_getfluid(D, &fluid);
-  int Q = fluids_descr_getncomp(D, flag);
-  for (int j=-1; j<3; ++j) {
-    fluids_state_getattr(src[j], P[j+1], flag);
-  }
-  for (int q=0; q<Q; ++q) {
-    double v[4];
-    for (int j=0; j<4; ++j) {
-      v[j] = P[j][q];
+  if (N > W->size || ncomp > W->ncomp || tile > W->tile) {
+    int size = N > W->size ? N : W->size;
+    ncomp = ncomp > W->ncomp ? ncomp : W->ncomp;
+    tile = tile > W->tile ? tile : W->tile;
+    struct { double **buf; int count; } buffers[] = {
+      { &W->P, size * ncomp * tile },
+      { &W->G, size * ncomp * tile },
+      { &W->Fiph, size * ncomp * tile },
+      { &W->A, size },
+      { &W->F, size * ncomp },
+      { &W->U, size * ncomp },
+      { &W->lam, size * ncomp },
+      { &W->T, size * ncomp },
+      { &W->Fl, size * ncomp },
+      { &W->Fr, size * ncomp },
+      { &W->fp, size * ncomp * 6 },
+      { &W->fm, size * ncomp * 6 },
+      { &W->Liph, size * ncomp * ncomp },
+      { &W->Riph, size * ncomp * ncomp },
+      { &W->st, ncomp * 6 * 2 },
+    } ;
+    int nbuf = sizeof(buffers) / sizeof(buffers[0]);
+    for (int i=0; i<nbuf; ++i) {
+      free(*buffers[i].buf);
+      *buffers[i].buf = (double*) malloc(buffers[i].count * sizeof(double));
     }
-    Pl[q] = _reconstruct(S, &v[1], PLM_C2R);
-    Pr[q] = _reconstruct(S, &v[2], PLM_C2L);
+    W->size = size;
+    W->ncomp = ncomp;
+    W->tile = tile;
+    W->nallocs += nbuf;
   }
-  fluids_state_setattr(L, Pl, flag);
-  fluids_state_setattr(R, Pr, flag);
+  return W;
 }
 
-void _weno5(fish_state *S, fluids_state **src, fluids_state *L,
-	    fluids_state *R, long flag)
+void _workspace_del(struct fish_workspace *W)
 {
-  double P[6][MAXQ];
-  double Pl[MAXQ], Pr[MAXQ];
-  fluids_descr *D;
-  int fluid;
-  fluids_state_getdescr(src[0], &D);
-  fluids_descr_getfluid(D, &fluid);
-  int Q = fluids_descr_getncomp(D, flag);
-  for (int j=-2; j<4; ++j) {
-    fluids_state_getattr(src[j], P[j+2], flag);
+  if (W == NULL) {
+    return;
   }
-  for (int q=0; q<Q; ++q) {
-    double v[6];
-    for (int j=0; j<6; ++j) {
-      v[j] = P[j][q];
+  fluids_state *states[5] = { W->S_, W->SL, W->SR, W->face, W->zone };
+  for (int i=0; i<5; ++i) {
+    if (states[i]) {
+      fluids_state_del(states[i]);
     }
-    Pl[q] = _reconstruct(S, &v[2], WENO5_FD_C2R);
-    Pr[q] = _reconstruct(S, &v[3], WENO5_FD_C2L);
   }
-  fluids_state_setattr(L, Pl, flag);
-  fluids_state_setattr(R, Pr, flag);
+  if (W->R) {
+    fluids_riemn_del(W->R);
+  }
+  free(W->P);
+  free(W->G);
+  free(W->Fiph);
+  free(W->A);
+  free(W->F);
+  free(W->U);
+  free(W->lam);
+  free(W->T);
+  free(W->Fl);
+  free(W->Fr);
+  free(W->fp);
+  free(W->fm);
+  free(W->Liph);
+  free(W->Riph);
+  free(W->st);
+  free(W);
 }
 
 
-int _matrix_product(double *A, double *B, double *C, int ni, int nj, int nk)
+void _stencil_product(double *A, double *B, double *C, int Q, int ldc)
+/* -----------------------------------------------------------------------------
+ * Computes the (Q x 6) product C = A B of the (Q x Q) matrix A and the (Q x 6)
+ * matrix B. Rows of C are ldc apart. The inner loop runs along the 6 stencil
+ * zones, and each entry is summed in the same order as a matrix-vector product
+ * would.
+ * -----------------------------------------------------------------------------
+ */
 {
-  for (int i=0; i<ni; ++i) {
-    for (int j=0; j<nj; ++j) {
-      C[i*nj+j] = 0.0;
-      for (int k=0; k<nk; ++k) {
-	C[i*nj+j] += A[i*nk+k] * B[k*nj+j];
+  for (int i=0; i<Q; ++i) {
+    double *Ci = &C[i*ldc];
+    for (int j=0; j<6; ++j) {
+      Ci[j] = 0.0;
+    }
+    for (int k=0; k<Q; ++k) {
+      double a = A[i*Q+k];
+      double *Bk = &B[k*6];
+      for (int j=0; j<6; ++j) {
+	Ci[j] += a * Bk[j];
       }
     }
   }
-  return 0;
 }
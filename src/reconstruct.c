@@ -95,58 +95,145 @@ double __avg(fish_state *S, double *v, double sgn)
   return (v[0] + v[sgnsgn]) / 2 ; /*S*/
 }
 
-double __weno5(fish_state *S, double *v, double c[3][3], double d[3])
+static inline void __weno5_stencils(double *v, double c[3][3],
+				    double vs[3], double B[3])
+{
+  vs[0] = c[0][0]*v[+0] + c[0][1]*v[+1] + c[0][2]*v[2];
+  vs[1] = c[1][0]*v[-1] + c[1][1]*v[+0] + c[1][2]*v[1];
+  vs[2] = c[2][0]*v[-2] + c[2][1]*v[-1] + c[2][2]*v[0];
+
+  // smoothness indicators
+  B[0] = ((13./12.)*SQU(1*v[+0] - 2*v[+1] + 1*v[+2]) +
+	  ( 1./ 4.)*SQU(3*v[+0] - 4*v[+1] + 1*v[+2]));
+  B[1] = ((13./12.)*SQU(1*v[-1] - 2*v[+0] + 1*v[+1]) +
+	  ( 1./ 4.)*SQU(1*v[-1] - 0*v[+0] - 1*v[+1]));
+  B[2] = ((13./12.)*SQU(1*v[-2] - 2*v[-1] + 1*v[+0]) +
+	  ( 1./ 4.)*SQU(1*v[-2] - 4*v[-1] + 3*v[+0]));
+}
+
+static inline double __weno5_jiangshu96(double *v, double c[3][3],
+					double d[3])
+{
+  double eps_prime = 1e-6; // recommended value by Jiang and Shu
+  double vs[3], B[3], w[3];
+  __weno5_stencils(v, c, vs, B);
+  w[0] = d[0] / SQU(eps_prime + B[0]);
+  w[1] = d[1] / SQU(eps_prime + B[1]);
+  w[2] = d[2] / SQU(eps_prime + B[2]);
+  double wtot = w[0] + w[1] + w[2];
+  return (w[0]*vs[0] + w[1]*vs[1] + w[2]*vs[2])/wtot;
+}
+
+static inline double __weno5_borges08(double *v, double c[3][3], double d[3])
+{
+  double eps = 1e-14; // Borges uses 1e-40, but has Matlab
+  double vs[3], B[3], w[3];
+  __weno5_stencils(v, c, vs, B);
+  double tau5 = fabs(B[0] - B[2]);
+
+  // Calculate my weights with new smoothness indicators according to Borges
+  w[0] = d[0] * (1.0 + (tau5 / (B[0] + eps)));
+  w[1] = d[1] * (1.0 + (tau5 / (B[1] + eps)));
+  w[2] = d[2] * (1.0 + (tau5 / (B[2] + eps)));
+  double wtot = w[0] + w[1] + w[2];
+  return (w[0]*vs[0] + w[1]*vs[1] + w[2]*vs[2])/wtot;
+}
+
+static inline double __weno5_shenzha10(double *v, double c[3][3], double d[3],
+				       double A)
 // -----------------------------------------------------------------------------
 // Improvement of the WENO scheme smoothness estimator, Shen & Zha (2010)
 // -----------------------------------------------------------------------------
 {
-  double eps = 1e-6;
-  double eps_prime = 1e-6;
-
-  double vs[3] = {
-    c[0][0]*v[+0] + c[0][1]*v[+1] + c[0][2]*v[2],
-    c[1][0]*v[-1] + c[1][1]*v[+0] + c[1][2]*v[1],
-    c[2][0]*v[-2] + c[2][1]*v[-1] + c[2][2]*v[0],
-  };
-  double B[3] = { // smoothness indicators
-    (13./12.)*SQU(1*v[+0] - 2*v[+1] + 1*v[+2]) +
-    ( 1./ 4.)*SQU(3*v[+0] - 4*v[+1] + 1*v[+2]),
-    (13./12.)*SQU(1*v[-1] - 2*v[+0] + 1*v[+1]) +
-    ( 1./ 4.)*SQU(1*v[-1] - 0*v[+0] - 1*v[+1]),
-    (13./12.)*SQU(1*v[-2] - 2*v[-1] + 1*v[+0]) +
-    ( 1./ 4.)*SQU(1*v[-2] - 4*v[-1] + 3*v[+0])
-  };
-
-  double w[3];
-  if (S->smoothness_indicator == FISH_ISK_BORGES08) {
-    eps = eps_prime = 1e-14; // Borges uses 1e-40, but has Matlab
-    double tau5 = fabs(B[0] - B[2]);
-
-    // Calculate my weights with new smoothness indicators according to Borges
-    w[0] = d[0] * (1.0 + (tau5 / (B[0] + eps)));
-    w[1] = d[1] * (1.0 + (tau5 / (B[1] + eps)));
-    w[2] = d[2] * (1.0 + (tau5 / (B[2] + eps)));
-  }
-  else if (S->smoothness_indicator == FISH_ISK_SHENZHA10) {
-    eps = 1e-6;
-    eps_prime = 1e-10;
-    double A = S->shenzha10_param;
-    double minB = min3(B), maxB = max3(B);
-    double R0 = minB / (maxB + eps_prime);
-    B[0] = R0*A*minB + B[0];
-    B[1] = R0*A*minB + B[1];
-    B[2] = R0*A*minB + B[2];
-    w[0] = d[0] / SQU(eps_prime + B[0]);
-    w[1] = d[1] / SQU(eps_prime + B[1]);
-    w[2] = d[2] / SQU(eps_prime + B[2]);
-  }
-  else { // Use JIANGSHU96
-    eps = eps_prime = 1e-6; // recommended value by Jiang and Shu
-    w[0] = d[0] / SQU(eps_prime + B[0]);
-    w[1] = d[1] / SQU(eps_prime + B[1]);
-    w[2] = d[2] / SQU(eps_prime + B[2]);
-  }
-
+  double eps_prime = 1e-10;
+  double vs[3], B[3], w[3];
+  __weno5_stencils(v, c, vs, B);
+  double minB = min3(B), maxB = max3(B);
+  double R0 = minB / (maxB + eps_prime);
+  B[0] = R0*A*minB + B[0];
+  B[1] = R0*A*minB + B[1];
+  B[2] = R0*A*minB + B[2];
+  w[0] = d[0] / SQU(eps_prime + B[0]);
+  w[1] = d[1] / SQU(eps_prime + B[1]);
+  w[2] = d[2] / SQU(eps_prime + B[2]);
   double wtot = w[0] + w[1] + w[2];
   return (w[0]*vs[0] + w[1]*vs[1] + w[2]*vs[2])/wtot;
 }
+
+double __weno5(fish_state *S, double *v, double c[3][3], double d[3])
+{
+  switch (S->smoothness_indicator) {
+  case FISH_ISK_BORGES08: return __weno5_borges08(v, c, d);
+  case FISH_ISK_SHENZHA10: return __weno5_shenzha10(v, c, d,
+						    S->shenzha10_param);
+  default: return __weno5_jiangshu96(v, c, d);
+  }
+}
+
+
+void _reconstruct_faces(fish_state *S, double *vl, double *vr,
+			double *L, double *R, int n0, int n1, int step,
+			int method)
+// -----------------------------------------------------------------------------
+// Pencil-wide version of _reconstruct. For each n0 <= n < n1, the value on the
+// left of a face is reconstructed from the stencil centered on vl[n*step], and
+// the value on its right from the one centered on vr[n*step]:
+//
+//   L[n] = C2R(&vl[n*step]), R[n] = C2L(&vr[n*step])
+//
+// For a contiguous pencil v of zone values, vl = v, vr = v+1 and step = 1 give
+// the states on either side of the faces n+1/2. The kernel is chosen once per
+// call, so that each of the loops below is free of branching.
+// -----------------------------------------------------------------------------
+{
+  switch (method) {
+  case FISH_PCM:
+    for (int n=n0; n<n1; ++n) {
+      L[n] = vl[n*step];
+      R[n] = vr[n*step];
+    }
+    break;
+  case FISH_AVG:
+    for (int n=n0; n<n1; ++n) {
+      double *u = &vl[n*step], *w = &vr[n*step];
+      L[n] = (u[0] + u[+1]) / 2;
+      R[n] = (w[0] + w[-1]) / 2;
+    }
+    break;
+  case FISH_PLM:
+    {
+      double tht = S->plm_theta;
+      for (int n=n0; n<n1; ++n) {
+	double *u = &vl[n*step], *w = &vr[n*step];
+	L[n] = u[0] + 0.5*__plm_minmod(u[-1], u[0], u[1], tht);
+	R[n] = w[0] - 0.5*__plm_minmod(w[-1], w[0], w[1], tht);
+      }
+    }
+    break;
+  case FISH_WENO5:
+    switch (S->smoothness_indicator) {
+    case FISH_ISK_BORGES08:
+      for (int n=n0; n<n1; ++n) {
+	L[n] = __weno5_borges08(&vl[n*step], CeesC2R_FD, DeesC2R_FD);
+	R[n] = __weno5_borges08(&vr[n*step], CeesC2L_FD, DeesC2L_FD);
+      }
+      break;
+    case FISH_ISK_SHENZHA10:
+      {
+	double A = S->shenzha10_param;
+	for (int n=n0; n<n1; ++n) {
+	  L[n] = __weno5_shenzha10(&vl[n*step], CeesC2R_FD, DeesC2R_FD, A);
+	  R[n] = __weno5_shenzha10(&vr[n*step], CeesC2L_FD, DeesC2L_FD, A);
+	}
+      }
+      break;
+    default:
+      for (int n=n0; n<n1; ++n) {
+	L[n] = __weno5_jiangshu96(&vl[n*step], CeesC2R_FD, DeesC2R_FD);
+	R[n] = __weno5_jiangshu96(&vr[n*step], CeesC2L_FD, DeesC2L_FD);
+      }
+      break;
+    }
+    break;
+  }
+}
@@ -1,6 +1,7 @@
 
 
 #include <stdio.h>
+#include <string.h>
 #include <assert.h>
 #include <math.h>
 #define FISH_PRIVATE_DEFS
@@ -48,8 +49,643 @@ int test1()
   return 0;
 }
 
+// Passes when the array-based time derivative agrees with the one computed from
+// fluids_state's, for all solver types and reconstructions
+// -----------------------------------------------------------------------------
+int test2()
+{
+  int shape[2] = {16, 12};
+  double dx[2] = {0.1, 0.1};
+  double P[16*12*5], L0[16*12*5], L1[16*12*5];
+  fluids_state *fluid[16*12];
+  int solvers[2] = {FISH_GODUNOV, FISH_SPECTRAL};
+  int recons[3] = {FISH_PCM, FISH_PLM, FISH_WENO5};
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  for (int n=0; n<16*12; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.1 * sin(0.3 * n);
+    P[5*n + 3] = 0.1 * cos(0.5 * n);
+    P[5*n + 4] = 0.0;
+    fluid[n] = fluids_state_new();
+    fluids_state_setdescr(fluid[n], D);
+    fluids_state_setattr(fluid[n], &P[5*n], FLUIDS_PRIMITIVE);
+  }
+
+  fish_state *S = fish_new();
+  for (int s=0; s<2; ++s) {
+    for (int r=0; r<3; ++r) {
+      fish_setparami(S, solvers[s], FISH_SOLVER_TYPE);
+      fish_setparami(S, recons[r], FISH_RECONSTRUCTION);
+      for (int m=0; m<16*12*5; ++m) {
+	L0[m] = L1[m] = 0.0;
+      }
+      fish_timederivative(S, fluid, 2, shape, dx, L0, 0);
+      fish_timederivative_array(S, D, P, NULL, 2, shape, dx, L1, 0);
+      for (int i=1; i<16; ++i) {
+	for (int j=1; j<12; ++j) {
+	  for (int q=0; q<5; ++q) {
+	    asserteq(L0[(i*12 + j)*5 + q], L1[(i*12 + j)*5 + q]);
+	  }
+	}
+      }
+    }
+  }
+  for (int n=0; n<16*12; ++n) {
+    fluids_state_del(fluid[n]);
+  }
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 2 PASSED\n");
+  return 0;
+}
+
+// Passes when the threaded sweeps give a time derivative bitwise identical to
+// the serial one
+// -----------------------------------------------------------------------------
+int test3()
+{
+  int shape[3] = {10, 9, 8};
+  double dx[3] = {0.1, 0.1, 0.1};
+  int ncell = 10*9*8;
+  double P[10*9*8*5], L0[10*9*8*5], L1[10*9*8*5];
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  for (int n=0; n<ncell; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.1 * sin(0.3 * n);
+    P[5*n + 3] = 0.1 * cos(0.5 * n);
+    P[5*n + 4] = 0.1 * cos(0.9 * n);
+  }
+  for (int m=0; m<ncell*5; ++m) {
+    L0[m] = L1[m] = 0.0;
+  }
+
+  fish_state *S = fish_new();
+  fish_setparami(S, FISH_WENO5, FISH_RECONSTRUCTION);
+  fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L0, 0);
+  assert(fish_setparami(S, 7, FISH_NUM_THREADS) == 0);
+  fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L1, 0);
+  assert(memcmp(L0, L1, sizeof(L0)) == 0);
+  assert(fish_setparami(S, 0, FISH_NUM_THREADS) == FISH_ERROR_BADARG);
+
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 3 PASSED\n");
+  return 0;
+}
+
+// Passes when repeated flux computations reuse the solver workspace
+// -----------------------------------------------------------------------------
+int test4()
+{
+  long avoided0, avoided1;
+  fluids_state *fluid[32];
+  double P[5] = {1, 1, 0, 0, 0};
+  double Fiph[32*5];
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+  for (int n=0; n<32; ++n) {
+    fluid[n] = fluids_state_new();
+    fluids_state_setdescr(fluid[n], D);
+    fluids_state_setattr(fluid[n], P, FLUIDS_PRIMITIVE);
+  }
+
+  fish_state *S = fish_new();
+  fish_intercellflux(S, fluid, Fiph, 32, 0);
+  fish_getparaml(S, &avoided0, FISH_ALLOCS_AVOIDED);
+  fish_intercellflux(S, fluid, Fiph, 16, 0);
+  fish_intercellflux(S, fluid, Fiph, 32, 0);
+  fish_getparaml(S, &avoided1, FISH_ALLOCS_AVOIDED);
+  assert(avoided1 - avoided0 == 2 * 5);
+
+  for (int n=0; n<32; ++n) {
+    fluids_state_del(fluid[n]);
+  }
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 4 PASSED\n");
+  return 0;
+}
+
+// Passes when an axis of length 1 leaves the time derivative as it is along the
+// other axis, with the PLM and WENO5 reconstructions whose stencils are longer
+// than that axis
+// -----------------------------------------------------------------------------
+int test5()
+{
+  int shape1[1] = {8}, shapeA[2] = {8, 1}, shapeB[2] = {1, 8};
+  double dx[2] = {0.1, 0.1};
+  double P[8*5], L1[8*5], LA[8*5], LB[8*5];
+  int reconstructions[2] = {FISH_PLM, FISH_WENO5};
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  for (int n=0; n<8; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.3 * sin(0.3 * n);
+    P[5*n + 3] = 0.0;
+    P[5*n + 4] = 0.0;
+  }
+
+  for (int r=0; r<2; ++r) {
+    fish_state *S = fish_new();
+    fish_setparami(S, FISH_GODUNOV, FISH_SOLVER_TYPE);
+    fish_setparami(S, reconstructions[r], FISH_RECONSTRUCTION);
+    for (int m=0; m<8*5; ++m) {
+      L1[m] = LA[m] = LB[m] = 0.0;
+    }
+    assert(fish_timederivative_array(S, D, P, NULL, 1, shape1, dx, L1, 0) == 0);
+    assert(fish_timederivative_array(S, D, P, NULL, 2, shapeA, dx, LA, 0) == 0);
+    for (int n=0; n<8; ++n) { // velocity along the second axis
+      P[5*n + 3] = P[5*n + 2];
+      P[5*n + 2] = 0.0;
+    }
+    assert(fish_timederivative_array(S, D, P, NULL, 2, shapeB, dx, LB, 0) == 0);
+    for (int n=0; n<8; ++n) {
+      P[5*n + 2] = P[5*n + 3];
+      P[5*n + 3] = 0.0;
+    }
+    for (int n=0; n<8; ++n) {
+      for (int q=0; q<3; ++q) {
+	asserteq(LA[5*n + q], L1[5*n + q]);
+      }
+      asserteq(LB[5*n + 0], L1[5*n + 0]);
+      asserteq(LB[5*n + 1], L1[5*n + 1]);
+      asserteq(LB[5*n + 3], L1[5*n + 2]);
+    }
+    fish_del(S);
+  }
+
+  fluids_descr_del(D);
+  printf("TEST 5 PASSED\n");
+  return 0;
+}
+
+// Passes when the pencil-wide reconstruction kernels agree exactly with the
+// single-value ones, for every method and smoothness indicator
+// -----------------------------------------------------------------------------
+int test6()
+{
+  double v[64], L[64], R[64];
+  int methods[4] = {FISH_PCM, FISH_AVG, FISH_PLM, FISH_WENO5};
+  int c2r[4] = {PCM_C2R, AVG_C2R, PLM_C2R, WENO5_FD_C2R};
+  int c2l[4] = {PCM_C2L, AVG_C2L, PLM_C2L, WENO5_FD_C2L};
+  int isk[3] = {FISH_ISK_JIANGSHU96, FISH_ISK_BORGES08, FISH_ISK_SHENZHA10};
+
+  for (int n=0; n<64; ++n) {
+    v[n] = (n < 32 ? 1.0 : 0.1) + 0.3 * sin(0.4 * n);
+  }
+  fish_state *S = fish_new();
+  fish_setparamd(S, 1.5, FISH_PLM_THETA);
+  fish_setparamd(S, 50.0, FISH_SHENZHA10_PARAM);
+  for (int m=0; m<4; ++m) {
+    for (int k=0; k<3; ++k) {
+      fish_setparami(S, isk[k], FISH_SMOOTHNESS_INDICATOR);
+      _reconstruct_faces(S, v, v+1, L, R, 2, 61, 1, methods[m]);
+      for (int n=2; n<61; ++n) {
+	assert(L[n] == _reconstruct(S, &v[n], c2r[m]));
+	assert(R[n] == _reconstruct(S, &v[n+1], c2l[m]));
+      }
+    }
+  }
+  fish_del(S);
+  printf("TEST 6 PASSED\n");
+  return 0;
+}
+
+// Passes when tiled sweeps reproduce the pencil-at-a-time result exactly, for
+// both the fluid state and array versions of the time derivative
+// -----------------------------------------------------------------------------
+int test7()
+{
+  int shape[3] = {10, 9, 8};
+  double dx[3] = {0.1, 0.1, 0.1};
+  int ncell = 10*9*8;
+  double P[10*9*8*5], L0[10*9*8*5], L1[10*9*8*5], L2[10*9*8*5];
+  fluids_state *fluid[10*9*8];
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  for (int n=0; n<ncell; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.1 * sin(0.3 * n);
+    P[5*n + 3] = 0.1 * cos(0.5 * n);
+    P[5*n + 4] = 0.1 * cos(0.9 * n);
+    fluid[n] = fluids_state_new();
+    fluids_state_setdescr(fluid[n], D);
+    fluids_state_setattr(fluid[n], &P[5*n], FLUIDS_PRIMITIVE);
+  }
+  for (int m=0; m<ncell*5; ++m) {
+    L0[m] = L1[m] = L2[m] = 0.0;
+  }
+
+  fish_state *S = fish_new();
+  fish_setparami(S, FISH_PLM, FISH_RECONSTRUCTION);
+  fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L0, 0);
+  assert(fish_setparami(S, 3, FISH_SWEEP_TILE) == 0);
+  assert(fish_setparami(S, 4, FISH_NUM_THREADS) == 0);
+  fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L1, 0);
+  fish_timederivative(S, fluid, 3, shape, dx, L2, 0);
+  assert(memcmp(L0, L1, sizeof(L0)) == 0);
+  assert(memcmp(L0, L2, sizeof(L0)) == 0);
+  assert(fish_setparami(S, 0, FISH_SWEEP_TILE) == FISH_ERROR_BADARG);
+
+  for (int n=0; n<ncell; ++n) {
+    fluids_state_del(fluid[n]);
+  }
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 7 PASSED\n");
+  return 0;
+}
+
+// Passes when skipping the guard zone pencils leaves the interior of the time
+// derivative unchanged, and the skipped pencils untouched
+// -----------------------------------------------------------------------------
+int test8()
+{
+  int shape[3] = {12, 10, 9};
+  double dx[3] = {0.1, 0.1, 0.1};
+  int ng = 2;
+  int ncell = 12*10*9;
+  double P[12*10*9*5], L0[12*10*9*5], L1[12*10*9*5];
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  for (int n=0; n<ncell; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.1 * sin(0.3 * n);
+    P[5*n + 3] = 0.1 * cos(0.5 * n);
+    P[5*n + 4] = 0.1 * cos(0.9 * n);
+  }
+  for (int m=0; m<ncell*5; ++m) {
+    L0[m] = L1[m] = 0.0;
+  }
+
+  fish_state *S = fish_new();
+  fish_setparami(S, FISH_PLM, FISH_RECONSTRUCTION);
+  fish_setparami(S, 4, FISH_SWEEP_TILE);
+  fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L0, 0);
+  fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L1, ng);
+  assert(fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L1, -1) ==
+	 FISH_ERROR_BADARG);
+
+  for (int i=0; i<shape[0]; ++i) {
+    for (int j=0; j<shape[1]; ++j) {
+      for (int k=0; k<shape[2]; ++k) {
+	int ni = i >= ng && i < shape[0] - ng;
+	int nj = j >= ng && j < shape[1] - ng;
+	int nk = k >= ng && k < shape[2] - ng;
+	int m = (i*shape[1]*shape[2] + j*shape[2] + k) * 5;
+	for (int q=0; q<5; ++q) {
+	  if (ni && nj && nk) {
+	    assert(L0[m+q] == L1[m+q]);
+	  }
+	  else if (ni + nj + nk < 2) {
+	    assert(L1[m+q] == 0.0); // no sweep passes through this zone
+	  }
+	}
+      }
+    }
+  }
+
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 8 PASSED\n");
+  return 0;
+}
+
+static int test9_calls = 0;
+static int test9_boundary(double *U, int ndim, int *shape, int Q, int ng,
+			  void *data)
+{
+  test9_calls += 1;
+  return data != NULL;
+}
+
+// Passes when fish_evolve conserves mass on a periodic domain for each of the
+// Runge-Kutta schemes, when a single RK1 step agrees with U + dt L, and when a
+// boundary condition callback is called once per stage plus once up front
+// -----------------------------------------------------------------------------
+int test9()
+{
+  int shape[2] = {16, 12};
+  double dx[2] = {0.1, 0.1};
+  double dt = 0.01;
+  int ng = 2;
+  int ncell = 16*12;
+  int schemes[4] = {FISH_RK1, FISH_RK2_TVD, FISH_RK3_SHUOSHER, FISH_RK4};
+  double P[16*12*5], U0[16*12*5], U1[16*12*5], L[16*12*5];
+  fluids_state *fluid[16*12];
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+  for (int n=0; n<ncell; ++n) {
+    fluid[n] = fluids_state_new();
+    fluids_state_setdescr(fluid[n], D);
+  }
+
+  fish_state *S = fish_new();
+  fish_setparami(S, FISH_PLM, FISH_RECONSTRUCTION);
+  fish_setparami(S, FISH_PERIODIC, FISH_BOUNDARY_CONDITION);
+
+  for (int r=0; r<4; ++r) {
+    double mass0 = 0.0, mass1 = 0.0;
+    for (int i=0; i<shape[0]; ++i) {
+      for (int j=0; j<shape[1]; ++j) {
+	int n = i*shape[1] + j;
+	int I = (i - ng + 12) % 12; // periodic over the 12 x 8 interior
+	int J = (j - ng + 8) % 8;
+	P[5*n + 0] = 1.0 + 0.2 * sin(6.283185307179586 * I / 12.0);
+	P[5*n + 1] = 1.0 + 0.1 * cos(6.283185307179586 * J / 8.0);
+	P[5*n + 2] = 0.1;
+	P[5*n + 3] = 0.2;
+	P[5*n + 4] = 0.0;
+	fluids_state_setattr(fluid[n], &P[5*n], FLUIDS_PRIMITIVE);
+      }
+    }
+    for (int i=ng; i<shape[0]-ng; ++i) {
+      for (int j=ng; j<shape[1]-ng; ++j) {
+	double U[5];
+	fluids_state_derive(fluid[i*shape[1] + j], U, FLUIDS_CONSERVED);
+	mass0 += U[0];
+      }
+    }
+    fish_setparami(S, schemes[r], FISH_TIME_INTEGRATOR);
+    assert(fish_evolve(S, fluid, 2, shape, dx, dt, ng) == 0);
+    for (int i=ng; i<shape[0]-ng; ++i) {
+      for (int j=ng; j<shape[1]-ng; ++j) {
+	double U[5];
+	fluids_state_derive(fluid[i*shape[1] + j], U, FLUIDS_CONSERVED);
+	mass1 += U[0];
+      }
+    }
+    asserteq(mass0, mass1);
+  }
+
+  /* a single forward Euler step on the interior */
+  for (int n=0; n<ncell; ++n) {
+    fluids_state_setattr(fluid[n], &P[5*n], FLUIDS_PRIMITIVE);
+    fluids_state_derive(fluid[n], &U0[5*n], FLUIDS_CONSERVED);
+    for (int q=0; q<5; ++q) {
+      L[5*n + q] = 0.0;
+    }
+  }
+  fish_timederivative(S, fluid, 2, shape, dx, L, ng);
+  fish_setparami(S, FISH_RK1, FISH_TIME_INTEGRATOR);
+  fish_evolve(S, fluid, 2, shape, dx, dt, ng);
+  for (int i=ng; i<shape[0]-ng; ++i) {
+    for (int j=ng; j<shape[1]-ng; ++j) {
+      int n = i*shape[1] + j;
+      fluids_state_derive(fluid[n], &U1[5*n], FLUIDS_CONSERVED);
+      for (int q=0; q<5; ++q) {
+	asserteq(U1[5*n + q], (U0[5*n + q] + dt * L[5*n + q]));
+      }
+    }
+  }
+
+  /* user boundary conditions */
+  fish_setparami(S, FISH_USER_BOUNDARY, FISH_BOUNDARY_CONDITION);
+  assert(fish_evolve(S, fluid, 2, shape, dx, dt, ng) == FISH_ERROR_BADARG);
+  fish_setboundary(S, test9_boundary, NULL);
+  fish_setparami(S, FISH_RK3_SHUOSHER, FISH_TIME_INTEGRATOR);
+  assert(fish_evolve(S, fluid, 2, shape, dx, dt, ng) == 0);
+  assert(test9_calls == 4);
+  fish_setboundary(S, test9_boundary, S);
+  assert(fish_evolve(S, fluid, 2, shape, dx, dt, ng) == FISH_ERROR_BOUNDARY);
+
+  for (int n=0; n<ncell; ++n) {
+    fluids_state_del(fluid[n]);
+  }
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 9 PASSED\n");
+  return 0;
+}
+
+// Passes when the conversion from conserved variables raises the zones below
+// the density and pressure floors, counts them, and rewrites their conserved
+// variables to match
+// -----------------------------------------------------------------------------
+int test10()
+{
+  double U[8*5], P[5], U1[5];
+  fluids_state *fluid[8];
+  long nfloor;
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+
+  for (int n=0; n<8; ++n) {
+    fluid[n] = fluids_state_new();
+    fluids_state_setdescr(fluid[n], D);
+    U[5*n + 0] = 1.0;
+    U[5*n + 1] = 1.0;
+    U[5*n + 2] = 0.5;
+    U[5*n + 3] = 0.0;
+    U[5*n + 4] = 0.0;
+  }
+  U[5*2 + 1] = -0.1; // negative energy
+  U[5*5 + 0] = 1e-9; // tiny density
+  U[5*5 + 2] = 0.0;
+
+  fish_state *S = fish_new();
+  fish_setparamd(S, 1e-6, FISH_DENSITY_FLOOR);
+  fish_setparamd(S, 1e-4, FISH_PRESSURE_FLOOR);
+  assert(fish_fromconserved(S, fluid, U, 8) == 0);
+  fish_getparaml(S, &nfloor, FISH_ZONES_FLOORED);
+  assert(nfloor == 2);
+
+  for (int n=0; n<8; ++n) {
+    fluids_state_getattr(fluid[n], P, FLUIDS_PRIMITIVE);
+    fluids_state_derive(fluid[n], U1, FLUIDS_CONSERVED);
+    assert(P[0] >= 1e-6);
+    assert(P[1] >= 1e-4);
+    for (int q=0; q<5; ++q) {
+      asserteq(U1[q], U[5*n + q]);
+    }
+  }
+  fluids_state_getattr(fluid[2], P, FLUIDS_PRIMITIVE);
+  asserteq(P[1], 1e-4);
+  fluids_state_getattr(fluid[5], P, FLUIDS_PRIMITIVE);
+  asserteq(P[0], 1e-6);
+
+  for (int n=0; n<8; ++n) {
+    fluids_state_del(fluid[n]);
+  }
+  fluids_descr_del(D);
+  fish_del(S);
+  printf("TEST 10 PASSED\n");
+  return 0;
+}
+
+// Passes when guard zones are filled face by face, periodic along x and with
+// inflow and outflow on the lower and upper y faces, and when badly composed
+// faces are refused
+// -----------------------------------------------------------------------------
+int test11()
+{
+  int shape[2] = {8, 7};
+  int ng = 2, Q = 2;
+  double U[8*7*2], G[8*2*2];
+  int faces[4] = {FISH_PERIODIC, FISH_PERIODIC, FISH_INFLOW, FISH_OUTFLOW};
+  double *inflow[4] = {NULL, NULL, G, NULL};
+
+  for (int i=0; i<8; ++i) {
+    for (int j=0; j<7; ++j) {
+      for (int q=0; q<Q; ++q) {
+	int interior = i >= ng && i < 8-ng && j >= ng && j < 7-ng;
+	U[(i*7 + j)*Q + q] = interior ? 100*i + 10*j + q : -1.0;
+      }
+    }
+  }
+  for (int n=0; n<8*2*2; ++n) {
+    G[n] = -10.0 - n;
+  }
+  assert(fish_fillguards(U, 2, shape, Q, ng, faces, inflow) == 0);
+
+  for (int i=0; i<8; ++i) {
+    int si = i < ng ? i + 4 : (i >= 8-ng ? i - 4 : i); // periodic image
+    for (int q=0; q<Q; ++q) {
+      for (int j=ng; j<7-ng; ++j) {
+	asserteq(U[(i*7 + j)*Q + q], (100*si + 10*j + q));
+      }
+      for (int j=0; j<ng; ++j) {
+	asserteq(U[(i*7 + j)*Q + q], G[(i*ng + j)*Q + q]);
+      }
+      for (int j=7-ng; j<7; ++j) {
+	asserteq(U[(i*7 + j)*Q + q], U[(i*7 + 7-ng-1)*Q + q]);
+      }
+    }
+  }
+
+  faces[1] = FISH_OUTFLOW;
+  assert(fish_fillguards(U, 2, shape, Q, ng, faces, inflow) ==
+	 FISH_ERROR_BADARG);
+  faces[1] = FISH_PERIODIC;
+  assert(fish_fillguards(U, 2, shape, Q, ng, faces, NULL) ==
+	 FISH_ERROR_BADARG);
+
+  printf("TEST 11 PASSED\n");
+  return 0;
+}
+
+// Passes when the wave speeds recorded by the time derivative are the largest
+// eigenvalues of the zones along each axis, for both solvers and any number of
+// threads, and when recording them leaves the time derivative unchanged
+// -----------------------------------------------------------------------------
+int test12()
+{
+  int shape[3] = {12, 10, 9};
+  double dx[3] = {0.1, 0.1, 0.1};
+  int ncell = 12*10*9;
+  double P[12*10*9*5], L0[12*10*9*5], L1[12*10*9*5];
+  double lam[5], amax[3] = {0.0, 0.0, 0.0}, a;
+  int solvers[2] = {FISH_GODUNOV, FISH_SPECTRAL};
+  int reconstructions[2] = {FISH_PCM, FISH_WENO5};
+  const long evals[3] = {FLUIDS_EVAL0, FLUIDS_EVAL1, FLUIDS_EVAL2};
+
+  fluids_descr *D = fluids_descr_new();
+  fluids_descr_setfluid(D, FLUIDS_NRHYD);
+  fluids_descr_setgamma(D, 1.4);
+  fluids_descr_seteos(D, FLUIDS_EOS_GAMMALAW);
+  fluids_state *zone = fluids_state_new();
+  fluids_state_setdescr(zone, D);
+
+  for (int n=0; n<ncell; ++n) {
+    P[5*n + 0] = 1.0 + 0.2 * sin(0.7 * n);
+    P[5*n + 1] = 1.0 + 0.1 * cos(1.3 * n);
+    P[5*n + 2] = 0.3 * sin(0.3 * n);
+    P[5*n + 3] = 0.2 * cos(0.5 * n);
+    P[5*n + 4] = 0.1 * cos(0.9 * n);
+    fluids_state_setattr(zone, &P[5*n], FLUIDS_PRIMITIVE);
+    for (int d=0; d<3; ++d) {
+      fluids_state_derive(zone, lam, evals[d]);
+      for (int q=0; q<5; ++q) {
+	if (fabs(lam[q]) > amax[d]) amax[d] = fabs(lam[q]);
+      }
+    }
+  }
+
+  for (int s=0; s<2; ++s) {
+    for (int nthread=1; nthread<=3; nthread+=2) {
+      fish_state *S = fish_new();
+      fish_setparami(S, solvers[s], FISH_SOLVER_TYPE);
+      fish_setparami(S, reconstructions[s], FISH_RECONSTRUCTION);
+      fish_setparami(S, nthread, FISH_NUM_THREADS);
+      for (int m=0; m<ncell*5; ++m) {
+	L0[m] = L1[m] = 0.0;
+      }
+      fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L0, 0);
+      fish_getparamd(S, &a, FISH_MAX_WAVESPEED);
+      assert(a == 0.0);
+
+      fish_setparami(S, 1, FISH_MEASURE_WAVESPEEDS);
+      fish_timederivative_array(S, D, P, NULL, 3, shape, dx, L1, 0);
+      for (int m=0; m<ncell*5; ++m) {
+	assert(L0[m] == L1[m]);
+      }
+      fish_getparamd(S, &a, FISH_MAX_WAVESPEED0);
+      asserteq(a, amax[0]);
+      fish_getparamd(S, &a, FISH_MAX_WAVESPEED1);
+      asserteq(a, amax[1]);
+      fish_getparamd(S, &a, FISH_MAX_WAVESPEED2);
+      asserteq(a, amax[2]);
+      fish_getparamd(S, &a, FISH_MAX_WAVESPEED);
+      asserteq(a, fmax(amax[0], fmax(amax[1], amax[2])));
+      fish_del(S);
+    }
+  }
+
+  fluids_state_del(zone);
+  fluids_descr_del(D);
+  printf("TEST 12 PASSED\n");
+  return 0;
+}
+
 int main()
 {
   test1();
+  test2();
+  test3();
+  test4();
+  test5();
+  test6();
+  test7();
+  test8();
+  test9();
+  test10();
+  test11();
+  test12();
   return 0;
 }
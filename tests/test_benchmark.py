@@ -0,0 +1,64 @@
+"""
+Tests of the case sweep and the baseline comparison of examples/benchmark.py.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'examples'))
+from benchmark import build_cases, case_key, compare, CASE_KEYS
+
+
+def result(resolution, rate, memory=100.0, status='ok'):
+    r = dict(problem='BrioWuShocktube', solver_type='godunov',
+             reconstruction='plm', riemann_solver='hllc',
+             resolution=resolution, dimension=1, num_threads=1, status=status)
+    if status == 'ok':
+        r.update(zone_updates_per_sec=rate, peak_memory_mb=memory)
+    else:
+        r.update(error='exit status 1')
+    return r
+
+
+def test_build_cases():
+    cases = build_cases(['BrioWuShocktube', 'PeriodicDensityWave'],
+                        ['godunov'], ['plm', 'weno5'], ['hllc'], [64, 128],
+                        [1, 2], [1])
+    assert len(cases) == 2 * 2 * 2 * 2
+    assert all(sorted(c.keys()) == sorted(CASE_KEYS) for c in cases)
+    assert len(set(case_key(c) for c in cases)) == len(cases)
+
+
+def test_compare():
+    baseline = [result(16, 1000.0), result(32, 1000.0), result(64, 1000.0),
+                result(128, 1000.0), result(256, None, status='error')]
+    results = [result(16, 950.0),                 # within tolerance
+               result(32, 800.0),                 # slower
+               result(64, None, status='error'),  # failed
+               result(128, 1000.0, memory=150.0), # grew in memory
+               result(256, 1000.0),               # failed in the baseline
+               result(512, 1000.0)]               # not in the baseline
+    rows = compare(results, baseline, tolerance=0.1)
+    assert [r for r, b, ratio, memory, regressed in rows] == results
+
+    by_resolution = dict((row[0]['resolution'], row[1:]) for row in rows)
+    b, ratio, memory, regressed = by_resolution[16]
+    assert b is baseline[0] and abs(ratio - 0.95) < 1e-12 and not regressed
+    assert abs(memory - 1.0) < 1e-12
+    assert by_resolution[32][1] == 0.8 and by_resolution[32][3]
+    assert by_resolution[64][1:] == (0.0, None, True)
+    assert by_resolution[128][1:] == (1.0, 1.5, True)
+    assert by_resolution[256] == (None, None, None, False)
+    assert by_resolution[512] == (None, None, None, False)
+
+    # a separate memory tolerance
+    rows = compare(results, baseline, tolerance=0.1, memory_tolerance=0.6)
+    assert not [row for row in rows if row[0]['resolution'] == 128][0][4]
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
@@ -0,0 +1,189 @@
+"""
+Tests of the chunked checkpoint format: round-trips of fields and attributes
+with each codec, slabs of raw and compressed fields, and the background
+CheckpointWriter.
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing.pool
+import numpy as np
+from pyfish.checkpoint import write_checkpoint, read_checkpoint, \
+    CheckpointWriter
+
+
+def make_fields():
+    np.random.seed(1)
+    return {'prim': np.random.rand(37, 6, 5),
+            'mask': np.arange(50, dtype=np.int32).reshape(10, 5),
+            'time': np.array(0.25)}
+
+
+def in_tempdir(test):
+    def wrapped():
+        tmpdir = tempfile.mkdtemp()
+        try:
+            test(tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+    wrapped.__name__ = test.__name__
+    return wrapped
+
+
+@in_tempdir
+def test_raw_round_trip(tmpdir):
+    fields = make_fields()
+    attrs = {'status': {'iteration': 12, 'time_simulation': 0.25}}
+    filename = os.path.join(tmpdir, 'chkpt.fish')
+    # Small chunks, so that each field is written as several of them
+    write_checkpoint(filename, fields, attrs, chunk_bytes=1000)
+    assert not os.path.exists(filename + '.tmp')
+
+    chkpt = read_checkpoint(filename)
+    assert chkpt.fields == ['mask', 'prim', 'time']
+    assert chkpt.attrs == attrs
+    assert 'prim' in chkpt and 'cons' not in chkpt
+    assert len(chkpt.header['fields']['prim']['chunks']) > 1
+    for name, A in fields.items():
+        B = chkpt[name]
+        assert B.dtype == A.dtype
+        assert (B == A.reshape(B.shape)).all()
+    assert chkpt['time'].shape == (1,)
+
+
+@in_tempdir
+def test_raw_slab_is_memory_mapped(tmpdir):
+    fields = make_fields()
+    filename = os.path.join(tmpdir, 'chkpt.fish')
+    write_checkpoint(filename, fields, chunk_bytes=1000)
+    chkpt = read_checkpoint(filename)
+    P = fields['prim']
+    for i0, i1 in [(0, 37), (3, 4), (10, 29), (30, 100), (-5, None)]:
+        S = chkpt.slab('prim', i0, i1)
+        assert isinstance(S, np.memmap)
+        assert S.shape == P[i0:i1].shape
+        assert (S == P[i0:i1]).all()
+    assert chkpt.slab('prim', 20, 10).shape == (0, 6, 5)
+    try:
+        chkpt.slab('prim', 0, 1)[...] = 0.0
+    except ValueError:
+        pass
+    else:
+        assert False, "expected a read-only slab"
+
+
+@in_tempdir
+def test_compressed_round_trip(tmpdir):
+    fields = make_fields()
+    pool = multiprocessing.pool.ThreadPool(3)
+    try:
+        for codec in ['zlib', 'bz2']:
+            for p in [None, pool]:
+                filename = os.path.join(tmpdir, 'chkpt.%s.fish' % codec)
+                write_checkpoint(filename, fields, {'codec': codec},
+                                 chunk_bytes=1000, codec=codec, pool=p)
+                chkpt = read_checkpoint(filename)
+                entry = chkpt.header['fields']['prim']
+                assert entry['codec'] == codec
+                assert len(entry['chunks']) > 1
+                assert chkpt.attrs == {'codec': codec}
+                for name, A in fields.items():
+                    assert (chkpt[name] == A.reshape(chkpt[name].shape)).all()
+    finally:
+        pool.close()
+        pool.join()
+
+
+@in_tempdir
+def test_compressed_slab(tmpdir):
+    fields = make_fields()
+    P = fields['prim']
+    for codec in ['zlib', 'bz2']:
+        filename = os.path.join(tmpdir, 'chkpt.%s.fish' % codec)
+        write_checkpoint(filename, fields, chunk_bytes=1000, codec=codec)
+        chkpt = read_checkpoint(filename)
+        for i0, i1 in [(0, 37), (3, 4), (10, 29), (30, 100), (-5, None)]:
+            S = chkpt.slab('prim', i0, i1)
+            assert not isinstance(S, np.memmap)
+            assert (S == P[i0:i1]).all()
+
+
+@in_tempdir
+def test_unknown_codec(tmpdir):
+    try:
+        write_checkpoint(os.path.join(tmpdir, 'chkpt.fish'), make_fields(),
+                         codec='lzma')
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+@in_tempdir
+def test_writer_snapshots_fields(tmpdir):
+    fields = make_fields()
+    P = fields['prim'].copy()
+    attrs = {'status': {'iteration': 1}}
+    names = [os.path.join(tmpdir, 'chkpt.%04d.fish' % n) for n in range(3)]
+    with CheckpointWriter(codec='zlib', num_threads=2,
+                          chunk_bytes=1000) as writer:
+        for n, name in enumerate(names):
+            writer.write(name, fields, attrs)
+            # The writer holds copies, so the caller may go on modifying these
+            fields['prim'] += 1.0
+            attrs['status']['iteration'] += 1
+        writer.flush()
+    for n, name in enumerate(names):
+        chkpt = read_checkpoint(name)
+        assert chkpt.attrs['status']['iteration'] == n + 1
+        assert (chkpt['prim'] == P + n).all()
+
+
+@in_tempdir
+def test_writer_owned_fields(tmpdir):
+    P = make_fields()['prim']
+    name = os.path.join(tmpdir, 'chkpt.fish')
+    with CheckpointWriter(codec='raw') as writer:
+        writer.write(name, {'prim': P.copy()}, owned=True)
+    assert (read_checkpoint(name)['prim'] == P).all()
+
+
+@in_tempdir
+def test_writer_reraises_errors(tmpdir):
+    writer = CheckpointWriter(codec='zlib')
+    name = os.path.join(tmpdir, 'missing', 'chkpt.fish')
+    writer.write(name, make_fields())
+    try:
+        writer.flush()
+    except IOError:
+        pass
+    else:
+        assert False, "expected IOError"
+    writer.close()
+    try:
+        writer.write(os.path.join(tmpdir, 'chkpt.fish'), make_fields())
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+@in_tempdir
+def test_not_a_checkpoint(tmpdir):
+    filename = os.path.join(tmpdir, 'chkpt.fish')
+    with open(filename, 'wb') as f:
+        f.write('\0' * 64)
+    try:
+        read_checkpoint(filename)
+    except IOError:
+        pass
+    else:
+        assert False, "expected IOError"
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
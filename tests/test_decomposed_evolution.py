@@ -0,0 +1,84 @@
+"""
+Tests of DecomposedEvolution in examples/euler.py: a step taken with the domain
+split among worker processes must match the serial step of
+MaraEvolutionOperator.
+"""
+
+import os
+import sys
+import numpy as np
+import pyfish
+from pyfish import problems
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'examples'))
+from euler import MaraEvolutionOperator, DecomposedEvolution
+
+
+def evolve(problem, nblocks, nsteps=2, rk=3):
+    """
+    Returns the primitive variables after nsteps of the problem, advanced
+    serially if nblocks is 1, and otherwise split into nblocks slabs.
+    """
+    mara = MaraEvolutionOperator(problem, pyfish.FishSolver())
+    mara.initial_model(problem.pinit, problem.ginit)
+    mara.boundary = problem.build_boundary(mara)
+    dt = 0.3 * mara.min_grid_spacing() / mara.max_wavespeed()
+    if nblocks == 1:
+        for n in range(nsteps):
+            mara.advance(dt, rk=rk)
+    else:
+        evolution = DecomposedEvolution(mara, nblocks)
+        try:
+            for n in range(nsteps):
+                evolution.advance(dt, rk=rk)
+            evolution.gather()
+        finally:
+            evolution.close()
+    return mara.fluid.primitive
+
+
+def check_matches_serial(make_problem, nblocks=3):
+    serial = evolve(make_problem(), 1)
+    decomposed = evolve(make_problem(), nblocks)
+    assert np.allclose(decomposed, serial, rtol=1e-12, atol=1e-14)
+    # the step must have moved the fluid for the comparison to mean anything
+    initial = evolve(make_problem(), 1, nsteps=0)
+    assert not np.allclose(serial, initial, rtol=1e-12, atol=1e-14)
+
+
+def test_periodic_1d():
+    check_matches_serial(lambda: problems.PeriodicDensityWave(
+            resolution=[64], v0=0.5))
+
+
+def test_outflow_2d():
+    check_matches_serial(lambda: problems.BrioWuShocktube(
+            resolution=[32, 16]))
+
+
+def test_static_gravity():
+    # a fixed potential well with inflow boundaries, whose gravity the workers
+    # must see as the serial step does
+    check_matches_serial(lambda: problems.OneDimensionalUpsidedownGaussian(
+            resolution=[64]))
+
+
+def test_whole_domain_terms_refused():
+    problem = problems.DrivenTurbulence2d(resolution=[16, 16])
+    mara = MaraEvolutionOperator(problem, pyfish.FishSolver())
+    mara.initial_model(problem.pinit, problem.ginit)
+    mara.boundary = problem.build_boundary(mara)
+    try:
+        DecomposedEvolution(mara, 2)
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
@@ -0,0 +1,119 @@
+"""
+Tests of the slab decomposition and of the worker processes stepping blocks
+held in shared memory.
+"""
+
+import numpy as np
+from pyfish.decomposition import SlabDecomposition, BlockWorkers, Barrier, \
+    shared_array
+
+
+def test_bounds_tile_the_interior():
+    for n, nblocks in [(32, 1), (32, 4), (33, 4), (30, 7)]:
+        dcmp = SlabDecomposition((n + 6, 5), 3, nblocks)
+        assert dcmp.bounds[0][0] == 3
+        assert dcmp.bounds[-1][1] == n + 3
+        sizes = [i1 - i0 for i0, i1 in dcmp.bounds]
+        assert max(sizes) - min(sizes) <= 1
+        for (i0, i1), (j0, j1) in zip(dcmp.bounds[:-1], dcmp.bounds[1:]):
+            assert i1 == j0
+        for (i0, i1), shape in zip(dcmp.bounds, dcmp.block_shapes):
+            assert shape == (i1 - i0 + 6, 5)
+
+
+def test_too_many_blocks():
+    try:
+        SlabDecomposition((16, 4), 3, 4)
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+def test_neighbors():
+    dcmp = SlabDecomposition((16, 4), 2, 3)
+    assert dcmp.neighbors(0) == (None, 1)
+    assert dcmp.neighbors(1) == (0, 2)
+    assert dcmp.neighbors(2) == (1, None)
+    assert dcmp.neighbors(0, periodic=True) == (2, 1)
+    assert dcmp.neighbors(2, periodic=True) == (1, 0)
+
+
+def test_scatter_gather():
+    dcmp = SlabDecomposition((26, 3, 2), 2, 3)
+    U = np.random.rand(26, 3, 2)
+    blocks = [np.zeros(s + (2,))[..., 0] for s in dcmp.block_shapes]
+    dcmp.scatter(U, blocks)
+    for (i0, i1), B in zip(dcmp.bounds, blocks):
+        assert (B == U[i0 - 2:i1 + 2]).all()
+    V = np.zeros_like(U)
+    dcmp.gather(blocks, V)
+    assert (V[2:-2] == U[2:-2]).all()
+    assert (V[:2] == 0.0).all() and (V[-2:] == 0.0).all()
+
+
+def test_workers_exchange_guard_zones():
+    # Each worker copies the edges of its neighbors' interiors from shared
+    # memory into its own guard zones, then replaces its interior by the
+    # average of the two neighboring zones, as a periodic smoothing step.
+    ng = 1
+    dcmp = SlabDecomposition((22, 1), ng, 4)
+    blocks = [shared_array(s) for s in dcmp.block_shapes]
+    U = np.random.rand(22, 1)
+    U[:ng] = U[-2 * ng:-ng]
+    U[-ng:] = U[ng:2 * ng]
+    dcmp.scatter(U, blocks)
+    barrier = Barrier(4)
+
+    def handler(b, command, nsteps):
+        B = blocks[b]
+        lower, upper = dcmp.neighbors(b, periodic=True)
+        for n in range(nsteps):
+            barrier.wait()
+            B[:ng] = blocks[lower][-2 * ng:-ng]
+            B[-ng:] = blocks[upper][ng:2 * ng]
+            barrier.wait()
+            B[ng:-ng] = 0.5 * (B[:-2 * ng] + B[2 * ng:])
+        return float(B[ng:-ng].sum())
+
+    workers = BlockWorkers(4, handler, barrier)
+    try:
+        sums = workers.run('smooth', 3)
+    finally:
+        workers.close()
+
+    V = U[ng:-ng].copy()
+    for n in range(3):
+        V = 0.5 * (np.roll(V, 1, axis=0) + np.roll(V, -1, axis=0))
+    W = np.zeros_like(U)
+    dcmp.gather(blocks, W)
+    assert abs(W[ng:-ng] - V).max() < 1e-14
+    assert abs(sum(sums) - V.sum()) < 1e-12
+
+
+def test_worker_failure():
+    barrier = Barrier(3)
+
+    def handler(b, command):
+        if b == 0:
+            raise ValueError("block %d failed" % b)
+        barrier.wait()
+        return b
+
+    workers = BlockWorkers(3, handler, barrier)
+    try:
+        workers.run('fail')
+    except RuntimeError as e:
+        # The other workers are released from the barrier rather than hanging
+        assert 'block 0 failed' in str(e)
+    else:
+        assert False, "expected RuntimeError"
+    finally:
+        workers.close()
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
@@ -0,0 +1,188 @@
+"""
+Tests of the append-only diagnostics log: appending in batches, reopening,
+queries by iteration and time, and truncation back to a pointer. Also tests of
+the Cadence on which measurements are made.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from pyfish.diagnostics import DiagnosticsLog, INDEX_DTYPE, open_log, Cadence
+
+
+def in_tempdir(test):
+    def wrapped():
+        tmpdir = tempfile.mkdtemp()
+        try:
+            test(tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+    wrapped.__name__ = test.__name__
+    return wrapped
+
+
+def record(n):
+    return {'kinetic': 0.5 * n, 'primitive_avg': [n, 1.0, 0.0, 0.0, 0.0]}
+
+
+def fill(log, n0, n1):
+    for n in range(n0, n1):
+        log.append(n, 0.1 * n, record(n))
+
+
+def check_index(log):
+    """
+    The index must be ordered, and its byte ranges must tile the data file.
+    """
+    index = log.index()
+    assert len(index) == len(log)
+    assert (np.diff(index['iteration']) > 0).all()
+    assert (index['offset'][1:] == index['offset'][:-1] +
+            index['nbytes'][:-1]).all()
+    size = os.path.getsize(log.filename)
+    assert size == (index[-1]['offset'] + index[-1]['nbytes'] if len(index)
+                    else 0)
+    assert os.path.getsize(log.index_filename) == len(index) * \
+        INDEX_DTYPE.itemsize
+
+
+@in_tempdir
+def test_append_in_batches(tmpdir):
+    filename = os.path.join(tmpdir, 'diagnostics.log')
+    log = DiagnosticsLog(filename, mode='w', batch_size=8)
+    fill(log, 0, 20)
+    # Two batches are on disk, the last four records are pending
+    assert os.path.getsize(log.index_filename) == 16 * INDEX_DTYPE.itemsize
+    assert len(log) == 20
+    assert log.records(18, 20) == [(18, 0.1 * 18, record(18)),
+                                   (19, 0.1 * 19, record(19))]
+    log.close()
+    check_index(log)
+
+
+@in_tempdir
+def test_reopen(tmpdir):
+    filename = os.path.join(tmpdir, 'diagnostics.log')
+    with DiagnosticsLog(filename, mode='w', batch_size=5) as log:
+        fill(log, 0, 12)
+    with DiagnosticsLog(filename, mode='a') as log:
+        assert len(log) == 12
+        fill(log, 12, 30)
+    log = open_log(filename)
+    assert len(log) == 30
+    check_index(log)
+    assert [r[0] for r in log.records()] == range(30)
+    assert [r[2] for r in log.records()] == [record(n) for n in range(30)]
+    assert log[17] == record(17)
+    try:
+        log.append(30, 3.0, record(30))
+    except IOError:
+        pass
+    else:
+        assert False, "expected IOError"
+
+
+@in_tempdir
+def test_queries(tmpdir):
+    filename = os.path.join(tmpdir, 'diagnostics.log')
+    log = DiagnosticsLog(filename, mode='w', batch_size=4)
+    fill(log, 0, 50)
+    assert [r[0] for r in log.records(10, 13)] == [10, 11, 12]
+    assert [r[0] for r in log.records(45)] == range(45, 50)
+    assert [r[0] for r in log.records(None, 3)] == [0, 1, 2]
+    assert [r[0] for r in log.between(0.95, 1.25)] == [10, 11, 12]
+    assert log.records(30, 30) == [ ]
+    assert log.between(10.0) == [ ]
+    try:
+        log[50]
+    except KeyError:
+        pass
+    else:
+        assert False, "expected KeyError"
+
+
+@in_tempdir
+def test_truncate_to_pointer(tmpdir):
+    filename = os.path.join(tmpdir, 'diagnostics.log')
+    log = DiagnosticsLog(filename, mode='w', batch_size=7)
+    fill(log, 0, 25)
+    pointer = log.pointer()
+    assert pointer['records'] == 25
+    fill(log, 25, 40)
+    log.close()
+
+    # A restart from the checkpoint holding the pointer
+    log = DiagnosticsLog(filename, mode='a')
+    assert len(log) == 40
+    log.truncate(pointer)
+    assert len(log) == 25
+    assert os.path.getsize(filename) == pointer['nbytes']
+    check_index(log)
+    fill(log, 25, 30)
+    log.close()
+
+    log = open_log(filename)
+    check_index(log)
+    assert [r[0] for r in log.records()] == range(30)
+    assert log[27] == record(27)
+
+
+@in_tempdir
+def test_recover_partial_write(tmpdir):
+    filename = os.path.join(tmpdir, 'diagnostics.log')
+    with DiagnosticsLog(filename, mode='w') as log:
+        fill(log, 0, 10)
+    # An index entry written only in part, and one past the end of the data
+    with open(log.index_filename, 'ab') as f:
+        entry = np.array([(10, 1.0, os.path.getsize(filename), 100)],
+                         dtype=INDEX_DTYPE)
+        f.write(entry.tostring())
+        f.write('\0' * 5)
+    with DiagnosticsLog(filename, mode='a') as log:
+        assert len(log) == 10
+        fill(log, 10, 12)
+    log = open_log(filename)
+    assert [r[0] for r in log.records()] == range(12)
+
+
+def due_iterations(cadence, times):
+    return [n for n, t in enumerate(times) if cadence.due(n, t)]
+
+
+def test_cadence_steps():
+    times = [0.1 * n for n in range(10)]
+    assert due_iterations(Cadence(), times) == range(10)
+    assert due_iterations(Cadence(steps=3), times) == [0, 3, 6, 9]
+
+
+def test_cadence_interval():
+    # Uneven time steps, a measurement is due once interval has elapsed
+    times = [0.0, 0.3, 0.5, 0.9, 1.0, 1.05, 1.6, 1.7]
+    assert due_iterations(Cadence(steps=None, interval=0.5),
+                          times) == [0, 2, 4, 6]
+
+
+def test_cadence_whichever_first():
+    times = [0.0, 0.3, 0.5, 0.9, 1.0, 1.05, 1.6, 1.7]
+    assert due_iterations(Cadence(steps=3, interval=0.5),
+                          times) == [0, 2, 4, 6]
+    times = [0.01 * n for n in range(10)]
+    assert due_iterations(Cadence(steps=4, interval=0.5),
+                          times) == [0, 4, 8]
+
+
+def test_cadence_needs_a_rule():
+    try:
+        Cadence(steps=None, interval=None)
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
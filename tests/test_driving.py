@@ -0,0 +1,152 @@
+"""
+Tests of the stochastic driving modules: the forcing field is solenoidal (or
+compressive), band-limited, cached between steps, and has the expected power in
+the steady state.
+"""
+
+import numpy as np
+from numpy.fft import fftfreq, rfftfreq, rfftn
+from pyfish.driving import DrivingModule2d, SparseDrivingModule, \
+    spectral_profile
+
+
+def wavenumbers(shape, derivative=True):
+    """
+    Wavenumbers of the real-to-complex transform of an array of the given
+    shape, shaped to broadcast against it. Nyquist modes carry no derivative,
+    so their wavenumber is zero if derivative is True.
+    """
+    ndim = len(shape)
+    K = [fftfreq(N) for N in shape[:-1]] + [rfftfreq(shape[-1])]
+    for k in K:
+        if derivative:
+            k[abs(k) == 0.5] = 0.0
+    return [k.reshape([-1 if e == d else 1 for e in range(ndim)])
+            for d, k in enumerate(K)]
+
+
+def transforms(F):
+    return np.array([rfftn(Fd) for Fd in F])
+
+
+def steady_power(driving, dt=0.1, burn=50, nsteps=400):
+    """
+    Mean power of the forcing over nsteps, after burn steps. The variance of
+    the Ornstein-Uhlenbeck process advanced by Euler steps of dt exceeds that
+    of the continuous process by the factor 1 / (1 - theta dt / 2), which is
+    divided out.
+    """
+    for n in range(burn):
+        driving.advance(dt)
+    power = [ ]
+    for n in range(nsteps):
+        driving.advance(dt)
+        power.append(driving.total_power(actual=True))
+    return np.mean(power) * (1.0 - 0.5 * driving.theta * dt)
+
+
+def test_driving2d_solenoidal():
+    for shape in [(32, 32), (24, 17)]:
+        driving = DrivingModule2d(shape)
+        for n in range(5):
+            driving.advance(0.1)
+        G = transforms(driving.field)
+        Kx, Ky = wavenumbers(shape)
+        div = Kx * G[0] + Ky * G[1]
+        assert abs(div).max() < 1e-12 * abs(G).max(), shape
+
+
+def test_driving2d_field_cache():
+    driving = DrivingModule2d((16, 16))
+    driving.advance(0.1)
+    F = driving.field
+    assert driving.field is F
+    driving.advance(0.1)
+    assert driving.field is not F
+    assert driving.field[0].shape == (16, 16)
+
+
+def test_driving2d_steady_power():
+    driving = DrivingModule2d((32, 32), rms=2.0)
+    expected = driving.total_power()
+    assert abs(steady_power(driving) / expected - 1.0) < 0.1
+
+
+def advanced_sparse(shape, nsteps=5, **kwargs):
+    driving = SparseDrivingModule(shape, **kwargs)
+    for n in range(nsteps):
+        driving.advance(0.1)
+    return driving
+
+
+def test_sparse_solenoidal():
+    for shape in [(32, 32), (24, 17), (16, 16, 16), (12, 15, 10)]:
+        G = transforms(advanced_sparse(shape).field)
+        K = wavenumbers(shape)
+        div = sum(k * g for k, g in zip(K, G))
+        assert abs(div).max() < 1e-12 * abs(G).max(), shape
+
+
+def test_sparse_compressive():
+    shape = (16, 12, 14)
+    G = transforms(advanced_sparse(shape, solenoidal=0.0).field)
+    K = wavenumbers(shape)
+    for i, j in [(0, 1), (1, 2), (2, 0)]:
+        curl = K[i] * G[j] - K[j] * G[i]
+        assert abs(curl).max() < 1e-12 * abs(G).max()
+    div = sum(k * g for k, g in zip(K, G))
+    assert abs(div).max() > 1e-3 * abs(G).max()
+
+
+def test_sparse_band_limited():
+    threshold = 1e-3
+    for shape in [(64, 64), (24, 32, 20)]:
+        driving = advanced_sparse(shape, threshold=threshold)
+        G = transforms(driving.field)
+        K = wavenumbers(shape, derivative=False)
+        k = sum(k**2 for k in K)**0.5
+        k0 = driving.k0
+        inside = spectral_profile(k, k0) > threshold * spectral_profile(2*k0, k0)
+        for k in K:
+            inside &= abs(k) != 0.5 # Nyquist modes are not evolved
+        power = (abs(G)**2).sum(axis=0)
+        assert driving.number_of_modes == inside.sum()
+        assert power[~inside].max() < 1e-24 * power.max(), shape
+        assert (power[inside] > 0.0).sum() == driving.number_of_modes
+
+
+def test_sparse_field_cache():
+    driving = advanced_sparse((16, 16))
+    F = driving.field
+    assert driving.field is F
+    driving.advance(0.1)
+    assert driving.field is not F
+    assert len(driving.field) == 2 and driving.field[0].shape == (16, 16)
+
+
+def test_sparse_power():
+    # With a small threshold, nearly all of the power of the full spectrum is
+    # carried by the evolved modes
+    for shape in [(32, 32), (16, 16, 16)]:
+        driving = SparseDrivingModule(shape, rms=2.0)
+        assert abs(driving.total_power() / 4.0 - 1.0) < 1e-3
+        assert abs(steady_power(driving) / driving.total_power() - 1.0) < 0.1
+    full = DrivingModule2d((32, 32), rms=2.0)
+    assert abs(SparseDrivingModule((32, 32), rms=2.0).total_power() /
+               full.total_power() - 1.0) < 1e-3
+
+
+def test_sparse_dimensions():
+    try:
+        SparseDrivingModule((32,))
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
@@ -0,0 +1,102 @@
+"""
+Tests of the cached grid geometry, against quantities computed directly on a
+dense coordinate grid.
+"""
+
+import numpy as np
+from pyfish.geometry import Geometry
+from pyfish.gravity import StaticCentralGravity
+
+
+def make_geometry():
+    x = np.linspace(-1.0, 1.0, 8)
+    y = np.linspace(-0.55, 0.65, 5)
+    z = np.linspace(-0.3, 0.45, 6)
+    return Geometry(x, y, z)
+
+
+def test_grid():
+    geom = make_geometry()
+    X, Y, Z = np.meshgrid(*geom.axes, indexing='ij')
+    grid = geom.grid()
+    assert grid.shape == (3, 8, 5, 6)
+    assert (grid[0] == X).all() and (grid[1] == Y).all() and \
+        (grid[2] == Z).all()
+    assert [S.shape for S in geom.sparse] == [(8, 1, 1), (1, 5, 1), (1, 1, 6)]
+    assert geom.grid() is not grid
+
+
+def test_derived_fields():
+    geom = make_geometry()
+    X, Y, Z = geom.grid()
+    r2 = X**2 + Y**2 + Z**2
+    r = r2**0.5
+    assert abs(geom.radius2 - r2).max() < 1e-14
+    assert abs(geom.radius - r).max() < 1e-14
+    assert abs(geom.inverse_radius2 - 1.0 / r2).max() < 1e-10
+    rhat = np.array([X / r, Y / r, Z / r])
+    assert abs(geom.rhat - rhat).max() < 1e-14
+    assert abs((geom.rhat**2).sum(axis=0) - 1.0).max() < 1e-14
+    assert abs(geom.rhat_over_r2 - rhat / r2).max() < 1e-10
+
+
+def test_central_force():
+    geom = make_geometry()
+    X, Y, Z = geom.grid()
+    r = (X**2 + Y**2 + Z**2)**0.5
+    F, phi = geom.central_force(G=2.0, M=0.5)
+    assert abs(phi + 1.0 / r).max() < 1e-12
+    for d, A in enumerate([X, Y, Z]):
+        assert abs(F[d] + A / r**3).max() < 1e-10
+
+
+def test_memoize():
+    geom = make_geometry()
+    assert geom.radius is geom.radius
+    assert geom.rhat is geom.rhat
+    assert geom.central_force(1.0, 2.0)[0] is geom.central_force(1.0, 2.0)[0]
+    assert geom.central_force(1.0, 2.0)[0] is not \
+        geom.central_force(1.0, 3.0)[0]
+    calls = [ ]
+    compute = lambda: calls.append(1) or len(calls)
+    assert geom.memoize('key', compute) == 1
+    assert geom.memoize('key', compute) == 1
+    assert len(calls) == 1
+
+
+class Fluid(object):
+    def __init__(self, P):
+        self.shape = P.shape[:-1]
+        self.primitive = P
+
+
+class Mara(object):
+    def __init__(self, P, geometry):
+        self.fluid = Fluid(P)
+        self.geometry = geometry
+
+
+def test_static_central_gravity():
+    geom = make_geometry()
+    np.random.seed(4)
+    P = np.random.rand(*geom.shape + (5,)) + 0.5
+    mara = Mara(P, geom)
+    S, phi = StaticCentralGravity(G=1.5, M=2.0).source_terms(mara, retphi=True)
+
+    X, Y, Z = geom.grid()
+    r = (X**2 + Y**2 + Z**2)**0.5
+    f = [-1.5 * 2.0 * A / r**3 for A in [X, Y, Z]]
+    rho = P[...,0]
+    assert abs(phi + 3.0 / r).max() < 1e-12
+    assert (S[...,0] == 0.0).all()
+    assert abs(S[...,1] - rho * (f[0]*P[...,2] + f[1]*P[...,3] +
+                                 f[2]*P[...,4])).max() < 1e-10
+    for d in range(3):
+        assert abs(S[...,2+d] - rho * f[d]).max() < 1e-10
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
@@ -0,0 +1,249 @@
+"""
+Tests of the gravity solvers against the complex-FFT solutions they replaced.
+"""
+
+import numpy as np
+from numpy.fft import fftfreq, fftn, ifftn
+from pyfish.gravity import PoissonSolver, PoissonSolver1d, \
+    SelfGravitySourceTerms, EnclosedMassMonopoleGravity
+from pyfish.geometry import Geometry
+
+
+class Fluid(object):
+    def __init__(self, P):
+        self.shape = P.shape[:-1]
+        self.primitive = P
+
+
+class Mara(object):
+    """
+    The parts of the evolution operator which the source terms use, for a
+    fluid of primitives P including ng guard zones, whose zones are centered
+    on the cube [-1, 1]^3.
+    """
+    def __init__(self, P, ng=3):
+        self.fluid = Fluid(P)
+        self.ng = ng
+        axes = [(np.arange(N) + 0.5) * (2.0 / N) - 1.0 for N in P.shape[:3]]
+        self.dx, self.dy, self.dz = [2.0 / N for N in P.shape[:3]]
+        self.geometry = Geometry(*axes)
+
+    def number_guard_zones(self):
+        return self.ng
+
+
+def complex_poisson(rho, L=1.0, four_pi_G=1.0):
+    """
+    The solution of del^2 phi = four_pi_G (rho - <rho>) and its gradient by
+    complex transforms, as the original PoissonSolver1d found it in 1d. L is
+    the length of the domain, one for all axes or one for each.
+    """
+    ndim = rho.ndim
+    lengths = L if np.iterable(L) else [L] * ndim
+    K = [fftfreq(N).reshape([-1 if e == d else 1 for e in range(ndim)]) *
+         (2*np.pi*N/l) for d, (N, l) in enumerate(zip(rho.shape, lengths))]
+    k2 = sum(k**2 for k in K)
+    k2.flat[0] = 1.0
+    phihat = four_pi_G * fftn(rho) / -k2
+    phihat.flat[0] = 0.0
+    soln = np.zeros(rho.shape + (4,))
+    soln[...,0] = ifftn(phihat).real
+    for d in range(ndim):
+        soln[...,1+d] = ifftn(1.j * K[d] * phihat).real
+    return soln
+
+
+def complex_self_gravity(mara, G=1.0):
+    """
+    The self-gravity source terms and potential by complex transforms, as the
+    original SelfGravitySourceTerms found them.
+    """
+    ng = mara.number_guard_zones()
+    interior = (slice(ng, -ng),) * 3
+    P = mara.fluid.primitive[interior]
+    rho = P[...,0]
+    K = [fftfreq(N).reshape([-1 if e == d else 1 for e in range(3)]) *
+         (2*np.pi*N) for d, N in enumerate(rho.shape)]
+    delsq = -(K[0]**2 + K[1]**2 + K[2]**2)
+    delsq[0,0,0] = 1.0
+    phihat = (4*np.pi*G) * fftn(rho) / delsq
+    f = [-ifftn(1.j * k * phihat).real for k in K]
+    S = np.zeros(mara.fluid.shape + (5,))
+    S[interior + (1,)] = rho * (f[0]*P[...,2] + f[1]*P[...,3] + f[2]*P[...,4])
+    for d in range(3):
+        S[interior + (2+d,)] = rho * f[d]
+    return S, ifftn(phihat).real
+
+
+def random_density(shape):
+    np.random.seed(2)
+    return 1.0 + np.random.rand(*shape)
+
+
+def test_poisson_matches_complex_transforms():
+    for shape in [(32,), (33,), (16, 12), (15, 9), (8, 6, 10), (7, 8, 5)]:
+        rho = random_density(shape)
+        solver = PoissonSolver()
+        solver.four_pi_G = 4 * np.pi
+        soln, rhobar = solver.solve(rho, retrhobar=True)
+        assert soln.shape == shape + (4,)
+        assert abs(rhobar - rho.mean()) < 1e-12
+        expected = complex_poisson(rho, four_pi_G=4 * np.pi)
+        assert abs(soln - expected).max() < 1e-12, shape
+
+
+def test_poisson_analytic():
+    # del^2 phi = cos(2 pi x) cos(4 pi y) on the unit square
+    N = 32
+    x = (np.arange(N) + 0.5) / N
+    X, Y = np.meshgrid(x, x, indexing='ij')
+    k2 = (2*np.pi)**2 + (4*np.pi)**2
+    rho = np.cos(2*np.pi*X) * np.cos(4*np.pi*Y)
+    soln = PoissonSolver().solve(rho)
+    assert abs(soln[...,0] + rho / k2).max() < 1e-12
+    assert abs(soln[...,1] - 2*np.pi * np.sin(2*np.pi*X) *
+               np.cos(4*np.pi*Y) / k2).max() < 1e-12
+    assert abs(soln[...,2] - 4*np.pi * np.cos(2*np.pi*X) *
+               np.sin(4*np.pi*Y) / k2).max() < 1e-12
+    assert (soln[...,3] == 0.0).all()
+
+
+def test_poisson_domain_lengths():
+    rho = random_density((12, 9, 10))
+    solver = PoissonSolver()
+    for L in [3.0, [2.0, 0.5, 1.5]]:
+        solver.L = L
+        assert abs(solver.solve(rho) - complex_poisson(rho, L=L)).max() \
+            < 1e-12
+
+
+def test_poisson_difference_gradient():
+    rho = random_density((32,))
+    solver = PoissonSolver1d()
+    solver.gradient_method = 'difference'
+    soln = solver.solve(rho)
+    expected = complex_poisson(rho)
+    assert abs(soln[...,0] - expected[...,0]).max() < 1e-12
+    assert abs(soln[...,1] - np.gradient(expected[...,0], 1.0 / 32)).max() \
+        < 1e-12
+
+
+def test_poisson_out_and_kernel_cache():
+    rho = random_density((10, 8))
+    solver = PoissonSolver()
+    G = np.ones((16, 14, 4))
+    soln = solver.solve(rho, out=G[3:-3,3:-3])
+    assert soln.base is G
+    assert abs(G[3:-3,3:-3] - complex_poisson(rho)).max() < 1e-12
+    assert (G[:3] == 1.0).all() and (G[:,:3] == 1.0).all()
+    assert solver.kernel((10, 8)) is solver.kernel((10, 8))
+    K, green = solver.kernel((10, 8))
+    solver.four_pi_G = 2.0
+    assert solver.kernel((10, 8))[1] is not green
+
+
+def random_primitive(shape):
+    np.random.seed(3)
+    P = np.random.rand(*shape + (5,)) - 0.5
+    P[...,0] += 1.5
+    return P
+
+
+def test_self_gravity_matches_complex_transforms():
+    for shape in [(14, 14, 14), (13, 16, 11)]:
+        mara = Mara(random_primitive(shape))
+        for num_threads in [1, 3]:
+            sg = SelfGravitySourceTerms(G=0.7, num_threads=num_threads)
+            S, phi = sg.source_terms(mara, retphi=True)
+            S0, phi0 = complex_self_gravity(mara, G=0.7)
+            assert abs(S - S0).max() < 1e-12, shape
+            assert abs(phi - phi0).max() < 1e-12, shape
+            assert abs(sg.source_terms(mara) - S0).max() < 1e-12
+
+
+def test_self_gravity_out():
+    mara = Mara(random_primitive((12, 10, 14)))
+    S0, phi0 = complex_self_gravity(mara)
+    S = np.ones(mara.fluid.shape + (5,))
+    assert SelfGravitySourceTerms().source_terms(mara, out=S) is S
+    interior = (slice(3, -3),) * 3
+    assert abs(S[interior] - S0[interior]).max() < 1e-12
+    assert (S[:3] == 1.0).all() and (S[:,:,-3:] == 1.0).all()
+
+
+def enclosed_mass(mara, S, G):
+    """
+    The enclosed mass implied by monopole source terms S, which are
+    -G M(r) rho rhat / r^2 in the momentum components.
+    """
+    rho = mara.fluid.primitive[...,0]
+    geom = mara.geometry
+    f = sum(S[...,2+d] * geom.rhat[d] for d in range(3))
+    return -f * geom.radius2 / (G * rho)
+
+
+def direct_enclosed_mass(mara, radii):
+    """
+    The mass in the zones at radii less than each of radii, summed directly.
+    """
+    rho = mara.fluid.primitive[...,0].ravel()
+    r = mara.geometry.radius.ravel()
+    dV = mara.dx * mara.dy * mara.dz
+    return np.array([rho[r < r0].sum() * dV for r0 in np.ravel(radii)])
+
+
+def test_monopole_matches_direct_sum():
+    mara = Mara(random_primitive((16, 16, 16)))
+    r = mara.geometry.radius
+    rmax = r.max() * (1 + 1e-12)
+    for nbins in [4, 10, 25]:
+        S = EnclosedMassMonopoleGravity(G=0.5, nbins=nbins).source_terms(mara)
+        M = enclosed_mass(mara, S, 0.5)
+        # Between the bin edges, M(r) is interpolated linearly from the mass
+        # enclosed by each edge
+        edges = np.linspace(0.0, rmax, nbins + 1)
+        Medges = direct_enclosed_mass(mara, edges)
+        u = r * (nbins / rmax)
+        i = u.astype(int)
+        expected = Medges[i] + (u - i) * (Medges[i + 1] - Medges[i])
+        assert abs(M - expected).max() < 1e-10 * Medges[-1], nbins
+        assert (S[...,0] == 0.0).all()
+        P = mara.fluid.primitive
+        assert abs(S[...,1] - (S[...,2:5] * P[...,2:5]).sum(axis=-1)).max() \
+            < 1e-12
+
+
+def test_monopole_within_a_shell_of_direct_sum():
+    # The mass below each zone, summed directly, and the interpolated mass
+    # both lie between the masses enclosed by the edges of the zone's bin
+    mara = Mara(random_primitive((12, 12, 12)))
+    r = mara.geometry.radius
+    direct = direct_enclosed_mass(mara, r.ravel()).reshape(r.shape)
+    for nbins in [4, 16, 64]:
+        grav = EnclosedMassMonopoleGravity(nbins=nbins)
+        M = enclosed_mass(mara, grav.source_terms(mara), 1.0)
+        index = grav.bins(mara)[0]
+        edges = np.linspace(0.0, r.max() * (1 + 1e-12), nbins + 1)
+        shell = np.diff(direct_enclosed_mass(mara, edges))
+        shell = shell[index].reshape(r.shape)
+        assert (abs(M - direct) <= shell * (1 + 1e-10)).all(), nbins
+
+
+def test_monopole_rmax():
+    mara = Mara(random_primitive((12, 12, 12)))
+    r = mara.geometry.radius
+    grav = EnclosedMassMonopoleGravity(nbins=5, rmax=0.8)
+    M = enclosed_mass(mara, grav.source_terms(mara), 1.0)
+    Mmax = direct_enclosed_mass(mara, [0.8])[0]
+    # Mass beyond rmax is not counted
+    assert abs(M[r >= 0.8] - Mmax).max() < 1e-10 * Mmax
+    assert (M[r < 0.8] <= Mmax * (1 + 1e-12)).all()
+    # The bins are kept with the geometry
+    assert grav.bins(mara) is grav.bins(mara)
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
@@ -0,0 +1,97 @@
+"""
+Tests of the Runge-Kutta integrators on the linear system dU/dt = M U, whose
+exact solution is known, comparing the 2N-storage schemes with the classic
+ones.
+"""
+
+import numpy as np
+from pyfish.integrators import build_integrator
+
+
+# A damped oscillation, as two uncoupled 2x2 blocks, on a grid of shape (4, 4)
+M = np.array([[-0.1, 1.0, 0.0, 0.0],
+              [-1.0, -0.1, 0.0, 0.0],
+              [0.0, 0.0, -0.5, 0.3],
+              [0.0, 0.0, -0.3, -0.5]])
+
+
+def dUdt(U, out=None):
+    out[...] = np.dot(U, M.T)
+    return out
+
+
+def initial_state():
+    return np.linspace(0.5, 2.0, 64).reshape(4, 4, 4)
+
+
+def exact_solution(t):
+    w, V = np.linalg.eig(M)
+    E = np.dot(V * np.exp(w * t), np.linalg.inv(V)).real
+    return np.dot(initial_state(), E.T)
+
+
+def integrate(rk, t, nsteps):
+    integrator = build_integrator(rk)
+    U = initial_state()
+    for n in range(nsteps):
+        integrator.advance(U, t / nsteps, dUdt)
+    return U
+
+
+def error(rk, t, nsteps):
+    return abs(integrate(rk, t, nsteps) - exact_solution(t)).max()
+
+
+def convergence_order(rk, t=2.0, nsteps=20):
+    return np.log2(error(rk, t, nsteps) / error(rk, t, 2 * nsteps))
+
+
+def test_classic_orders():
+    for rk in [1, 2, 3, 4]:
+        assert abs(convergence_order(rk) - rk) < 0.2, rk
+
+
+def test_low_storage_orders():
+    assert abs(convergence_order('ls3') - 3) < 0.2
+    assert abs(convergence_order('ls4') - 4) < 0.2
+
+
+def test_ls3_matches_rk3():
+    # Every three stage, third order scheme applies the same polynomial
+    # 1 + z + z^2/2 + z^3/6 of dt M to a linear system
+    U3 = integrate(3, 2.0, 20)
+    L3 = integrate('ls3', 2.0, 20)
+    assert abs(U3 - L3).max() < 1e-12
+
+
+def test_ls4_matches_rk4():
+    # The five stage scheme differs from the classic one at fifth order in dt
+    for nsteps in [20, 40]:
+        U4 = integrate(4, 2.0, nsteps)
+        L4 = integrate('ls4', 2.0, nsteps)
+        assert abs(U4 - L4).max() < error(4, 2.0, nsteps)
+
+
+def test_storage():
+    for rk, nreg in [(1, 1), (2, 2), (3, 2), (4, 3), ('ls3', 2), ('ls4', 2)]:
+        integrator = build_integrator(rk)
+        U = initial_state()
+        integrator.advance(U, 0.1, dUdt)
+        integrator.advance(U, 0.1, dUdt)
+        assert integrator.storage() == nreg, rk
+
+
+def test_unknown_scheme():
+    try:
+        build_integrator('ls5')
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError"
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"
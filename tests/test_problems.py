@@ -0,0 +1,99 @@
+"""
+Tests of the array-valued initial conditions in pyfish.problems: each must
+match its per-point original, and array_initializer must only pick a companion
+defined alongside the function it replaces.
+"""
+
+import numpy as np
+from pyfish import problems
+from pyfish.problems import array_initializer
+
+
+def coordinates(shape=(13, 7, 5)):
+    # The axes pass through 0, and through the edges of the profiles below
+    axes = [np.linspace(-0.6, 0.6, n) for n in shape]
+    return np.meshgrid(*axes, indexing='ij')
+
+
+def check_companion(f, nq):
+    """
+    Evaluates f point by point and through its companion, on a small grid.
+    """
+    fa = array_initializer(f)
+    assert fa is not None, f.__name__
+    X, Y, Z = coordinates()
+    expected = np.array([f(x, y, z) for x, y, z in zip(X.flat, Y.flat, Z.flat)])
+    result = fa(X, Y, Z)
+    assert result.shape == X.shape + (nq,), f.__name__
+    assert np.allclose(result, expected.reshape(X.shape + (nq,)),
+                       rtol=1e-14, atol=0.0), f.__name__
+
+
+def check_problem(problem):
+    descr = problem.fluid_descriptor
+    check_companion(problem.pinit, descr.nprimitive)
+    if descr.ngravity:
+        check_companion(problem.ginit, descr.ngravity)
+
+
+def test_problem_companions():
+    check_problem(problems.OneDimensionalUpsidedownGaussian())
+    for floor_fix in [True, False]:
+        check_problem(problems.OneDimensionalPolytrope(selfgrav=False,
+                                                       floor_fix=floor_fix))
+    check_problem(problems.PeriodicDensityWave())
+    for direction in ['x', 'y', 'z']:
+        check_problem(problems.BrioWuShocktube(direction=direction))
+    for geometry in ['cylindrical', 'spherical']:
+        check_problem(problems.BrioWuShocktube(geometry=geometry))
+    check_problem(problems.DrivenTurbulence2d(resolution=[8, 8]))
+    check_problem(problems.DrivenTurbulence3d(resolution=[8, 8, 8]))
+
+
+def test_module_companions():
+    check_companion(problems.polytrope3d, 5)
+    check_companion(problems.central_mass3d, 5)
+    # the static polytrope potential has no companion
+    assert array_initializer(problems.ginit) is None
+    assert array_initializer(lambda x, y, z: [x, y, z]) is None
+
+
+class GaussianOverridingPinit(problems.OneDimensionalUpsidedownGaussian):
+    def pinit(self, x, y, z):
+        return [2.0, 1.0, 0.0, 0.0, 0.0]
+
+
+class GaussianOverridingBoth(problems.OneDimensionalUpsidedownGaussian):
+    def pinit(self, x, y, z):
+        return [2.0, 1.0, 0.0, 0.0, 0.0]
+
+    def pinit_array(self, X, Y, Z):
+        return problems._stack(X, 2.0, 1.0, 0.0, 0.0, 0.0)
+
+
+class GaussianInheriting(problems.OneDimensionalUpsidedownGaussian):
+    sig = 0.1
+
+
+def test_companion_follows_mro():
+    # overriding only pinit must not pick up the inherited pinit_array
+    problem = GaussianOverridingPinit()
+    assert array_initializer(problem.pinit) is None
+    check_companion(problem.ginit, 4)
+
+    problem = GaussianOverridingBoth()
+    assert array_initializer(problem.pinit).__func__ is \
+        GaussianOverridingBoth.pinit_array.__func__
+    check_problem(problem)
+
+    problem = GaussianInheriting()
+    assert array_initializer(problem.pinit).__func__ is \
+        problems.OneDimensionalUpsidedownGaussian.pinit_array.__func__
+    check_problem(problem)
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, "passed"